@@ -0,0 +1,105 @@
+"""警告音の非同期再生モジュール"""
+import logging
+import threading
+
+from metrics import metrics
+from utils import play_beep, prepare_beep
+
+logger = logging.getLogger(__name__)
+
+
+class AlertPlayer:
+    """警告音を専用のワーカースレッドで再生するクラス
+    
+    play()はすぐに戻るため、警告音の長さに関係なく監視ループはメールのチェックを続けられる。
+    再生中に届いた警告は今の再生にまとめ（重ねて鳴らしたり後から鳴らし直したりしない）、
+    stop()で再生中の警告音をすぐに止められる。
+    """
+    
+    def __init__(self, duration=10.0, cache_dir=None, prepare=False):
+        """
+        Args:
+            duration: 警告音の秒数
+            cache_dir: 波形キャッシュ（.npy）の保存先
+            prepare: ワーカースレッドで警告音の波形を先に用意しておくか
+                （numpy・simpleaudioの読み込みと波形の生成を、起動を待たせずに済ませる）
+        """
+        self.duration = duration
+        self.cache_dir = cache_dir
+        # 再生を要求された警告音の秒数（ルールごとの秒数で鳴らしても既定の秒数は変えない）
+        self._play_duration = duration
+        self.coalesced_count = 0
+        self._lock = threading.Lock()
+        self._request = threading.Event()
+        self._stop_playback = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._closed = False
+        self._prepare = prepare
+        self._thread = threading.Thread(target=self._run, name='alert-player', daemon=True)
+        self._thread.start()
+    
+    def play(self, duration=None):
+        """警告音の再生を要求（再生の終了を待たずに戻る）
+        
+        Args:
+            duration: 今回の警告音の秒数（省略時は作成時の値）
+        
+        Returns:
+            新たに再生を開始した場合はTrue、再生中の警告音にまとめた場合はFalse
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            if not self._idle.is_set():
+                self.coalesced_count += 1
+                logger.info("警告音を再生中のため、今回の警告は再生中の警告音にまとめました")
+                return False
+            self._play_duration = self.duration if duration is None else duration
+            self._stop_playback.clear()
+            self._idle.clear()
+            self._request.set()
+            return True
+    
+    def stop(self):
+        """再生中（または再生待ち）の警告音をすぐに止める"""
+        with self._lock:
+            self._stop_playback.set()
+    
+    def is_playing(self):
+        """警告音を再生中（または再生待ち）か"""
+        return not self._idle.is_set()
+    
+    def wait_done(self, timeout=None):
+        """再生が終わるまで待つ（--onceモードなど、終了前に鳴らし切りたい場合）"""
+        return self._idle.wait(timeout)
+    
+    def close(self):
+        """再生を止めてワーカースレッドを終了"""
+        with self._lock:
+            self._closed = True
+            self._stop_playback.set()
+            self._request.set()
+        self._thread.join(timeout=2)
+    
+    def _run(self):
+        """ワーカースレッド: 再生要求を待って警告音を鳴らす"""
+        if self._prepare:
+            prepare_beep(self.duration, self.cache_dir)
+        while True:
+            self._request.wait()
+            with self._lock:
+                self._request.clear()
+                if self._closed:
+                    self._idle.set()
+                    return
+                duration = self._play_duration
+            try:
+                # 再生待ちの間にstop()された場合は鳴らさない
+                if not self._stop_playback.is_set():
+                    with metrics.span('playback'):
+                        play_beep(duration=duration, cache_dir=self.cache_dir, stop_event=self._stop_playback)
+            except Exception as e:
+                logger.error(f"警告音の再生エラー: {e}")
+            finally:
+                self._idle.set()
@@ -0,0 +1,627 @@
+"""asyncio版のGmail監視モジュール
+
+GmailMonitorと同じ検索・判定処理を、imaplibではなくasyncioのストリーム上で行う。
+1つのイベントループで多数のメールボックスの接続・IDLE待機・タイマー・停止要求を
+まとめて扱えるため、監視対象ごとにOSスレッドを用意する必要がない。
+
+使用例:
+    monitor = AsyncGmailMonitor(config_manager)
+    await monitor.connect()
+    matched = await monitor.check_new_mail()
+    await monitor.wait_for_new_mail(30, stop_event)
+    await monitor.disconnect()
+"""
+import asyncio
+import re
+import ssl
+import time
+import logging
+
+from gmail_monitor import (
+    BaseMailMonitor, IDLE_RENEW_SECONDS, INTERNALDATE_FETCH_ITEMS, HEADER_FETCH_ITEMS,
+    _quote, _uid_set,
+)
+from imap_connection import DEFAULT_NOOP_INTERVAL, DEFAULT_TIMEOUT, get_ssl_context
+from imap_utils import encode_mailbox_name, get_response_size, parse_fetch_response
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# StreamReaderのバッファの上限（UID SEARCHの応答は件数分のUIDが1行に並ぶため、既定の64KiBより大きくする）
+STREAM_LIMIT = 1024 * 1024
+
+_LITERAL_RE = re.compile(rb'\{(\d+)\}$')
+_UNTAGGED_RE = re.compile(rb'\* (?:(\d+) )?([A-Za-z-]+) ?(.*)$', re.DOTALL)
+_RESPONSE_CODE_RE = re.compile(rb'\[([A-Za-z-]+)(?: ([^\]]*))?\]')
+
+
+class ImapError(Exception):
+    """IMAPコマンドの失敗（NO / BAD）"""
+
+
+class ImapAbort(ImapError):
+    """接続の切断など、セッションを続行できないエラー"""
+
+
+class AsyncImapClient:
+    """asyncioストリーム上の最小限のIMAP4rev1クライアント
+    
+    応答データはimaplibと同じ形（リテラルは (行, 本体) のタプル）で返すため、
+    parse_fetch_response等の解析処理をそのまま使える。
+    """
+    
+    def __init__(self, reader, writer, timeout=None):
+        """
+        Args:
+            reader / writer: 接続済みのストリーム
+            timeout: 応答を待つ最大秒数（Noneで無制限、IDLEの通知待ちには適用しない）
+        """
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.capabilities = ()
+        self.untagged_responses = {}
+        self.last_response = time.monotonic()
+        self._tag_number = 0
+    
+    @classmethod
+    async def open(cls, host, port, use_ssl=True, timeout=None, capabilities=None, ssl_context=None):
+        """接続してサーバーの挨拶とCAPABILITYを受け取る
+        
+        capabilitiesを渡した場合（再接続時）はCAPABILITYの問い合わせを省く。
+        ssl_contextを省略した場合は共有のSSLContext（システムの証明書で検証）を使う。
+        """
+        if use_ssl:
+            ssl_context = ssl_context or get_ssl_context()
+        else:
+            ssl_context = None
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port, ssl=ssl_context, limit=STREAM_LIMIT), timeout
+            )
+        except asyncio.TimeoutError:
+            raise ImapAbort(f"{timeout}秒以内に接続できませんでした")
+        client = cls(reader, writer, timeout)
+        greeting = await client._read_response()
+        if not _head(greeting).startswith(b'* OK'):
+            writer.close()
+            raise ImapAbort(f"サーバーの応答が不正です: {_head(greeting)!r}")
+        if capabilities:
+            client.capabilities = capabilities
+        else:
+            await client.refresh_capabilities()
+        return client
+    
+    async def refresh_capabilities(self):
+        """CAPABILITYを取得し直す（ログイン後に増える場合がある）"""
+        _, data = await self.command('CAPABILITY')
+        self.capabilities = tuple((data[-1] or b'').decode('ascii', 'replace').upper().split()) if data else ()
+    
+    def response(self, name):
+        """タグ無し応答のデータを取り出す（imaplibのresponse()と同じ）"""
+        return name, self.untagged_responses.pop(name.upper(), [None])
+    
+    async def _wait(self, awaitable, timeout):
+        """timeout秒以内に応答が無ければImapAbortにする"""
+        if timeout is None:
+            return await awaitable
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            raise ImapAbort(f"{timeout}秒以内に応答がありません")
+    
+    async def _readline(self, timeout=None):
+        line = await self._wait(self._read_line(), timeout)
+        if not line:
+            raise ImapAbort("サーバーが接続を切断しました")
+        self.last_response = time.monotonic()
+        return line.rstrip(b'\r\n')
+    
+    async def _read_line(self):
+        """改行までを読み取る（StreamReaderの上限を超える長い行は分けて読み取り、つなげて返す）"""
+        chunks = []
+        while True:
+            try:
+                chunks.append(await self.reader.readuntil(b'\n'))
+            except asyncio.IncompleteReadError as e:
+                # 接続が切断された（読み取れた分だけ返す）
+                chunks.append(e.partial)
+            except asyncio.LimitOverrunError as e:
+                # 上限を超えた分はバッファに残っているので、その長さだけ読み取って続きを待つ
+                chunk = await self.reader.readexactly(e.consumed)
+                chunks.append(chunk)
+                if not chunk.endswith(b'\n'):
+                    continue
+            return b''.join(chunks)
+    
+    async def _read_response(self):
+        """1応答分を読み取る（リテラルを含む場合は (行, 本体) のタプルが並ぶ）"""
+        parts = []
+        while True:
+            line = await self._readline(self.timeout)
+            match = _LITERAL_RE.search(line)
+            if not match:
+                parts.append(line)
+                return parts
+            literal = await self._wait(self.reader.readexactly(int(match.group(1))), self.timeout)
+            parts.append((line, literal))
+    
+    def _store_untagged(self, parts):
+        """タグ無し応答を名前ごとに保存"""
+        match = _UNTAGGED_RE.match(_head(parts))
+        if not match:
+            return
+        number, name, rest = match.groups()
+        name = name.upper().decode('ascii')
+        
+        if name == 'FETCH':
+            # imaplibと同様に「番号 (項目 ...」の形にしてリテラルごと保存する
+            first = b'%s %s' % (number, rest)
+            parts = [(first, parts[0][1]) if isinstance(parts[0], tuple) else first] + parts[1:]
+            self.untagged_responses.setdefault(name, []).extend(parts)
+            return
+        
+        if number is not None:
+            self.untagged_responses.setdefault(name, []).append(number)
+            return
+        
+        self.untagged_responses.setdefault(name, []).append(rest or None)
+        code = _RESPONSE_CODE_RE.match(rest or b'')
+        if name in ('OK', 'NO', 'BAD') and code:
+            key = code.group(1).upper().decode('ascii')
+            self.untagged_responses.setdefault(key, []).append(code.group(2))
+    
+    def _next_tag(self):
+        self._tag_number += 1
+        return b'A%04d' % self._tag_number
+    
+    async def command(self, name, *args, literal=None):
+        """コマンドを送信し、タグ付き応答まで読み取る
+        
+        Args:
+            name: コマンド名（UIDコマンドの場合は 'UID'）
+            args: 引数（文字列）
+            literal: 最後の引数として送るリテラル（bytes）
+        
+        Returns:
+            (状態, そのコマンドのタグ無し応答データのリスト)
+        """
+        tag = self._next_tag()
+        data_name = (args[0] if name.upper() == 'UID' else name).upper()
+        self.untagged_responses.pop(data_name, None)
+        
+        line = b' '.join([tag, name.encode('ascii')] + [a.encode('utf-8') for a in args])
+        if literal is not None:
+            line += b' {%d}' % len(literal)
+        self.writer.write(line + b'\r\n')
+        await self.writer.drain()
+        
+        if literal is not None:
+            parts = await self._read_response()
+            if not _head(parts).startswith(b'+'):
+                raise ImapError(f"リテラルの送信が拒否されました: {_head(parts)!r}")
+            self.writer.write(literal + b'\r\n')
+            await self.writer.drain()
+        
+        while True:
+            parts = await self._read_response()
+            head = _head(parts)
+            if head.startswith(b'* '):
+                if head.upper().startswith(b'* BYE') and name.upper() != 'LOGOUT':
+                    raise ImapAbort(f"サーバーが接続を終了しました: {head!r}")
+                self._store_untagged(parts)
+                continue
+            if head.startswith(tag + b' '):
+                status = head[len(tag) + 1:].split(b' ', 1)[0].decode('ascii', 'replace').upper()
+                if status not in ('OK', 'NO', 'BAD'):
+                    raise ImapAbort(f"不正な応答: {head!r}")
+                if status != 'OK' and name.upper() in ('LOGIN', 'SELECT', 'EXAMINE'):
+                    raise ImapError(f"{name} が失敗しました: {head!r}")
+                return status, self.untagged_responses.pop(data_name, [None])
+            logger.debug("想定外の応答を無視: %r", head)
+    
+    async def idle(self, timeout, stop_event=None):
+        """IMAP IDLE（RFC 2177）で新着メールの通知を待つ"""
+        tag = self._next_tag()
+        self.writer.write(tag + b' IDLE\r\n')
+        await self.writer.drain()
+        response = await self._readline()
+        if not response.startswith(b'+'):
+            raise ImapError(f"IDLEの開始に失敗しました: {response!r}")
+        logger.debug("IDLE開始")
+        
+        got_mail = False
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        stop_task = asyncio.ensure_future(stop_event.wait()) if stop_event else None
+        read_task = None
+        try:
+            while not got_mail:
+                remaining = deadline - loop.time()
+                if remaining <= 0 or (stop_event and stop_event.is_set()):
+                    break
+                if read_task is None:
+                    read_task = asyncio.ensure_future(self._readline())
+                waiting = {read_task, stop_task} if stop_task else {read_task}
+                await asyncio.wait(waiting, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not read_task.done():
+                    continue
+                line = read_task.result()
+                read_task = None
+                logger.debug("IDLE応答: %r", line)
+                if line.startswith(b'* BYE'):
+                    raise ImapAbort(f"サーバーが接続を終了しました: {line!r}")
+                if line.endswith((b'EXISTS', b'RECENT')):
+                    got_mail = True
+        finally:
+            # 読み取り待ちを取り消す（StreamReaderは読み取り途中のデータをバッファに残す）
+            for task in (read_task, stop_task):
+                if task and not task.done():
+                    task.cancel()
+                    try:
+                        await task
+                    except asyncio.CancelledError:
+                        pass
+        
+        self.writer.write(b'DONE\r\n')
+        await self.writer.drain()
+        # IDLE終了のタグ付き応答まで読み捨てる
+        while True:
+            line = await self._readline(self.timeout)
+            if line.startswith(tag + b' '):
+                if not line[len(tag) + 1:].startswith(b'OK'):
+                    raise ImapError(f"IDLEの終了に失敗しました: {line!r}")
+                break
+        return got_mail
+    
+    async def noop(self):
+        """NOOPを送り、新着メール（EXISTS）の通知があればTrueを返す"""
+        self.untagged_responses.pop('EXISTS', None)
+        status, _ = await self.command('NOOP')
+        if status != 'OK':
+            raise ImapAbort(f"NOOPが失敗しました: {status}")
+        return self.untagged_responses.pop('EXISTS', None) is not None
+    
+    async def close(self):
+        """ストリームを閉じる"""
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError, ssl.SSLError):
+            pass
+
+
+def _head(parts):
+    """応答の最初の行"""
+    first = parts[0]
+    return first[0] if isinstance(first, tuple) else first
+
+
+class AsyncGmailMonitor(BaseMailMonitor):
+    """asyncio版のGmail監視クラス（1アカウントの1メールボックスを監視）
+    
+    connect / check_new_mail / wait_for_new_mail / disconnect はGmailMonitorと同じ意味を持つ
+    コルーチン。停止要求はshould_stop関数の代わりにasyncio.Eventで受け取る。
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.client = None
+        # 最初の接続で得たCAPABILITY（再接続で使い回す）
+        self._cached_capabilities = None
+        # 先読みのタスクとチェック処理が同じ接続でコマンドを送るためのロック
+        self._command_lock = asyncio.Lock()
+    
+    async def connect(self):
+        """Gmailに接続（再接続では前回のCAPABILITYを使い回す）"""
+        email_addr = self.config_manager.get(self.account_section, 'email')
+        password = self.config_manager.get(self.account_section, 'password')
+        
+        # アプリパスワードのスペースを削除
+        password = password.replace(' ', '')
+        
+        # 接続先（通常はGmail。ローカルの偽IMAPサーバーで試験する場合に上書き）
+        host = self.config_manager.get(self.account_section, 'imap_host', 'imap.gmail.com')
+        port = int(self.config_manager.get(self.account_section, 'imap_port', '993'))
+        use_ssl = self.config_manager.get_bool(self.account_section, 'imap_ssl', True)
+        timeout = float(self.config_manager.get(self.account_section, 'imap_timeout', str(DEFAULT_TIMEOUT)))
+        cafile = self.config_manager.get(self.account_section, 'imap_cafile', '').strip() or None
+        
+        try:
+            logger.info("Gmailに接続中: %s", email_addr)
+            with metrics.span('connect', mailbox=self.name):
+                self.client = await AsyncImapClient.open(
+                    host, port, use_ssl, timeout if timeout > 0 else None, self._cached_capabilities,
+                    get_ssl_context(cafile),
+                )
+                await self.client.command('LOGIN', _quote(email_addr), _quote(password))
+                if not self._cached_capabilities:
+                    await self.client.refresh_capabilities()
+                    self._cached_capabilities = self.client.capabilities
+            logger.info("Gmail接続成功")
+            return True
+        except Exception as e:
+            metrics.increment('errors', mailbox=self.name, stage='connect')
+            if self.client:
+                await self.client.close()
+                self.client = None
+            logger.error("Gmail接続エラー: %s", e)
+            raise Exception(f"Gmail接続エラー: {str(e)}")
+    
+    async def disconnect(self):
+        """接続を切断"""
+        if self.client:
+            try:
+                logger.info("Gmail接続を切断中")
+                # メールボックスを選択している場合のみCLOSEを送る
+                if self.mailbox_selected:
+                    await self.client.command('CLOSE')
+                await self.client.command('LOGOUT')
+                logger.info("Gmail接続を切断しました")
+            except Exception as e:
+                logger.warning("切断時にエラー: %s", e)
+            await self._abandon_connection()
+    
+    async def _abandon_connection(self):
+        """LOGOUTを送らずに接続を閉じる（応答しない接続を待たずに捨てる）"""
+        if self.client:
+            await self.client.close()
+        self.client = None
+        self.mailbox_selected = False
+    
+    def _get_noop_interval(self):
+        return float(self.config_manager.get(self.account_section, 'noop_interval', str(DEFAULT_NOOP_INTERVAL)))
+    
+    async def ensure_connected(self):
+        """接続が無い場合や応答しなくなった場合に接続（常時接続モードでセッションを使い回す）
+        
+        しばらくやり取りが無かった接続はNOOPで確認し、応答が無ければ張り直す。
+        """
+        if self.client is not None and time.monotonic() - self.client.last_response >= self._get_noop_interval():
+            try:
+                await self.client.noop()
+            except (ImapError, OSError) as e:
+                logger.warning("接続が応答しません: %s", e)
+                logger.info("%s: 接続を張り直します", self.name)
+                await self._abandon_connection()
+        if self.client is None:
+            await self.connect()
+    
+    @property
+    def capabilities(self):
+        """サーバーのCAPABILITY（未接続なら空）"""
+        return self.client.capabilities if self.client else ()
+    
+    def supports_idle(self):
+        """IDLEで新着を待機できるか（設定で有効かつサーバーが対応）"""
+        return self.client is not None and super().supports_idle()
+    
+    async def wait_for_new_mail(self, poll_interval, stop_event=None):
+        """次のチェックまで待機
+        
+        IDLE対応サーバーでは新着通知を受けるまで（最長でpoll_interval秒とIDLE再発行周期の短い方まで）待機し、
+        非対応の場合は poll_interval 秒待機する。stop_eventがセットされると直ちに戻る。
+        ポーリングの待機中もnoop_intervalごとにNOOPを送り、接続を保つ（新着の通知があれば戻る）。
+        
+        Returns:
+            IDLE・NOOPで新着メールの通知を受けた場合はTrue
+        """
+        try:
+            if self.supports_idle() and self.mailbox_selected:
+                got_mail = await self.client.idle(min(poll_interval, IDLE_RENEW_SECONDS), stop_event)
+                if got_mail:
+                    logger.info("IDLEで新着メールの通知を受信しました")
+                return got_mail
+            return await self._poll_wait(poll_interval, stop_event)
+        except (ImapAbort, OSError):
+            await self._abandon_connection()
+            raise
+    
+    async def _poll_wait(self, poll_interval, stop_event):
+        """poll_interval秒待機（その間もnoop_intervalごとにNOOPを送る）"""
+        stop_event = stop_event or asyncio.Event()
+        noop_interval = self._get_noop_interval()
+        deadline = time.monotonic() + poll_interval
+        while not stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if self.client is not None:
+                until_noop = noop_interval - (time.monotonic() - self.client.last_response)
+                if until_noop <= 0:
+                    if await self.client.noop():
+                        logger.info("NOOPで新着メールの通知を受信しました")
+                        return True
+                    continue
+                remaining = min(remaining, until_noop)
+            try:
+                await asyncio.wait_for(stop_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        return False
+    
+    async def check_new_mail(self, time_window_minutes=None, first_only=False):
+        """未読メールをチェックし、条件に合致したメールのリスト（MatchResult）を返す
+        
+        first_onlyを指定すると最初に合致したメールで打ち切る（残りは次回のチェックで照合する）。
+        """
+        results = []
+        matches = self.iter_matches(time_window_minutes)
+        try:
+            async for result in matches:
+                results.append(result)
+                if first_only:
+                    break
+        finally:
+            await matches.aclose()
+        return results
+    
+    async def iter_matches(self, time_window_minutes=None):
+        """未読メールをチェックし、条件に合致したメールのMatchResultを見つかった順に返す
+        
+        GmailMonitor.iter_matchesと同じく、メールはチャンクごとに取得し、照合中に次のチャンクの
+        ヘッダーを先読みする（スレッドではなく同じイベントループ上のタスクで取得する）。
+        
+        Args:
+            time_window_minutes: 何分以内に受信したメールを対象とするか（省略時は設定値、デフォルト: 2分）
+        """
+        settings = self._load_settings()
+        if time_window_minutes is None:
+            time_window_minutes = settings.time_window_minutes
+        
+        started = time.monotonic()
+        match_count = 0
+        # 本文を取得できなかった最初のUID（処理済みUIDをこの手前で止め、次回のチェックで照合し直す）
+        retry_uid = None
+        try:
+            logger.info("メールチェック開始: %s", self.name)
+            
+            # メールボックスを選択
+            with metrics.span('select', mailbox=self.name):
+                await self.client.command('SELECT', _quote(encode_mailbox_name(self.mailbox)))
+            self.mailbox_selected = True
+            uidvalidity = self.uidvalidity = self._get_response_int('UIDVALIDITY')
+            uidnext = self._get_response_int('UIDNEXT')
+            
+            # 前回までに処理したUID（UIDVALIDITYが変わった場合や初回はNone）
+            last_uid = self.state.get_last_uid(self.name, uidvalidity)
+            
+            time_threshold = self._get_time_threshold(time_window_minutes)
+            sender_filter, keyword_filter = self._get_filters()
+            
+            criteria, literal = self._build_search_criteria(last_uid, time_threshold, sender_filter, keyword_filter)
+            logger.info("検索条件: %s%s", ' '.join(criteria), ' (+リテラル)' if literal else '')
+            with metrics.span('search', mailbox=self.name):
+                status, messages = await self.client.command('UID', 'SEARCH', *criteria, literal=literal)
+            if status != 'OK':
+                logger.warning("未読メール検索が失敗しました")
+                return
+            
+            mail_uids = self._get_new_uids(messages[-1], last_uid, time_threshold)
+            max_uid = await self._get_max_uid() if uidnext is None and last_uid is None else 0
+            new_last_uid = self._get_next_last_uid(last_uid, mail_uids, uidnext, max_uid)
+            
+            # Gmail以外では受信時刻（INTERNALDATE）だけを先に取得し、範囲外のメールはダウンロードしない
+            if mail_uids and not self._has_gmail_search():
+                with metrics.span('fetch', mailbox=self.name):
+                    status, msg_data = await self.client.command(
+                        'UID', 'FETCH', _uid_set(mail_uids), INTERNALDATE_FETCH_ITEMS
+                    )
+                metrics.increment('bytes_fetched', get_response_size(msg_data), mailbox=self.name)
+                if status == 'OK':
+                    mail_uids = self._get_uids_in_window(parse_fetch_response(msg_data), time_threshold)
+                else:
+                    logger.warning("受信時刻の一括取得に失敗しました")
+            
+            if not mail_uids:
+                logger.info("未読メールはありません")
+                self.state.set_last_uid(self.name, uidvalidity, new_last_uid)
+                return
+            
+            # 第1段階: ヘッダー・構造だけをチャンクごとに取得（BODY.PEEKのため既読にはならない）
+            chunks = self._get_fetch_chunks(mail_uids)
+            logger.info("メールのヘッダーを取得中: %d件（%d回に分けて取得）", len(mail_uids), len(chunks))
+            async for chunk, fetched in self._iter_header_chunks(chunks):
+                if fetched is None:
+                    logger.warning("メールヘッダーの一括取得に失敗しました")
+                    return
+                logger.info("ヘッダー取得完了: %d件（UID %s〜%s）", len(fetched), chunk[0], chunk[-1])
+                
+                # プロセスプールで解析する場合も、結果を待つ間は他の監視対象のコルーチンを動かす
+                with metrics.span('parse', mailbox=self.name):
+                    parsed = await self.parser.parse_headers_async(self._get_headers(fetched))
+                candidates = []
+                for result in self._evaluate_headers(
+                    fetched, parsed, time_threshold, time_window_minutes, started, candidates
+                ):
+                    match_count += 1
+                    yield result
+                
+                # 第2段階: 候補のメールだけ本文（text/plain）をパート番号ごとにまとめて取得
+                bodies, failed = await self._fetch_text_bodies(candidates)
+                texts = await self.parser.body_texts_async(bodies)
+                for result in self._evaluate_bodies(candidates, bodies, texts, failed, started):
+                    match_count += 1
+                    yield result
+                if failed and retry_uid is None:
+                    retry_uid = min(failed)
+                
+                # このチャンクは照合し終えたので処理済みUIDを進める
+                chunk_last_uid = new_last_uid if chunk is chunks[-1] else chunk[-1]
+                self.state.set_last_uid(self.name, uidvalidity, self._limit_last_uid(chunk_last_uid, retry_uid))
+            
+            if match_count:
+                logger.info("条件に合致したメール: %d件", match_count)
+            else:
+                logger.info("条件に合致するメールはありませんでした")
+        
+        except Exception as e:
+            metrics.increment('errors', mailbox=self.name, stage='check')
+            logger.error("メールチェックエラー: %s", e)
+            if isinstance(e, (ImapAbort, OSError)):
+                # 応答の無い接続にLOGOUTを送って待たないよう、ここで捨てる
+                await self._abandon_connection()
+            raise Exception(f"メールチェックエラー: {str(e)}")
+        finally:
+            self.seen.save()
+    
+    async def _fetch(self, uids, items):
+        """UID FETCHを実行して解析済みの結果を返す（失敗した場合はNone）
+        
+        先読みのタスクと同じ接続を使うため、コマンドはロックで1つずつ送る。
+        """
+        async with self._command_lock:
+            with metrics.span('fetch', mailbox=self.name):
+                status, msg_data = await self.client.command('UID', 'FETCH', _uid_set(uids), items)
+        metrics.increment('bytes_fetched', get_response_size(msg_data), mailbox=self.name)
+        if status != 'OK':
+            return None
+        return parse_fetch_response(msg_data)
+    
+    async def _iter_header_chunks(self, chunks):
+        """チャンクごとにヘッダーを取得し、(チャンク, 解析済みのFETCH結果) を順に返す
+        
+        呼び出し元が照合している間に次のチャンクを取得する。先読み中のコマンドは途中で
+        キャンセルすると応答の読み取りがずれるため、反復をやめた場合も完了を待ってから戻る。
+        """
+        next_fetch = asyncio.ensure_future(self._fetch(chunks[0], HEADER_FETCH_ITEMS))
+        try:
+            for i, chunk in enumerate(chunks):
+                fetched = await next_fetch
+                next_fetch = None
+                if fetched is not None and i + 1 < len(chunks):
+                    next_fetch = asyncio.ensure_future(self._fetch(chunks[i + 1], HEADER_FETCH_ITEMS))
+                yield chunk, fetched
+                if fetched is None:
+                    return
+        finally:
+            if next_fetch is not None:
+                await asyncio.gather(next_fetch, return_exceptions=True)
+    
+    async def _fetch_text_bodies(self, candidates):
+        """候補のメールの本文パートをパート番号ごとにまとめて取得（GmailMonitor._fetch_text_bodiesと同じ戻り値）"""
+        parts, groups = self._plan_text_bodies(candidates)
+        bodies = {}
+        for section, uids in groups.items():
+            logger.info("本文（パート %s）を取得中: %d件", section, len(uids))
+            fetched = await self._fetch(uids, self._get_body_fetch_items(section))
+            if fetched is None:
+                logger.warning("本文の取得に失敗しました")
+                continue
+            self._collect_text_bodies(fetched, section, parts, bodies)
+        return bodies, self._get_failed_bodies(parts, bodies)
+    
+    def _get_response_int(self, name):
+        """SELECT応答のレスポンスコード（UIDVALIDITY等）を整数で取得"""
+        _, data = self.client.response(name)
+        try:
+            return int(data[-1])
+        except (TypeError, ValueError, IndexError):
+            return None
+    
+    async def _get_max_uid(self):
+        """メールボックス内の最大UIDを取得（UIDNEXT非対応サーバー用）"""
+        status, data = await self.client.command('UID', 'SEARCH', 'UID *')
+        if status != 'OK' or not data or not data[-1]:
+            return 0
+        return max(int(uid) for uid in data[-1].split())
@@ -0,0 +1,397 @@
+"""チェック処理の各段階の計測
+
+プロセス内で起動した偽IMAPサーバーに合成したメールを投入し、次の処理を個別に計測する。
+
+- connect: GmailMonitor.connect（接続とログイン）
+- check_new_mail: 1回のチェック（検索・ヘッダーと本文の取得・照合）
+- get_email_body: 取得済みのメール（email.message）から本文のテキストを取り出す処理
+- search_large_mailbox: UIDが多数あるメールボックスでのasyncio版クライアントのUID SEARCH
+  （応答の1行がStreamReaderの既定の上限を超える大きさになる）
+- beep_synthesis: 警告音の波形の生成（numpyが無い環境ではnull）
+
+メールの件数・添付ファイルの割合・文字コードと転送エンコーディングの組み合わせを指定でき、
+結果（所要時間・処理件数/秒・転送バイト数・tracemallocで測ったメモリのピーク）をJSONで出力する。
+バージョン間で結果を比較できるよう、gitのコミットも記録する。
+
+使用例:
+    python benchmarks/bench_check_cycle.py --messages 1000 --output bench.json
+    python benchmarks/bench_check_cycle.py --encodings utf-8:base64,iso-2022-jp:7bit --attachment-ratio 0.5
+"""
+import argparse
+import asyncio
+import base64
+import email
+import json
+import logging
+import os
+import platform
+import quopri
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from email.header import Header
+from email.utils import format_datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from async_gmail_monitor import AsyncImapClient  # noqa: E402
+from config_manager import ConfigManager  # noqa: E402
+from fake_imap_server import FakeImapServer  # noqa: E402
+from gmail_monitor import GmailMonitor  # noqa: E402
+from mail_state import MailState, SeenCache  # noqa: E402
+
+USER = 'bench@example.com'
+PASSWORD = 'password'
+SENDER = 'alerts@example.com'
+KEYWORD = '障害発生'
+
+# 文字コードと転送エンコーディングの組み合わせ（デフォルト）
+DEFAULT_ENCODINGS = (
+    'utf-8:base64',
+    'utf-8:quoted-printable',
+    'utf-8:8bit',
+    'iso-2022-jp:7bit',
+    'shift_jis:base64',
+    'shift_jis:quoted-printable',
+)
+
+# 本文の合成に使う語句
+WORDS = (
+    '監視', '通知', 'サーバー', '定期', 'レポート', '確認', '完了', '送信', '予定', '状態',
+    'alert', 'report', 'status', 'daily', 'SIM', 'session', 'traffic', 'OK',
+)
+
+
+def parse_encodings(value):
+    """'utf-8:base64,shift_jis:7bit' 形式の指定を (文字コード, 転送エンコーディング) のリストに変換"""
+    encodings = []
+    for item in value.split(','):
+        charset, _, cte = item.strip().partition(':')
+        cte = cte or '8bit'
+        if cte not in ('7bit', '8bit', 'base64', 'quoted-printable'):
+            raise argparse.ArgumentTypeError(f"未対応の転送エンコーディングです: {cte}")
+        if charset == 'iso-2022-jp' and cte == '8bit':
+            cte = '7bit'
+        encodings.append((charset, cte))
+    return encodings
+
+
+def _make_text(rng, lines, keyword):
+    """本文のテキストを合成（keywordを指定すると最後の方に含める）"""
+    text = [''.join(rng.choice(WORDS) for _ in range(12)) for _ in range(lines)]
+    if keyword:
+        text.insert(max(0, lines - 2), f'{keyword}: {rng.randrange(1000)}')
+    return '\r\n'.join(text) + '\r\n'
+
+
+def _encode_body(text, charset, cte):
+    data = text.encode(charset)
+    if cte == 'base64':
+        return base64.encodebytes(data).replace(b'\n', b'\r\n')
+    if cte == 'quoted-printable':
+        return quopri.encodestring(data).replace(b'\n', b'\r\n')
+    return data
+
+
+def build_message(index, rng, charset, cte, body_lines=20, attachment_size=0, keyword=None):
+    """合成したメール（bytes）を作成"""
+    subject = Header(f'定期レポート #{index}', charset).encode()
+    headers = [
+        f'From: =?utf-8?b?{base64.b64encode("監視システム".encode()).decode()}?= <{SENDER}>',
+        f'To: {USER}',
+        f'Subject: {subject}',
+        f'Date: {format_datetime(datetime.now(timezone.utc))}',
+        f'Message-ID: <bench-{index}@example.com>',
+        'MIME-Version: 1.0',
+    ]
+    text_headers = f'Content-Type: text/plain; charset="{charset}"\r\nContent-Transfer-Encoding: {cte}\r\n'
+    body = _encode_body(_make_text(rng, body_lines, keyword), charset, cte)
+    if not attachment_size:
+        return ('\r\n'.join(headers) + '\r\n' + text_headers + '\r\n').encode() + body
+    
+    boundary = f'==bench-{index}=='
+    attachment = base64.encodebytes(rng.randbytes(attachment_size)).replace(b'\n', b'\r\n')
+    return b''.join([
+        ('\r\n'.join(headers) + f'\r\nContent-Type: multipart/mixed; boundary="{boundary}"\r\n\r\n').encode(),
+        f'--{boundary}\r\n{text_headers}\r\n'.encode(), body,
+        f'\r\n--{boundary}\r\nContent-Type: application/octet-stream\r\n'
+        f'Content-Disposition: attachment; filename="data-{index}.bin"\r\n'
+        'Content-Transfer-Encoding: base64\r\n\r\n'.encode(), attachment,
+        f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+
+
+def build_corpus(args):
+    """引数の指定どおりにメールを合成し、bytesのリストを返す"""
+    rng = random.Random(args.seed)
+    corpus = []
+    for index in range(args.messages):
+        charset, cte = args.encodings[index % len(args.encodings)]
+        attachment_size = args.attachment_size * 1024 if rng.random() < args.attachment_ratio else 0
+        keyword = KEYWORD if rng.random() < args.match_ratio else None
+        corpus.append(build_message(index, rng, charset, cte, args.body_lines, attachment_size, keyword))
+    return corpus
+
+
+def measure(func, repeat, setup=None):
+    """funcをrepeat回実行して所要時間を計り、最後に1回tracemalloc下で実行してメモリのピークを計る
+    
+    Returns:
+        (所要時間（秒）のリスト, メモリのピーク（バイト）, 最後の戻り値)
+    """
+    timings = []
+    result = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    
+    # tracemallocは処理を大幅に遅くするため、時間の計測とは別に実行する
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return timings, peak, result
+
+
+def summarize(timings, peak, items=None, transferred=None):
+    """計測結果をJSONに出力する辞書にまとめる"""
+    best = min(timings)
+    summary = {
+        'runs': len(timings),
+        'best_ms': best * 1000,
+        'mean_ms': sum(timings) / len(timings) * 1000,
+        'peak_memory_bytes': peak,
+    }
+    if items is not None:
+        summary['items'] = items
+        summary['items_per_second'] = items / best if best > 0 else None
+    if transferred is not None:
+        summary['bytes_transferred'] = transferred
+    return summary
+
+
+def make_config(server, directory, args):
+    """偽IMAPサーバーに接続する設定を作成"""
+    config_manager = ConfigManager(os.path.join(directory, 'config.ini'))
+    config_manager.set('Gmail', 'email', USER)
+    config_manager.set('Gmail', 'password', PASSWORD)
+    config_manager.set('Gmail', 'imap_host', server.host)
+    config_manager.set('Gmail', 'imap_port', str(server.port))
+    config_manager.set('Gmail', 'imap_ssl', 'false')
+    config_manager.set('Monitor', 'sender_filter', SENDER)
+    config_manager.set('Monitor', 'keyword_filter', KEYWORD)
+    config_manager.set('Monitor', 'time_window_minutes', '60')
+    config_manager.set('Monitor', 'server_filter', 'true' if args.server_filter else 'false')
+    config_manager.set('Monitor', 'parse_workers', args.parse_workers)
+    if args.fetch_chunk_size:
+        config_manager.set('Monitor', 'fetch_chunk_size', str(args.fetch_chunk_size))
+    return config_manager
+
+
+def bench_connect(server, config_manager, args):
+    monitor = GmailMonitor(config_manager)
+    transferred = []
+    
+    def connect():
+        sent = server.bytes_sent
+        monitor.connect()
+        transferred.append(server.bytes_sent - sent)
+    
+    # 切断（LOGOUT）は計測に含めない
+    timings, peak, _ = measure(connect, args.repeat, setup=monitor.disconnect)
+    monitor.disconnect()
+    return summarize(timings, peak, transferred=transferred[0])
+
+
+def bench_check(server, config_manager, args, directory):
+    monitor = GmailMonitor(config_manager)
+    monitor.connect()
+    transferred = []
+    matched = []
+    
+    def reset():
+        # 毎回、全てのメールが未処理の状態からチェックする
+        state_path = os.path.join(directory, 'state.json')
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        monitor.state = MailState(state_path)
+        monitor.seen = SeenCache()
+    
+    def check():
+        sent = server.bytes_sent
+        results = monitor.check_new_mail()
+        transferred.append(server.bytes_sent - sent)
+        matched.append(len(results))
+    
+    try:
+        timings, peak, _ = measure(check, args.repeat, setup=reset)
+    finally:
+        monitor.disconnect()
+        monitor.parser.close()
+    summary = summarize(timings, peak, items=args.messages, transferred=transferred[0])
+    summary['matched'] = matched[0]
+    return summary
+
+
+def bench_body(config_manager, corpus, args):
+    monitor = GmailMonitor(config_manager)
+    messages = [email.message_from_bytes(raw) for raw in corpus]
+    
+    def extract():
+        return sum(len(monitor._get_email_body(msg)) for msg in messages)
+    
+    timings, peak, characters = measure(extract, args.repeat)
+    summary = summarize(timings, peak, items=len(messages))
+    summary['bytes_processed'] = sum(len(raw) for raw in corpus)
+    summary['characters'] = characters
+    return summary
+
+
+def bench_large_search(args):
+    """UIDが多数あるメールボックスでのUID SEARCH（asyncio版のクライアント、--large-mailbox 0でNone）"""
+    if not args.large_mailbox:
+        return None
+    with FakeImapServer(users={USER: PASSWORD}) as server:
+        for index in range(args.large_mailbox):
+            server.deliver(
+                f'From: <{SENDER}>\r\nSubject: filler {index}\r\n'
+                f'Message-ID: <filler-{index}@example.com>\r\n\r\nfiller\r\n'.encode()
+            )
+        loop = asyncio.new_event_loop()
+        try:
+            client = loop.run_until_complete(AsyncImapClient.open(server.host, server.port, use_ssl=False))
+            loop.run_until_complete(client.command('LOGIN', USER, PASSWORD))
+            loop.run_until_complete(client.command('SELECT', 'INBOX'))
+            
+            def search():
+                status, data = loop.run_until_complete(client.command('UID', 'SEARCH', 'ALL'))
+                if status != 'OK':
+                    raise RuntimeError(f"UID SEARCHが失敗しました: {status}")
+                return data[-1]
+            
+            timings, peak, line = measure(search, args.repeat)
+            loop.run_until_complete(client.command('LOGOUT'))
+            loop.run_until_complete(client.close())
+        finally:
+            loop.close()
+    
+    uids = len(line.split())
+    if uids != args.large_mailbox:
+        raise RuntimeError(f"検索結果の件数が合いません: {uids}件（{args.large_mailbox}件のはず）")
+    summary = summarize(timings, peak, items=uids)
+    summary['response_line_bytes'] = len(line)
+    return summary
+
+
+def bench_beep(args):
+    """警告音の波形の生成（numpyが無い場合はNone）"""
+    import utils
+    
+    # numpyは初回の使用時に読み込まれるため、ここで読み込んで有無を確認する
+    try:
+        utils._load_numpy()
+    except ImportError as e:
+        logging.getLogger(__name__).warning(f"警告音の計測を省略します: {e}")
+        return None
+    
+    def synthesize():
+        # lru_cacheを通さず、毎回波形を生成する
+        return utils._synthesize_beep(args.beep_duration, 300, 6)
+    
+    timings, peak, audio = measure(synthesize, args.repeat)
+    summary = summarize(timings, peak, items=len(audio))
+    summary['duration_seconds'] = args.beep_duration
+    return summary
+
+
+def get_git_commit():
+    """計測したソースのgitのコミット（取得できなければNone）"""
+    try:
+        result = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="チェック処理の各段階の計測")
+    parser.add_argument('--messages', type=int, default=500, help='メールの件数（デフォルト: 500）')
+    parser.add_argument('--body-lines', type=int, default=20, help='本文の行数（デフォルト: 20）')
+    parser.add_argument('--attachment-ratio', type=float, default=0.2,
+                        help='添付ファイル付きのメールの割合（デフォルト: 0.2）')
+    parser.add_argument('--attachment-size', type=int, default=64, help='添付ファイルのサイズ（KB、デフォルト: 64）')
+    parser.add_argument('--encodings', type=parse_encodings, default=parse_encodings(','.join(DEFAULT_ENCODINGS)),
+                        help='文字コード:転送エンコーディング のカンマ区切り（デフォルト: 6種類の組み合わせ）')
+    parser.add_argument('--match-ratio', type=float, default=0.1,
+                        help='キーワードを含むメールの割合（デフォルト: 0.1）')
+    parser.add_argument('--server-filter', action='store_true', help='キーワードをサーバー側の検索でも絞り込む')
+    parser.add_argument('--parse-workers', default='0', help='[Monitor] parse_workers（デフォルト: 0）')
+    parser.add_argument('--fetch-chunk-size', type=int, default=0, help='[Monitor] fetch_chunk_size（省略時は設定の既定値）')
+    parser.add_argument('--large-mailbox', type=int, default=15000,
+                        help='UID SEARCHを計測するメールボックスのメール数（0で省略、デフォルト: 15000）')
+    parser.add_argument('--beep-duration', type=float, default=10.0, help='警告音の秒数（デフォルト: 10）')
+    parser.add_argument('--repeat', type=int, default=3, help='各計測の繰り返し回数（デフォルト: 3）')
+    parser.add_argument('--seed', type=int, default=0, help='メールの合成に使う乱数のシード')
+    parser.add_argument('--output', help='結果のJSONの保存先（省略時は標準出力）')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.WARNING)
+    corpus = build_corpus(args)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, FakeImapServer(users={USER: PASSWORD}) as server:
+        for raw in corpus:
+            server.deliver(raw)
+        config_manager = make_config(server, directory, args)
+        results['connect'] = bench_connect(server, config_manager, args)
+        results['check_new_mail'] = bench_check(server, config_manager, args, directory)
+        results['get_email_body'] = bench_body(config_manager, corpus, args)
+    results['search_large_mailbox'] = bench_large_search(args)
+    results['beep_synthesis'] = bench_beep(args)
+    
+    report = {
+        'benchmark': 'check_cycle',
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': get_git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'messages': args.messages,
+            'corpus_bytes': sum(len(raw) for raw in corpus),
+            'body_lines': args.body_lines,
+            'attachment_ratio': args.attachment_ratio,
+            'attachment_size_kb': args.attachment_size,
+            'encodings': [f'{charset}:{cte}' for charset, cte in args.encodings],
+            'match_ratio': args.match_ratio,
+            'server_filter': args.server_filter,
+            'parse_workers': args.parse_workers,
+            'fetch_chunk_size': args.fetch_chunk_size or None,
+            'large_mailbox': args.large_mailbox,
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""再接続（接続してログインするまで）の所要時間の計測
+
+ローカルの偽IMAPサーバー（TLS）に対して、次の2通りで接続とログインを繰り返す。
+
+- before: 以前のGmailMonitor.connectと同じく、毎回imaplib.IMAP4_SSLを作成してログインする
+  （SSLContextを毎回作り、完全なTLSハンドシェイクとCAPABILITYの問い合わせを行う）
+- after: ImapConnection.reconnect（共有のSSLContext・TLSセッションの再開・CAPABILITYの使い回し）
+
+サーバーは別プロセスで動かすため、CPU時間はクライアント側だけの値になる。
+自己署名の証明書の作成にopensslコマンドを使う。
+
+使用例:
+    python benchmarks/bench_reconnect.py --iterations 200
+    python benchmarks/bench_reconnect.py --json
+"""
+import argparse
+import imaplib
+import json
+import multiprocessing
+import os
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from imap_connection import ImapConnection  # noqa: E402
+
+USER = 'bench@example.com'
+PASSWORD = 'password'
+
+
+def create_certificate(directory):
+    """自己署名の証明書と秘密鍵を作成し、(証明書, 秘密鍵) のパスを返す"""
+    openssl = shutil.which('openssl')
+    if openssl is None:
+        raise SystemExit("opensslコマンドが見つかりません")
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.run(
+        [openssl, 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-subj', '/CN=localhost',
+         '-addext', 'subjectAltName=IP:127.0.0.1,DNS:localhost',
+         '-days', '1', '-keyout', keyfile, '-out', certfile],
+        check=True, capture_output=True,
+    )
+    return certfile, keyfile
+
+
+def serve(certfile, keyfile, conn):
+    """偽IMAPサーバー（TLS）を起動し、ポート番号を送って終了の合図を待つ（別プロセスで実行）"""
+    from fake_imap_server import FakeImapServer
+    
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    with FakeImapServer(users={USER: PASSWORD}, ssl_context=context) as server:
+        conn.send(server.port)
+        conn.recv()
+
+
+def bench_before(port, cafile, iterations):
+    """毎回IMAP4_SSLを作成してログインする"""
+    for _ in range(iterations):
+        context = ssl.create_default_context(cafile=cafile)
+        imap = imaplib.IMAP4_SSL('127.0.0.1', port, ssl_context=context)
+        imap.login(USER, PASSWORD)
+        imap.shutdown()
+
+
+def bench_after(port, cafile, iterations):
+    """ImapConnection.reconnectで接続し直す（TLSセッションを再開できた回数を返す）"""
+    connection = ImapConnection('127.0.0.1', port, True, USER, PASSWORD, cafile=cafile)
+    # 最初の接続（TLSセッションとCAPABILITYを取得する）は計測に含めない
+    connection.open()
+    reused = 0
+    started = time.perf_counter(), time.process_time()
+    for _ in range(iterations):
+        connection.reconnect()
+        reused += connection.imap.sock.session_reused
+    elapsed = time.perf_counter() - started[0], time.process_time() - started[1]
+    connection.abandon()
+    return reused, elapsed
+
+
+def run(port, cafile, iterations):
+    results = {}
+    
+    bench_before(port, cafile, 1)
+    started = time.perf_counter(), time.process_time()
+    bench_before(port, cafile, iterations)
+    results['before'] = {
+        'wall_ms': (time.perf_counter() - started[0]) * 1000 / iterations,
+        'cpu_ms': (time.process_time() - started[1]) * 1000 / iterations,
+        'session_reused': 0.0,
+        'capability_requests': 1,
+    }
+    
+    reused, (wall, cpu) = bench_after(port, cafile, iterations)
+    results['after'] = {
+        'wall_ms': wall * 1000 / iterations,
+        'cpu_ms': cpu * 1000 / iterations,
+        'session_reused': reused / iterations,
+        'capability_requests': 0,
+    }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="再接続の所要時間の計測")
+    parser.add_argument('--iterations', type=int, default=100, help='接続の回数（デフォルト: 100）')
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = create_certificate(directory)
+        parent_conn, child_conn = multiprocessing.Pipe()
+        server = multiprocessing.get_context('spawn').Process(
+            target=serve, args=(certfile, keyfile, child_conn), daemon=True
+        )
+        server.start()
+        try:
+            port = parent_conn.recv()
+            results = run(port, certfile, args.iterations)
+        finally:
+            parent_conn.send(None)
+            server.join(5)
+    
+    results['iterations'] = args.iterations
+    results['openssl'] = ssl.OPENSSL_VERSION
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    
+    print(f"再接続 {args.iterations}回（{ssl.OPENSSL_VERSION}）")
+    print(f"{'':8}{'実時間/回':>12}{'CPU時間/回':>12}{'セッション再開':>14}{'CAPABILITY':>12}")
+    for name in ('before', 'after'):
+        result = results[name]
+        print(f"{name:8}{result['wall_ms']:>10.2f}ms{result['cpu_ms']:>10.2f}ms"
+              f"{result['session_reused']:>13.0%}{result['capability_requests']:>11}回")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""メール本文の逐次デコードモジュール
+
+本文パートを一度に文字列へ変換せず、一定サイズごとに転送エンコーディング（base64 /
+quoted-printable）と文字コードを解いて順に返す。照合側（Matcher.match_stream）は
+チャンクごとに照合し、一致した時点で残りのデコードを打ち切る。
+text/plainが無いHTMLだけのメールは、タグを簡易的に取り除いたテキストを照合する。
+"""
+import binascii
+import codecs
+import html
+import quopri
+import re
+
+# 1回にデコードする転送エンコード済みデータのバイト数
+DEFAULT_CHUNK_SIZE = 8192
+
+# 本文として扱わない（中身を照合しない）HTML要素
+_SKIPPED_ELEMENTS = ('script', 'style')
+_SKIPPED_ELEMENT_RE = re.compile(
+    r'<(%s)\b[^>]*>.*?</\1\s*>' % '|'.join(_SKIPPED_ELEMENTS), re.IGNORECASE | re.DOTALL
+)
+# 段落などの区切りになるタグは改行に、それ以外（<b>や<span>など）は取り除くだけにする
+_BLOCK_TAG_RE = re.compile(r'<\s*/?\s*(?:p|div|br|li|tr|td|th|h[1-6]|table|ul|ol|blockquote)\b[^>]*>', re.IGNORECASE)
+_TAG_RE = re.compile(r'<[^>]*>')
+_SPACES_RE = re.compile(r'[ \t\r\f\v]+')
+# 文字参照として認識する最大の長さ（&#x10FFFF; など）
+_MAX_ENTITY_LENGTH = 32
+# 閉じていないタグとして次のチャンクに持ち越す最大の長さ（超えたら '<' は本文の文字として扱う）
+_MAX_TAG_LENGTH = 4096
+# script/style要素の中身を読み捨てる間、閉じタグを探すために持ち越す末尾の長さ
+_CLOSING_TAG_TAIL = 64
+
+
+def _transfer_decoded_chunks(payload, encoding, chunk_size):
+    """転送エンコーディングを解いたbytesをチャンクごとに返す"""
+    encoding = (encoding or '').lower()
+    if encoding == 'base64':
+        pending = b''
+        for start in range(0, len(payload), chunk_size):
+            data = pending + b''.join(payload[start:start + chunk_size].split())
+            usable = len(data) - len(data) % 4
+            pending = data[usable:]
+            try:
+                yield binascii.a2b_base64(data[:usable])
+            except binascii.Error:
+                return
+        # 部分取得で途中までしか無い場合、4文字に満たない端数は捨てる
+    elif encoding == 'quoted-printable':
+        pending = b''
+        for start in range(0, len(payload), chunk_size):
+            data = pending + payload[start:start + chunk_size]
+            # 行の途中（ソフト改行 = や =XX の途中）で区切らないよう、最後の改行までをデコードする
+            cut = data.rfind(b'\n') + 1
+            pending = data[cut:]
+            if cut:
+                yield quopri.decodestring(data[:cut])
+        if pending:
+            yield quopri.decodestring(pending)
+    else:
+        for start in range(0, len(payload), chunk_size):
+            yield payload[start:start + chunk_size]
+
+
+class HtmlTextStripper:
+    """HTMLを逐次受け取り、タグを取り除いたテキストを返すクラス
+    
+    チャンクの境界で切れたタグ・文字参照は次のチャンクに持ち越す。閉じていないscript/style要素は
+    閉じタグが来るまで中身を読み捨てる。持ち越す長さには上限があるため、壊れたHTMLや
+    大きなHTMLでも、チャンクごとに同じ部分を何度も走査し直すことはない。
+    """
+    
+    def __init__(self):
+        self._pending = ''
+        # 中身を読み捨てているscript/style要素の名前（要素の外ならNone）
+        self._skipping = None
+    
+    def feed(self, text):
+        """HTMLの断片を渡し、確定したテキストを返す"""
+        text = self._pending + text
+        self._pending = ''
+        
+        if self._skipping:
+            end = re.search(r'</%s\s*>' % self._skipping, text, re.IGNORECASE)
+            if not end:
+                # チャンクの境界で切れた閉じタグを見つけられるよう、末尾だけ持ち越す
+                self._pending = text[-_CLOSING_TAG_TAIL:]
+                return ''
+            # 閉じた要素は _SKIPPED_ELEMENT_RE と同じく空白1つに置き換える
+            text = ' ' + text[end.end():]
+            self._skipping = None
+        
+        # 閉じていないscript/style要素は、閉じタグが来るまで中身を読み捨てる
+        text = _SKIPPED_ELEMENT_RE.sub(' ', text)
+        lowered = text.lower()
+        for name in _SKIPPED_ELEMENTS:
+            start = lowered.rfind('<' + name)
+            if start != -1 and not re.search(r'</%s\s*>' % name, lowered[start:]):
+                self._skipping = name
+                self._pending = text[start:][-_CLOSING_TAG_TAIL:]
+                text = text[:start]
+                lowered = lowered[:start]
+        
+        # 閉じていないタグは持ち越す（長すぎる場合はタグではないものとして扱う）
+        start = text.rfind('<')
+        if start != -1 and text.find('>', start) == -1 and len(text) - start <= _MAX_TAG_LENGTH:
+            if self._skipping:
+                text = text[:start]
+            else:
+                text, self._pending = text[:start], text[start:]
+        
+        # 途中で切れた文字参照は持ち越す
+        start = text.rfind('&', max(0, len(text) - _MAX_ENTITY_LENGTH))
+        if start != -1 and ';' not in text[start:] and not self._pending:
+            text, self._pending = text[:start], text[start:]
+        
+        return self._strip(text)
+    
+    def close(self):
+        """残っている断片を返す"""
+        text, self._pending = self._pending, ''
+        if self._skipping:
+            self._skipping = None
+            return ''
+        return self._strip(_SKIPPED_ELEMENT_RE.sub(' ', text))
+    
+    def _strip(self, text):
+        text = _TAG_RE.sub('', _BLOCK_TAG_RE.sub('\n', text))
+        return _SPACES_RE.sub(' ', html.unescape(text))
+
+
+def iter_body_text(payload, encoding, charset, subtype='plain', chunk_size=DEFAULT_CHUNK_SIZE):
+    """本文パートを逐次デコードし、テキストのチャンクを順に返す
+    
+    Args:
+        payload: 転送エンコードされたままのパートのデータ（部分取得で途中まででもよい）
+        encoding: 転送エンコーディング（base64 / quoted-printable / 7bit など）
+        charset: 文字コード
+        subtype: 'plain' または 'html'（htmlの場合はタグを取り除く）
+        chunk_size: 1回にデコードする転送エンコード済みデータのバイト数
+    """
+    if not payload:
+        return
+    try:
+        decoder = codecs.getincrementaldecoder(charset or 'utf-8')(errors='ignore')
+    except LookupError:
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    stripper = HtmlTextStripper() if subtype == 'html' else None
+    
+    for data in _transfer_decoded_chunks(payload, encoding, chunk_size):
+        text = decoder.decode(data)
+        if stripper:
+            text = stripper.feed(text)
+        if text:
+            yield text
+    
+    text = decoder.decode(b'', final=True)
+    if stripper:
+        text = stripper.feed(text) + stripper.close()
+    if text:
+        yield text
@@ -7,30 +7,52 @@ import logging
 import threading
 from pathlib import Path
 
-from config_manager import ConfigManager
-from gmail_monitor import GmailMonitor
-from utils import play_beep, setup_logging
+from alert_player import AlertPlayer
+from config_manager import ConfigManager, ConfigWatcher
+from metrics import MetricsExporter
+from monitor_engine import MonitorEngine, describe_latency, describe_matches, get_alert_duration, get_engine_key
+from scheduler import AdaptiveScheduler
+from utils import get_waveform_cache_dir, prepare_beep, setup_logging
 
 logger = logging.getLogger(__name__)
 
 # 終了フラグ
 should_stop = False
 
+# 警告音の再生（監視開始時に作成）
+alert_player = None
+
+
+def request_stop():
+    """監視の停止を要求し、再生中の警告音も止める"""
+    global should_stop
+    should_stop = True
+    if alert_player:
+        alert_player.stop()
+
 
 def signal_handler(signum, frame):
     """シグナルハンドラー（Ctrl+Cなど）"""
-    global should_stop
     logger.info("終了シグナルを受信しました。監視を停止します...")
-    should_stop = True
+    request_stop()
+
+
+def wait_until_stopped(seconds):
+    """指定秒数待機（停止が要求されたらすぐに戻る）"""
+    deadline = time.monotonic() + seconds
+    while not should_stop:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(remaining, 0.5))
 
 
 def wait_for_user_input():
     """ユーザー入力を待機するスレッド"""
-    global should_stop
     try:
         input()  # Enterキーまたは任意の入力を待つ
         logger.info("ユーザー入力を検知しました。監視を停止します...")
-        should_stop = True
+        request_stop()
     except Exception:
         # 入力エラーが発生しても無視
         pass
@@ -103,6 +125,11 @@ def main():
         action='store_true',
         help='デバッグモードで実行'
     )
+    parser.add_argument(
+        '--log-queue',
+        action='store_true',
+        help='ログの整形と出力を専用のスレッドで行う（監視スレッドの負荷を減らす）'
+    )
     parser.add_argument(
         '--once',
         action='store_true',
@@ -113,7 +140,7 @@ def main():
     
     # ロギング設定
     log_level = logging.DEBUG if args.debug else logging.INFO
-    setup_logging(level=log_level)
+    setup_logging(level=log_level, use_queue=args.log_queue)
     
     logger.info("=" * 60)
     logger.info("Gmail監視ビープアプリ（CLI版）")
@@ -128,21 +155,21 @@ def main():
     
     config_manager = ConfigManager(str(config_path))
     
-    # コマンドライン引数で設定を上書き
+    # コマンドライン引数で設定を上書き（設定ファイルを読み直しても引数の値を優先する）
     if args.email:
-        config_manager.set('Gmail', 'email', args.email)
+        config_manager.override('Gmail', 'email', args.email)
     if args.password:
-        config_manager.set('Gmail', 'password', args.password)
+        config_manager.override('Gmail', 'password', args.password)
     if args.interval:
-        config_manager.set('Monitor', 'check_interval', str(args.interval))
+        config_manager.override('Monitor', 'check_interval', str(args.interval))
     if args.time_window:
-        config_manager.set('Monitor', 'time_window_minutes', str(args.time_window))
+        config_manager.override('Monitor', 'time_window_minutes', str(args.time_window))
     if args.sender_filter is not None:
-        config_manager.set('Monitor', 'sender_filter', args.sender_filter)
+        config_manager.override('Monitor', 'sender_filter', args.sender_filter)
     if args.keyword_filter is not None:
-        config_manager.set('Monitor', 'keyword_filter', args.keyword_filter)
+        config_manager.override('Monitor', 'keyword_filter', args.keyword_filter)
     if args.beep_duration:
-        config_manager.set('Sound', 'beep_duration', str(args.beep_duration))
+        config_manager.override('Sound', 'beep_duration', str(args.beep_duration))
     
     # 最低限の設定チェック
     if not config_manager.is_configured():
@@ -157,6 +184,7 @@ def main():
     sender_filter = config_manager.get('Monitor', 'sender_filter')
     keyword_filter = config_manager.get('Monitor', 'keyword_filter')
     beep_duration = float(config_manager.get('Sound', 'beep_duration', '10'))
+    waveform_cache_dir = get_waveform_cache_dir(config_manager)
     
     logger.info(f"Gmailアドレス: {email}")
     logger.info(f"チェック間隔: {check_interval}秒")
@@ -164,21 +192,28 @@ def main():
     logger.info(f"送信者フィルター: {sender_filter if sender_filter else '(なし)'}")
     logger.info(f"キーワードフィルター: {keyword_filter if keyword_filter else '(なし)'}")
     logger.info(f"ビープ音の秒数: {beep_duration}秒")
-    logger.info("")
     
-    # Gmail監視インスタンスを作成
-    gmail_monitor = GmailMonitor(config_manager)
+    # 監視エンジンを作成（[Watch:*] があれば複数のメールボックスを並行監視）
+    engine = MonitorEngine(config_manager)
+    engine_key = get_engine_key(config_manager)
+    logger.info(f"監視対象: {', '.join(monitor.name for monitor in engine.monitors)}")
+    logger.info("")
     
-    # 接続テスト
+    # 接続テスト（成功した接続はそのまま監視セッションとして使い回す）
     logger.info("Gmailへの接続をテスト中...")
     try:
-        gmail_monitor.connect()
-        gmail_monitor.disconnect()
+        engine.connect_all()
         logger.info("接続テスト成功")
     except Exception as e:
         logger.error(f"接続テストに失敗しました: {e}")
         sys.exit(1)
     
+    # 警告音は別スレッドで再生し、鳴っている間もメールのチェックを続ける
+    # 波形は再生用のスレッドで先に用意しておく（最初の警告から生成待ちなしで鳴らすため）。
+    # --onceモードでは警告音を鳴らすときまでnumpy・simpleaudioを読み込まない
+    global alert_player
+    alert_player = AlertPlayer(beep_duration, waveform_cache_dir, prepare=not args.once)
+    
     # シグナルハンドラーを設定
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
@@ -198,6 +233,14 @@ def main():
     logger.info("=" * 60)
     
     beep_count = 0
+    scheduler = AdaptiveScheduler.for_config(config_manager)
+    # 計測値の公開（[Monitor] の metrics_port / stats_file を設定した場合）
+    exporter = MetricsExporter.for_config(config_manager).start()
+    # 監視中に設定ファイルが書き換えられたら読み直す（次のサイクルから反映、--onceモードでは不要）
+    watcher = ConfigWatcher.for_config(config_manager)
+    if not args.once:
+        watcher.start()
+    applied_snapshot = None
     
     try:
         while not should_stop:
@@ -206,50 +249,76 @@ def main():
                 logger.info("=" * 60)
                 logger.info("新しい監視サイクル開始")
                 
-                # Gmail接続
-                gmail_monitor.connect()
+                # 設定が読み直されていれば、監視対象・チェック間隔・警告音の秒数を反映
+                snapshot = config_manager.snapshot
+                if snapshot is not applied_snapshot:
+                    # 監視対象（[Watch:*]）か接続情報が変わった場合だけ、監視エンジンを作り直して接続し直す
+                    new_engine_key = get_engine_key(config_manager)
+                    if new_engine_key != engine_key:
+                        engine.shutdown()
+                        engine = MonitorEngine(config_manager)
+                        engine_key = new_engine_key
+                        logger.info(f"監視対象を変更しました: {', '.join(monitor.name for monitor in engine.monitors)}")
+                    scheduler = scheduler.reconfigured(config_manager)
+                    if snapshot.beep_duration != beep_duration:
+                        beep_duration = snapshot.beep_duration
+                        prepare_beep(beep_duration, waveform_cache_dir)
+                    applied_snapshot = snapshot
                 
-                # メールチェック
-                if gmail_monitor.check_new_mail(time_window_minutes=time_window_minutes):
-                    # 条件に合致するメールあり
-                    logger.info("条件に合致するメールが見つかりました！警告音を再生します")
-                    play_beep(duration=beep_duration)
-                    beep_count += 1
-                    logger.info(f"✓ ビープ回数: {beep_count}")
+                # 全監視対象を並行にチェック（接続済みならセッションを再利用）
+                matched = engine.check_all()
+                scheduler.record_success(bool(matched))
+                if matched:
+                    # 条件に合致するメールあり（複数のメールボックスで合致しても警告音は1回）
+                    logger.info(f"条件に合致するメールが見つかりました！警告音を再生します: {describe_matches(matched)}")
+                    for result in matched:
+                        logger.info(f"  {result.mailbox} UID {result.uid}: {result.sender} - {describe_latency(result)}")
+                    if alert_player.play(duration=get_alert_duration(matched, beep_duration)):
+                        beep_count += 1
+                        logger.info(f"✓ ビープ回数: {beep_count}")
                 else:
                     logger.info("条件に合致するメールはありませんでした")
                 
-                # 切断
-                gmail_monitor.disconnect()
-                
                 # 一度だけチェックモードの場合は終了
                 if args.once:
                     logger.info("--once モードのため、終了します")
+                    # 警告音は最後まで鳴らしてから終了する
+                    alert_player.wait_done()
                     break
                 
-                logger.info(f"次のチェックまで {check_interval}秒 待機します")
+                delay = scheduler.next_delay()
+                if engine.supports_idle():
+                    logger.info(f"IDLEで新着メールを待機します（最長 {delay:.0f}秒、{scheduler.reason}）")
+                else:
+                    logger.info(f"次のチェックまで {delay:.0f}秒 待機します（{scheduler.reason}）")
                 logger.info("=" * 60)
                 
                 # 待機（Ctrl+Cで中断可能）
-                for _ in range(check_interval):
-                    if should_stop:
-                        break
-                    time.sleep(1)
+                engine.wait_for_new_mail(delay, should_stop=lambda: should_stop)
                 
             except Exception as e:
                 logger.error(f"監視エラー: {e}")
                 logger.info("エラーが発生しましたが、監視を継続します")
                 
-                # エラー後は短い待機時間
+                # 接続が壊れている可能性があるため切断し、次のサイクルで再接続
+                engine.disconnect_all()
+                
+                # エラーが続くほど待機時間を延ばす
+                scheduler.record_failure()
                 if not args.once:
-                    time.sleep(10)
+                    delay = scheduler.next_delay()
+                    logger.info(f"{delay:.0f}秒後に再試行します（{scheduler.reason}）")
+                    wait_until_stopped(delay)
     
     finally:
         logger.info("")
         logger.info("=" * 60)
         logger.info(f"監視を終了しました（合計ビープ回数: {beep_count}）")
         logger.info("=" * 60)
-        gmail_monitor.disconnect()
+        watcher.stop()
+        alert_player.close()
+        engine.shutdown()
+        exporter.stop()
 
 
 if __name__ == "__main__":
@@ -1,6 +1,117 @@
-"""設定ファイル（config.ini）の管理モジュール"""
+"""設定ファイル（config.ini）の管理モジュール
+
+設定はconfigparserで読み込んだ上で、監視サイクルで参照する値を型変換済みの読み取り専用の
+スナップショット（ConfigSnapshot）にまとめる。照合ルール（Matcher）もスナップショットの作成時に
+コンパイルするため、監視処理はチェックのたびに文字列を解釈し直さずに属性を読むだけで済む。
+
+ConfigWatcherで設定ファイルの更新時刻を監視すると、ファイルが書き換えられたときに読み直して
+スナップショットを丸ごと差し替える（チェックの途中では差し替え前のスナップショットを使い続ける）。
+書き換えた設定に誤りがある場合は、今の設定のまま監視を続ける。
+
+    [Monitor]
+    config_watch_interval = 2
+
+- config_watch_interval: 設定ファイルの変更を確認する間隔（秒、0で無効、デフォルト: 2）
+"""
 import configparser
+import copy
+import logging
 import os
+import threading
+
+from matcher import build_matcher
+
+logger = logging.getLogger(__name__)
+
+# キーワード判定のために取得する本文の最大バイト数（0で無制限）
+DEFAULT_BODY_FETCH_LIMIT = 65536
+
+# 1回のFETCHで取得するメールの件数（取得結果を保持するメモリの上限になる）
+DEFAULT_FETCH_CHUNK_SIZE = 100
+
+DEFAULT_WATCH_INTERVAL = 2
+
+# 監視対象ごとのフィルター設定を持つセクションの接頭辞（monitor_engine.WATCH_SECTION_PREFIXと同じ）
+_WATCH_SECTION_PREFIX = 'Watch:'
+
+_TRUE_VALUES = ('1', 'yes', 'true', 'on')
+
+
+class _Frozen:
+    """作成後に属性を変更できないクラスの基底（スナップショットを複数のスレッドで共有するため）"""
+    
+    __slots__ = ()
+    
+    def _init(self, **values):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} は変更できません")
+    
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} は変更できません")
+
+
+class WatchSettings(_Frozen):
+    """監視対象（[Watch:*] または [Monitor]）ごとの検索・照合の設定"""
+    
+    __slots__ = ('section', 'sender_filter', 'keyword_filter', 'time_window_minutes', 'server_filter',
+                 'fetch_chunk_size', 'body_fetch_limit', 'matcher')
+    
+    def __init__(self, config_manager, section):
+        """
+        Args:
+            config_manager: 設定管理
+            section: フィルター設定を持つセクション（無い項目は [Monitor] を使用）
+        """
+        def get(key, fallback=''):
+            value = config_manager.get(section, key, None)
+            if value is None:
+                value = config_manager.get('Monitor', key, fallback)
+            return value
+        
+        sender_filter = get('sender_filter').strip()
+        keyword_filter = get('keyword_filter').strip()
+        self._init(
+            section=section,
+            sender_filter=sender_filter,
+            keyword_filter=keyword_filter,
+            time_window_minutes=int(get('time_window_minutes', '2')),
+            # Gmailの検索は単語単位のため、部分一致で指定したフィルターのメールを除外しないよう既定では無効
+            server_filter=get('server_filter', 'false').strip().lower() in _TRUE_VALUES,
+            fetch_chunk_size=max(1, int(get('fetch_chunk_size', str(DEFAULT_FETCH_CHUNK_SIZE)))),
+            body_fetch_limit=int(get('body_fetch_limit', str(DEFAULT_BODY_FETCH_LIMIT))),
+            matcher=build_matcher(config_manager, sender_filter, keyword_filter),
+        )
+
+
+class ConfigSnapshot(_Frozen):
+    """ある時点の設定を型変換した読み取り専用のスナップショット"""
+    
+    __slots__ = ('version', 'check_interval', 'time_window_minutes', 'use_idle', 'beep_duration', 'watches')
+    
+    def __init__(self, config_manager, version=0):
+        """
+        Args:
+            config_manager: 設定管理
+            version: 設定を読み込んだ回数（読み直すたびに増える）
+        """
+        watches = {'Monitor': WatchSettings(config_manager, 'Monitor')}
+        for section in config_manager.get_sections(_WATCH_SECTION_PREFIX):
+            watches[section] = WatchSettings(config_manager, section)
+        self._init(
+            version=version,
+            check_interval=int(config_manager.get('Monitor', 'check_interval', '60') or 60),
+            time_window_minutes=watches['Monitor'].time_window_minutes,
+            use_idle=config_manager.get_bool('Monitor', 'use_idle', True),
+            beep_duration=float(config_manager.get('Sound', 'beep_duration', '10')),
+            watches=watches,
+        )
+    
+    def watch(self, section):
+        """監視対象のフィルター設定（セクションが無い場合は [Monitor] の設定）"""
+        return self.watches.get(section) or self.watches['Monitor']
 
 
 class ConfigManager:
@@ -9,12 +120,19 @@ class ConfigManager:
     def __init__(self, config_path="config.ini"):
         self.config_path = config_path
         self.config = configparser.ConfigParser()
+        # コマンドライン引数などで上書きした値（設定ファイルを読み直した後も適用する）
+        self.overrides = {}
+        self.version = 0
+        self._snapshot = None
+        self._file_stat = None
+        self._lock = threading.Lock()
         self.load_or_create()
     
     def load_or_create(self):
         """設定ファイルの読み込み、存在しない場合はデフォルト値で作成"""
         if os.path.exists(self.config_path):
             self.config.read(self.config_path, encoding='utf-8')
+            self._file_stat = self._stat()
         else:
             # デフォルト設定を作成
             self.config['Gmail'] = {
@@ -25,27 +143,102 @@ class ConfigManager:
                 'check_interval': '60',
                 'time_window_minutes': '2',
                 'sender_filter': 'no-reply@soracom.io',
-                'keyword_filter': ''
+                'keyword_filter': '',
+                'use_idle': 'true'
             }
             self.config['Sound'] = {
-                'beep_duration': '10'
+                'beep_duration': '10',
+                'waveform_cache': 'false'
             }
             self.save()
     
+    def _stat(self):
+        """変更の検知に使う設定ファイルの (更新時刻, サイズ)（ファイルが無ければNone）"""
+        try:
+            stat = os.stat(self.config_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+    
+    @property
+    def snapshot(self):
+        """今の設定のスナップショット（設定を変更した後の最初の参照で作り直す）"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = ConfigSnapshot(self, self.version)
+                snapshot = self._snapshot
+        return snapshot
+    
+    def reload(self):
+        """設定ファイルを読み直してスナップショットを差し替える
+        
+        上書きした値（override）は読み直した設定にも適用する。読み込みやスナップショットの作成
+        （照合ルールのコンパイルなど）に失敗した場合は、今の設定のまま例外を送出する。
+        
+        Returns:
+            新しいConfigSnapshot
+        """
+        file_stat = self._stat()
+        config = configparser.ConfigParser()
+        with open(self.config_path, encoding='utf-8') as f:
+            config.read_file(f)
+        for (section, key), value in self.overrides.items():
+            if not config.has_section(section):
+                config.add_section(section)
+            config.set(section, key, value)
+        
+        # 差し替える前の設定で作ってみて、誤りがあればここで例外にする
+        candidate = copy.copy(self)
+        candidate.config = config
+        snapshot = ConfigSnapshot(candidate, self.version + 1)
+        with self._lock:
+            self.config = config
+            self.version += 1
+            self._snapshot = snapshot
+            self._file_stat = file_stat
+        return snapshot
+    
+    def reload_if_changed(self):
+        """設定ファイルが書き換えられていれば読み直す（読み直した場合はTrue）"""
+        file_stat = self._stat()
+        if file_stat is None or file_stat == self._file_stat:
+            return False
+        # 読み直しに失敗しても、同じ内容のファイルで何度も失敗しないよう記録しておく
+        self._file_stat = file_stat
+        self.reload()
+        return True
+    
     def save(self):
         """設定ファイルを保存"""
         with open(self.config_path, 'w', encoding='utf-8') as f:
             self.config.write(f)
+        self._file_stat = self._stat()
     
     def get(self, section, key, fallback=''):
         """設定値を取得"""
         return self.config.get(section, key, fallback=fallback)
     
+    def get_bool(self, section, key, fallback=False):
+        """真偽値の設定値を取得"""
+        return self.config.getboolean(section, key, fallback=fallback)
+    
+    def get_sections(self, prefix):
+        """指定した接頭辞で始まるセクション名の一覧を取得（例: 'Watch:'）"""
+        return [section for section in self.config.sections() if section.startswith(prefix)]
+    
     def set(self, section, key, value):
         """設定値を設定"""
         if not self.config.has_section(section):
             self.config.add_section(section)
         self.config.set(section, key, value)
+        self._snapshot = None
+    
+    def override(self, section, key, value):
+        """設定値を上書き（コマンドライン引数用。設定ファイルを読み直しても上書きしたままにする）"""
+        self.overrides[(section, key)] = value
+        self.set(section, key, value)
     
     def is_configured(self):
         """最低限の設定がされているか確認"""
@@ -53,3 +246,58 @@ class ConfigManager:
         password = self.get('Gmail', 'password')
         return bool(email_addr and password)
 
+
+class ConfigWatcher:
+    """設定ファイルの更新時刻をバックグラウンドスレッドで確認し、変更されたら読み直すクラス"""
+    
+    def __init__(self, config_manager, interval=DEFAULT_WATCH_INTERVAL, on_change=None):
+        """
+        Args:
+            config_manager: 監視する設定管理
+            interval: 変更を確認する間隔（秒、0で無効）
+            on_change: 読み直した後に新しいConfigSnapshotを渡して呼ぶ関数（監視スレッドで呼ばれる）
+        """
+        self.config_manager = config_manager
+        self.interval = interval
+        self.on_change = on_change
+        self._stop = threading.Event()
+        self._thread = None
+    
+    @classmethod
+    def for_config(cls, config_manager, on_change=None):
+        """設定（[Monitor] の config_watch_interval）から作成"""
+        interval = float(config_manager.get('Monitor', 'config_watch_interval', str(DEFAULT_WATCH_INTERVAL)) or 0)
+        return cls(config_manager, interval, on_change)
+    
+    def start(self):
+        """変更の確認を開始（間隔が0なら何もしない）"""
+        if self.interval > 0 and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='config-watcher', daemon=True)
+            self._thread.start()
+        return self
+    
+    def stop(self):
+        """変更の確認を終了"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+    
+    def poll(self):
+        """設定ファイルが変更されていれば読み直す（読み直した場合はTrue）"""
+        try:
+            if not self.config_manager.reload_if_changed():
+                return False
+        except Exception as e:
+            logger.error("設定ファイルを読み直せませんでした（今の設定のまま監視を続けます）: %s", e)
+            return False
+        snapshot = self.config_manager.snapshot
+        logger.info("設定ファイルの変更を反映しました（%d回目の読み直し）", snapshot.version)
+        if self.on_change:
+            self.on_change(snapshot)
+        return True
@@ -0,0 +1,564 @@
+"""デーモンモード（ローカルの制御ソケットでの操作）モジュール
+
+標準入力やシグナルに頼らずにバックグラウンドで常駐し、Unixドメインソケットで次の操作を受け付ける。
+IMAPの接続を張ったまま操作するため、設定の再読み込みやすぐのチェックのたびに接続テストをやり直す必要はない。
+
+- status: 監視の状態（監視対象と接続・最後のチェック・次のチェックまでの秒数・直近の合致など）
+- stats: 計測値（metricsのスナップショット）
+- pause / resume: チェックの一時停止・再開（一時停止中もIDLE・NOOPで接続を保つ）
+- reload: config.iniを読み直す（監視対象か接続情報が変わった場合のみ接続し直す）
+- silence: 再生中の警告音を止める
+- check: 待機を打ち切ってすぐにチェックする（一時停止中でも1回チェックし、結果を返す）
+- stop: デーモンを終了
+
+制御ソケットは [Monitor] の control_socket（config.iniからの相対パス、デフォルト: mail_beep.sock）に作成し、
+所有者だけが読み書きできるようにする。1行に1つのコマンドを送ると、1行のJSON（{"ok": true, ...}）が返る。
+
+    python main.py daemon --config config.ini
+    python main.py ctl status
+    python main.py ctl check
+
+SIGTERM・SIGINTで終了し、SIGHUPで設定を読み直す。config.iniを書き換えた場合もConfigWatcherが検知して
+reloadと同じように反映する。
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import signal
+import socket
+import socketserver
+import stat
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from alert_player import AlertPlayer
+from config_manager import ConfigManager, ConfigWatcher
+from metrics import MetricsExporter, metrics
+from monitor_engine import (MonitorEngine, describe_latency, describe_matches, get_alert_duration,
+                            get_engine_key)
+from scheduler import AdaptiveScheduler
+from utils import get_waveform_cache_dir, prepare_beep, setup_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET_NAME = 'mail_beep.sock'
+
+# 監視ループでの処理（check・reload）の完了を待つ最長の秒数
+COMMAND_TIMEOUT = 120
+
+# 制御ソケットで受け付けるコマンドと説明
+COMMANDS = {
+    'status': '監視の状態を表示',
+    'stats': '計測値を表示',
+    'pause': 'チェックを一時停止（接続は保つ）',
+    'resume': 'チェックを再開',
+    'reload': '設定ファイルを読み直す',
+    'silence': '再生中の警告音を止める',
+    'check': 'すぐにチェックして結果を表示',
+    'stop': 'デーモンを終了',
+}
+
+
+def get_socket_path(config_manager):
+    """制御ソケットのパス（[Monitor] の control_socket、config.iniからの相対パス）"""
+    name = config_manager.get('Monitor', 'control_socket', DEFAULT_SOCKET_NAME).strip() or DEFAULT_SOCKET_NAME
+    config_dir = os.path.dirname(os.path.abspath(config_manager.config_path))
+    return os.path.join(config_dir, name)
+
+
+def _isoformat(value):
+    return value.isoformat(timespec='seconds') if value else None
+
+
+def _describe_result(result):
+    """MatchResultを応答用の辞書にする"""
+    return {
+        'mailbox': result.mailbox,
+        'uid': result.uid,
+        'sender': result.sender,
+        'subject': result.subject,
+        'rule': result.rule.name,
+        'received': _isoformat(result.received),
+        'latency_seconds': result.latency,
+    }
+
+
+def _get_exporter_key(exporter):
+    return exporter.port, exporter.host, exporter.stats_path, exporter.stats_interval
+
+
+class _Reply:
+    """監視ループに依頼した処理の結果を、依頼したスレッドに渡すための入れ物"""
+    
+    __slots__ = ('event', 'result')
+    
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+    
+    def set(self, result):
+        self.result = result
+        self.event.set()
+    
+    def wait(self, timeout):
+        if not self.event.wait(timeout):
+            return {'ok': False, 'error': f'{timeout}秒以内に処理が終わりませんでした'}
+        return self.result
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    """1行に1つのコマンドを読み、1行のJSONで応答するハンドラー"""
+    
+    def handle(self):
+        for line in self.rfile:
+            command = line.decode('utf-8', 'replace').strip()
+            if not command:
+                continue
+            response = self.server.monitor_daemon.handle_command(command)
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class MonitorDaemon:
+    """監視ループを常駐させ、制御ソケットからの操作を受け付けるクラス
+    
+    IMAPの操作は監視ループのスレッドだけが行う。制御ソケットのスレッドは、すぐに済む操作
+    （状態の取得・一時停止・警告音の停止など）はその場で行い、チェックと設定の読み直しは
+    監視ループに依頼して待機を打ち切り、結果を待って応答する。
+    """
+    
+    def __init__(self, config_manager, socket_path):
+        """
+        Args:
+            config_manager: 設定管理
+            socket_path: 制御ソケットのパス
+        """
+        self.config_manager = config_manager
+        self.socket_path = socket_path
+        self.engine = None
+        self.engine_key = None
+        self.scheduler = None
+        self.alert_player = None
+        self.exporter = None
+        self.watcher = None
+        self.beep_duration = None
+        self.paused = False
+        self.checking = False
+        self.beep_count = 0
+        self.cycle_count = 0
+        self.last_check = None
+        self.last_error = None
+        self.last_matches = []
+        self.next_check = None
+        self.started = time.time()
+        self._server = None
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._requests = queue.SimpleQueue()
+    
+    @classmethod
+    def for_config(cls, config_manager, socket_path=None):
+        """設定から作成（socket_pathを省略した場合は [Monitor] の control_socket）"""
+        return cls(config_manager, socket_path or get_socket_path(config_manager))
+    
+    # --- 制御ソケット ---
+    
+    def start_server(self):
+        """制御ソケットを作成し、バックグラウンドスレッドで待ち受けを開始"""
+        server_class = getattr(socketserver, 'ThreadingUnixStreamServer', None)
+        if server_class is None:
+            raise RuntimeError("この環境はUnixドメインソケットに対応していません")
+        
+        if os.path.exists(self.socket_path):
+            if not stat.S_ISSOCK(os.stat(self.socket_path).st_mode):
+                raise RuntimeError(f"制御ソケットのパスにソケット以外のファイルがあります: {self.socket_path}")
+            try:
+                send_command(self.socket_path, 'status', timeout=2)
+            except OSError:
+                # 前回異常終了したデーモンのソケットが残っている
+                os.unlink(self.socket_path)
+            else:
+                raise RuntimeError(f"既にデーモンが起動しています: {self.socket_path}")
+        
+        # ソケットのファイルを所有者だけが読み書きできる状態で作成する
+        old_umask = os.umask(0o077)
+        try:
+            self._server = server_class(self.socket_path, _ControlHandler)
+        finally:
+            os.umask(old_umask)
+        self._server.daemon_threads = True
+        self._server.monitor_daemon = self
+        threading.Thread(target=self._server.serve_forever, name='daemon-control', daemon=True).start()
+        logger.info("制御ソケットで待ち受けます: %s", self.socket_path)
+    
+    def stop_server(self):
+        """制御ソケットを閉じて削除"""
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+    
+    def handle_command(self, line):
+        """制御ソケットで受け取ったコマンドを実行し、応答（JSONに変換できる辞書）を返す"""
+        command = line.split()[0].lower()
+        if command not in COMMANDS:
+            return {'ok': False, 'error': f"不明なコマンドです: {command}", 'commands': sorted(COMMANDS)}
+        logger.debug("制御コマンド: %s", command)
+        try:
+            return getattr(self, f'_command_{command}')()
+        except Exception as e:
+            logger.error("制御コマンド %s のエラー: %s", command, e)
+            return {'ok': False, 'error': str(e)}
+    
+    def _command_status(self):
+        engine = self.engine
+        scheduler = self.scheduler
+        next_check = self.next_check
+        if self.paused:
+            state = 'paused'
+        elif self.checking:
+            state = 'checking'
+        else:
+            state = 'waiting'
+        return {
+            'ok': True,
+            'state': state,
+            'pid': os.getpid(),
+            'config': os.path.abspath(self.config_manager.config_path),
+            'uptime_seconds': time.time() - self.started,
+            'monitors': [
+                {'name': monitor.name, 'connected': monitor.imap is not None, 'idle': monitor.supports_idle()}
+                for monitor in (engine.monitors if engine else ())
+            ],
+            'cycles': self.cycle_count,
+            'last_check': _isoformat(self.last_check),
+            'last_error': self.last_error,
+            'next_check_seconds': max(0.0, next_check - time.monotonic()) if next_check else None,
+            'schedule_reason': scheduler.reason if scheduler else '',
+            'beep_count': self.beep_count,
+            'alert_playing': bool(self.alert_player and self.alert_player.is_playing()),
+            'last_matches': [_describe_result(result) for result in self.last_matches],
+        }
+    
+    def _command_stats(self):
+        return dict(metrics.snapshot(), ok=True)
+    
+    def _command_pause(self):
+        if not self.paused:
+            logger.info("制御ソケットからの要求でチェックを一時停止します")
+        self.paused = True
+        self._wake.set()
+        return {'ok': True, 'paused': True}
+    
+    def _command_resume(self):
+        if self.paused:
+            logger.info("制御ソケットからの要求でチェックを再開します")
+        self.paused = False
+        self._wake.set()
+        return {'ok': True, 'paused': False}
+    
+    def _command_silence(self):
+        playing = bool(self.alert_player and self.alert_player.is_playing())
+        if self.alert_player:
+            self.alert_player.stop()
+        if playing:
+            logger.info("制御ソケットからの要求で警告音を止めました")
+        return {'ok': True, 'silenced': playing}
+    
+    def _command_check(self):
+        return self._submit('check').wait(COMMAND_TIMEOUT)
+    
+    def _command_reload(self):
+        return self._submit('reload').wait(COMMAND_TIMEOUT)
+    
+    def _command_stop(self):
+        self.request_stop()
+        return {'ok': True}
+    
+    def _submit(self, action):
+        """監視ループに処理を依頼し、待機中なら打ち切る"""
+        reply = _Reply()
+        self._requests.put((action, reply))
+        self._wake.set()
+        return reply
+    
+    def request_stop(self):
+        """デーモンの終了を要求し、再生中の警告音も止める"""
+        self._stop.set()
+        self._wake.set()
+        if self.alert_player:
+            self.alert_player.stop()
+    
+    def request_reload(self):
+        """設定の読み直しを監視ループに依頼（結果は待たない。SIGHUP用）"""
+        self._submit('reload')
+    
+    # --- 監視ループ ---
+    
+    def run(self):
+        """制御ソケットを開き、終了が要求されるまで監視する"""
+        self.start_server()
+        try:
+            self._open()
+            self._loop()
+        finally:
+            self._close()
+    
+    def _open(self):
+        self.engine = MonitorEngine(self.config_manager)
+        self.engine_key = get_engine_key(self.config_manager)
+        self.scheduler = AdaptiveScheduler.for_config(self.config_manager)
+        self.beep_duration = float(self.config_manager.get('Sound', 'beep_duration', '10'))
+        waveform_cache_dir = get_waveform_cache_dir(self.config_manager)
+        # 波形は再生用のスレッドで用意し、制御ソケットと監視はすぐに使えるようにする
+        self.alert_player = AlertPlayer(self.beep_duration, waveform_cache_dir, prepare=True)
+        self.exporter = MetricsExporter.for_config(self.config_manager).start()
+        # 設定ファイルが書き換えられたら、読み直した設定の反映を監視ループに依頼する
+        self.watcher = ConfigWatcher.for_config(
+            self.config_manager, on_change=lambda snapshot: self._submit('apply')
+        ).start()
+        logger.info("監視対象: %s", ', '.join(monitor.name for monitor in self.engine.monitors))
+        
+        # デーモンは接続できなくても終了せず、スケジューラーの間隔で接続を再試行する
+        try:
+            self.engine.connect_all()
+        except Exception as e:
+            logger.error("接続に失敗しました（次のチェックで再試行します）: %s", e)
+    
+    def _close(self):
+        self.stop_server()
+        if self.watcher:
+            self.watcher.stop()
+        # 監視ループが受け取る前に終了した依頼にも応答する
+        while True:
+            try:
+                _, reply = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            reply.set({'ok': False, 'error': 'デーモンを終了しました'})
+        if self.alert_player:
+            self.alert_player.close()
+        if self.engine:
+            self.engine.shutdown()
+        if self.exporter:
+            self.exporter.stop()
+        logger.info("デーモンを終了しました（合計ビープ回数: %d）", self.beep_count)
+    
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            checks = self._process_requests()
+            if self._stop.is_set():
+                break
+            if self.paused and not checks:
+                # 一時停止中もIDLE・NOOPで接続を保ち、再開したらすぐにチェックできるようにする
+                self._wait(self.scheduler.max_interval)
+                continue
+            
+            result = self._run_cycle()
+            for reply in checks:
+                reply.set(result)
+            if self.paused or self._stop.is_set():
+                continue
+            
+            delay = self.scheduler.next_delay()
+            logger.info("次のチェックまで最長 %.0f秒 待機します（%s）", delay, self.scheduler.reason)
+            self._wait(delay)
+    
+    def _process_requests(self):
+        """依頼された処理のうち設定の読み直し・反映を行い、チェックの依頼（_Reply）のリストを返す"""
+        checks = []
+        while True:
+            try:
+                action, reply = self._requests.get_nowait()
+            except queue.Empty:
+                return checks
+            if action == 'reload':
+                reply.set(self._reload())
+            elif action == 'apply':
+                reply.set(self._apply_config())
+            else:
+                checks.append(reply)
+    
+    def _run_cycle(self):
+        """全監視対象をチェックし、合致があれば警告音を鳴らす（checkコマンドへの応答を返す）"""
+        self.checking = True
+        try:
+            matched = self.engine.check_all()
+        except Exception as e:
+            logger.error("監視エラー: %s", e)
+            # 接続が壊れている可能性があるため切断し、次のサイクルで再接続
+            self.engine.disconnect_all()
+            self.scheduler.record_failure()
+            self.last_error = str(e)
+            return {'ok': False, 'error': str(e)}
+        finally:
+            self.checking = False
+            self.cycle_count += 1
+            self.last_check = datetime.now(timezone.utc)
+        
+        self.last_error = None
+        self.scheduler.record_success(bool(matched))
+        beeped = False
+        if matched:
+            self.last_matches = matched
+            logger.info("条件に合致するメールが見つかりました！警告音を再生します: %s", describe_matches(matched))
+            for result in matched:
+                logger.info("  %s UID %s: %s - %s", result.mailbox, result.uid, result.sender, describe_latency(result))
+            beeped = self.alert_player.play(duration=get_alert_duration(matched, self.beep_duration))
+            if beeped:
+                self.beep_count += 1
+        return {'ok': True, 'matches': [_describe_result(result) for result in matched], 'beeped': beeped}
+    
+    def _wait(self, delay):
+        """次のチェックまで待機（新着の通知・制御ソケットからの依頼・終了要求で打ち切る）"""
+        self.next_check = time.monotonic() + delay
+        try:
+            self.engine.wait_for_new_mail(delay, should_stop=self._wake.is_set)
+        except Exception as e:
+            logger.error("待機中のエラー: %s", e)
+            self.engine.disconnect_all()
+            self._wake.wait(max(0.0, self.next_check - time.monotonic()))
+        finally:
+            self.next_check = None
+    
+    def _reload(self):
+        """設定ファイルを読み直して反映する（監視ループのスレッドで実行）"""
+        try:
+            self.config_manager.reload()
+        except Exception as e:
+            logger.error("設定ファイルを読み直せませんでした（今の設定で監視を続けます）: %s", e)
+            return {'ok': False, 'error': str(e)}
+        return self._apply_config()
+    
+    def _apply_config(self):
+        """読み直した設定を監視エンジン・スケジューラー・警告音・計測値の公開に反映する
+        
+        フィルターと照合ルールは設定のスナップショットに含まれるため、次のチェックから自動的に使われる。
+        """
+        # 監視対象か接続情報が変わった場合だけ接続し直す（それ以外は今のセッションを使い続ける）
+        engine_key = get_engine_key(self.config_manager)
+        reconnected = engine_key != self.engine_key
+        if reconnected:
+            self.engine.shutdown()
+            self.engine = MonitorEngine(self.config_manager)
+            self.engine_key = engine_key
+        
+        self.scheduler = self.scheduler.reconfigured(self.config_manager)
+        self.beep_duration = self.config_manager.snapshot.beep_duration
+        waveform_cache_dir = get_waveform_cache_dir(self.config_manager)
+        if (self.beep_duration, waveform_cache_dir) != (self.alert_player.duration, self.alert_player.cache_dir):
+            prepare_beep(self.beep_duration, waveform_cache_dir)
+            self.alert_player.duration = self.beep_duration
+            self.alert_player.cache_dir = waveform_cache_dir
+        
+        exporter = MetricsExporter.for_config(self.config_manager)
+        if _get_exporter_key(exporter) != _get_exporter_key(self.exporter):
+            self.exporter.stop()
+            self.exporter = exporter.start()
+        
+        monitors = [monitor.name for monitor in self.engine.monitors]
+        logger.info("設定を読み直しました（%s）: %s", '接続し直します' if reconnected else '接続は維持します',
+                    ', '.join(monitors))
+        return {'ok': True, 'reconnected': reconnected, 'monitors': monitors}
+
+
+def send_command(socket_path, command, timeout=COMMAND_TIMEOUT + 10):
+    """デーモンの制御ソケットにコマンドを送り、応答（辞書）を返す"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(command.encode('utf-8') + b'\n')
+        with sock.makefile('rb') as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("デーモンから応答がありませんでした")
+    return json.loads(line)
+
+
+def daemon_main():
+    """デーモンモードのエントリーポイント"""
+    parser = argparse.ArgumentParser(
+        description='Gmail監視ビープアプリ（デーモンモード）',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+使用例:
+  # 起動（停止は ctl stop・SIGTERM・Ctrl+C）
+  %(prog)s --config /path/to/config.ini
+
+  # 別のターミナルから操作
+  mail-beep ctl status
+  mail-beep ctl reload
+        """
+    )
+    parser.add_argument('--config', default='config.ini', help='設定ファイルのパス（デフォルト: config.ini）')
+    parser.add_argument('--socket', help='制御ソケットのパス（設定ファイルより優先）')
+    parser.add_argument('--debug', action='store_true', help='デバッグモードで実行')
+    parser.add_argument(
+        '--log-queue',
+        action='store_true',
+        help='ログの整形と出力を専用のスレッドで行う（監視スレッドの負荷を減らす）'
+    )
+    args = parser.parse_args()
+    
+    setup_logging(level=logging.DEBUG if args.debug else logging.INFO, use_queue=args.log_queue)
+    
+    if not os.path.exists(args.config):
+        logger.error("設定ファイル '%s' が見つかりません", args.config)
+        sys.exit(1)
+    config_manager = ConfigManager(args.config)
+    if not config_manager.is_configured():
+        logger.error("Gmail設定が不足しています")
+        sys.exit(1)
+    
+    monitor_daemon = MonitorDaemon.for_config(config_manager, args.socket)
+    signal.signal(signal.SIGINT, lambda signum, frame: monitor_daemon.request_stop())
+    signal.signal(signal.SIGTERM, lambda signum, frame: monitor_daemon.request_stop())
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: monitor_daemon.request_reload())
+    
+    logger.info("Gmail監視ビープアプリ（デーモンモード）を開始します")
+    try:
+        monitor_daemon.run()
+    except RuntimeError as e:
+        logger.error("%s", e)
+        sys.exit(1)
+
+
+def ctl_main():
+    """デーモンの操作（制御ソケットのクライアント）のエントリーポイント"""
+    parser = argparse.ArgumentParser(
+        description='デーモンモードの操作',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='コマンド:\n' + '\n'.join(f'  {name:8} {description}' for name, description in COMMANDS.items()),
+    )
+    parser.add_argument('command', choices=list(COMMANDS), metavar='command', help='送るコマンド')
+    parser.add_argument('--config', default='config.ini', help='設定ファイルのパス（デフォルト: config.ini）')
+    parser.add_argument('--socket', help='制御ソケットのパス（設定ファイルより優先）')
+    args = parser.parse_args()
+    
+    socket_path = args.socket
+    if not socket_path:
+        # 設定ファイルが無い場合も作成はせず、デフォルトのパスを使う
+        if os.path.exists(args.config):
+            socket_path = get_socket_path(ConfigManager(args.config))
+        else:
+            socket_path = os.path.join(os.path.dirname(os.path.abspath(args.config)), DEFAULT_SOCKET_NAME)
+    try:
+        response = send_command(socket_path, args.command)
+    except OSError as e:
+        print(f"デーモンに接続できません（{socket_path}）: {e}", file=sys.stderr)
+        sys.exit(2)
+    
+    print(json.dumps(response, ensure_ascii=False, indent=2))
+    if not response.get('ok'):
+        sys.exit(1)
@@ -0,0 +1,748 @@
+"""テスト用のローカル偽IMAPサーバーモジュール
+
+GmailMonitorを実際のGmailに接続せずに動作確認するための、最小限のIMAP4rev1サーバーです。
+別スレッドで起動し、deliver()でメールを投入するとIDLE中のクライアントへ即座に通知します。
+AsyncFakeImapServerは同じサーバーをasyncioのイベントループ上で動かします。
+ssl_contextにサーバー側のSSLContextを渡すと、IMAPS（TLS）で待ち受けます。
+
+使用例:
+    with FakeImapServer(users={'user@example.com': 'secret'}) as server:
+        server.deliver(raw_message_bytes)
+        # [Gmail] imap_host = 127.0.0.1 / imap_port = server.port / imap_ssl = false
+"""
+import asyncio
+import email
+import re
+import socket
+import time
+from email.header import decode_header, make_header
+import socketserver
+import threading
+from datetime import datetime, timezone
+
+from imap_utils import decode_mailbox_name
+
+_LITERAL_RE = re.compile(rb'\{(\d+)\}$')
+_SECTION_RE = re.compile(rb'^BODY(\.PEEK)?\[([^\]]*)\](?:<(\d+)(?:\.(\d+))?>)?$', re.IGNORECASE)
+
+
+class FakeMessage:
+    """偽サーバー上のメッセージ"""
+    
+    def __init__(self, uid, raw, flags=(), internaldate=None):
+        self.uid = uid
+        self.raw = raw
+        self.flags = set(flags)
+        self.internaldate = internaldate or datetime.now(timezone.utc)
+        self._parsed = None
+    
+    @property
+    def parsed(self):
+        """email.messageとして解析したメッセージ"""
+        if self._parsed is None:
+            self._parsed = email.message_from_bytes(self.raw)
+        return self._parsed
+
+
+class FakeMailbox:
+    """偽サーバー上のメールボックス"""
+    
+    def __init__(self, name, uidvalidity=1):
+        self.name = name
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.messages = []
+    
+    def append(self, raw, flags=(), internaldate=None):
+        """メッセージを追加してそのメッセージを返す"""
+        message = FakeMessage(self.uidnext, raw, flags, internaldate)
+        self.uidnext += 1
+        self.messages.append(message)
+        return message
+
+
+def tokenize(data):
+    """IMAPコマンド引数をトークン列に分解（括弧はネストしたリストになる）"""
+    tokens, _ = _tokenize(data, 0)
+    return tokens
+
+
+def _tokenize(data, pos):
+    tokens = []
+    while pos < len(data):
+        char = data[pos:pos + 1]
+        if char == b' ':
+            pos += 1
+        elif char == b'(':
+            sub, pos = _tokenize(data, pos + 1)
+            tokens.append(sub)
+        elif char == b')':
+            return tokens, pos + 1
+        elif char == b'"':
+            end = pos + 1
+            value = bytearray()
+            while data[end:end + 1] != b'"':
+                if data[end:end + 1] == b'\\':
+                    end += 1
+                value += data[end:end + 1]
+                end += 1
+            tokens.append(bytes(value))
+            pos = end + 1
+        else:
+            end = pos
+            depth = 0
+            while end < len(data):
+                c = data[end:end + 1]
+                if c == b'[':
+                    depth += 1
+                elif c == b']':
+                    depth -= 1
+                elif depth == 0 and c in (b' ', b'(', b')'):
+                    break
+                end += 1
+            tokens.append(data[pos:end])
+            pos = end
+    return tokens, pos
+
+
+def parse_sequence_set(value, max_value):
+    """シーケンスセット（例: 1:3,5,7:*）を整数の集合に変換"""
+    result = set()
+    for part in value.split(b','):
+        if b':' in part:
+            start, end = part.split(b':', 1)
+            start = max_value if start == b'*' else int(start)
+            end = max_value if end == b'*' else int(end)
+            if start > end:
+                start, end = end, start
+            result.update(range(start, end + 1))
+        else:
+            result.add(max_value if part == b'*' else int(part))
+    return result
+
+
+class _Session:
+    """1接続分のIMAPセッション処理"""
+    
+    def __init__(self, server, write):
+        self.server = server
+        self.write = write
+        self.authenticated = False
+        self.mailbox = None
+        self.readonly = False
+        self.idling = False
+        # 選択中のメールボックスについてクライアントに通知済みのメール数
+        self.known_exists = 0
+    
+    # --- 応答ヘルパー ---
+    
+    def untagged(self, text):
+        self.write(b'* ' + text + b'\r\n')
+    
+    def tagged(self, tag, text):
+        self.write(tag + b' ' + text + b'\r\n')
+    
+    def greeting(self):
+        self.untagged(b'OK Fake IMAP server ready')
+    
+    # --- コマンド処理 ---
+    
+    def process(self, line):
+        """受信した1行を処理（IDLE中ならDONEとして扱う）。接続を閉じる場合はFalseを返す"""
+        if self.idling:
+            self.finish_idle(line)
+            return True
+        return self.handle(line)
+    
+    def close(self):
+        """接続終了時の後始末"""
+        if self.idling:
+            self.server.unregister_idle(self)
+    
+    def handle(self, line):
+        """1コマンドを処理。接続を閉じる場合はFalseを返す"""
+        parts = line.split(b' ', 2)
+        if len(parts) < 2:
+            self.write(b'* BAD Invalid command\r\n')
+            return True
+        tag, command = parts[0], parts[1].upper()
+        args = parts[2] if len(parts) > 2 else b''
+        handler = getattr(self, 'cmd_' + command.decode('ascii', 'replace').replace('-', '_'), None)
+        if handler is None:
+            self.tagged(tag, b'BAD Unknown command')
+            return True
+        try:
+            return handler(tag, args) is not False
+        except Exception as e:
+            self.tagged(tag, b'BAD ' + str(e).encode('ascii', 'replace'))
+            return True
+    
+    def cmd_CAPABILITY(self, tag, args):
+        self.untagged(b'CAPABILITY ' + b' '.join(self.server.capabilities))
+        self.tagged(tag, b'OK CAPABILITY completed')
+    
+    def cmd_NOOP(self, tag, args):
+        # 選択中のメールボックスに新着があれば通知する
+        if self.mailbox is not None:
+            with self.server.lock:
+                count = len(self.mailbox.messages)
+            if count > self.known_exists:
+                self.notify_exists(count)
+        self.tagged(tag, b'OK NOOP completed')
+    
+    def cmd_LOGIN(self, tag, args):
+        user, password = [t.decode('utf-8') for t in tokenize(args)[:2]]
+        if self.server.users.get(user) != password:
+            self.tagged(tag, b'NO [AUTHENTICATIONFAILED] Invalid credentials')
+            return
+        self.authenticated = True
+        self.tagged(tag, b'OK LOGIN completed')
+    
+    def cmd_LOGOUT(self, tag, args):
+        self.untagged(b'BYE Logging out')
+        self.tagged(tag, b'OK LOGOUT completed')
+        return False
+    
+    def cmd_SELECT(self, tag, args, readonly=False):
+        # Gmailと同じく、メールボックス名は修正UTF-7で受け取る
+        name = decode_mailbox_name(tokenize(args)[0].decode('ascii'))
+        mailbox = self.server.mailboxes.get(name)
+        if mailbox is None:
+            self.tagged(tag, b'NO Mailbox does not exist')
+            return
+        self.mailbox = mailbox
+        self.readonly = readonly
+        with self.server.lock:
+            self.known_exists = len(mailbox.messages)
+            self.untagged(b'%d EXISTS' % self.known_exists)
+            self.untagged(b'0 RECENT')
+            self.untagged(b'OK [UIDVALIDITY %d] UIDs valid' % mailbox.uidvalidity)
+            self.untagged(b'OK [UIDNEXT %d] Predicted next UID' % mailbox.uidnext)
+        mode = b'READ-ONLY' if readonly else b'READ-WRITE'
+        self.tagged(tag, b'OK [' + mode + b'] SELECT completed')
+    
+    def cmd_EXAMINE(self, tag, args):
+        self.cmd_SELECT(tag, args, readonly=True)
+    
+    def cmd_CLOSE(self, tag, args):
+        self.mailbox = None
+        self.tagged(tag, b'OK CLOSE completed')
+    
+    def cmd_SEARCH(self, tag, args, use_uid=False):
+        with self.server.lock:
+            messages = list(self.mailbox.messages)
+            matched = self._search(tokenize(args), messages)
+            numbers = [
+                message.uid if use_uid else messages.index(message) + 1
+                for message in matched
+            ]
+        self.untagged(b'SEARCH' + b''.join(b' %d' % n for n in numbers))
+        self.tagged(tag, b'OK SEARCH completed')
+    
+    def cmd_FETCH(self, tag, args, use_uid=False):
+        sequence, items = args.split(b' ', 1)
+        with self.server.lock:
+            messages = list(self.mailbox.messages)
+            if use_uid:
+                max_uid = messages[-1].uid if messages else 0
+                uids = parse_sequence_set(sequence, max_uid)
+                targets = [m for m in messages if m.uid in uids]
+            else:
+                numbers = parse_sequence_set(sequence, len(messages))
+                targets = [messages[n - 1] for n in sorted(numbers) if 0 < n <= len(messages)]
+            item_tokens = tokenize(items)
+            if len(item_tokens) == 1 and isinstance(item_tokens[0], list):
+                item_tokens = item_tokens[0]
+            if use_uid and b'UID' not in [t.upper() for t in item_tokens if isinstance(t, bytes)]:
+                item_tokens = [b'UID'] + item_tokens
+            for message in targets:
+                number = messages.index(message) + 1
+                self.write(b'* %d FETCH (' % number + self._fetch_items(message, item_tokens) + b')\r\n')
+        self.tagged(tag, b'OK FETCH completed')
+    
+    def cmd_UID(self, tag, args):
+        command, rest = args.split(b' ', 1)
+        command = command.upper()
+        if command == b'SEARCH':
+            return self.cmd_SEARCH(tag, rest, use_uid=True)
+        if command == b'FETCH':
+            return self.cmd_FETCH(tag, rest, use_uid=True)
+        self.tagged(tag, b'BAD Unsupported UID command')
+    
+    def cmd_IDLE(self, tag, args):
+        if b'IDLE' not in self.server.capabilities:
+            self.tagged(tag, b'BAD IDLE not supported')
+            return
+        self.idling = True
+        self.write(b'+ idling\r\n')
+        self.server.register_idle(self)
+        self.idle_tag = tag
+    
+    def finish_idle(self, line):
+        """IDLE中に受信した行（DONE）を処理"""
+        self.server.unregister_idle(self)
+        self.idling = False
+        if line.strip().upper() == b'DONE':
+            self.tagged(self.idle_tag, b'OK IDLE terminated')
+        else:
+            self.tagged(self.idle_tag, b'BAD Expected DONE')
+    
+    def notify_exists(self, count):
+        """新着メールをIDLE中のクライアントに通知"""
+        self.known_exists = count
+        self.untagged(b'%d EXISTS' % count)
+    
+    # --- SEARCH / FETCH の評価 ---
+    
+    def _search(self, criteria, messages):
+        return [m for m in messages if self._matches(list(criteria), m, messages)]
+    
+    def _matches(self, criteria, message, messages):
+        while criteria:
+            if not self._match_one(criteria, message, messages):
+                return False
+        return True
+    
+    def _match_one(self, criteria, message, messages):
+        key = criteria.pop(0)
+        if isinstance(key, list):
+            return self._matches(list(key), message, messages)
+        key_upper = key.upper()
+        if key_upper == b'ALL':
+            return True
+        if key_upper == b'UNSEEN':
+            return '\\Seen' not in message.flags
+        if key_upper == b'SEEN':
+            return '\\Seen' in message.flags
+        if key_upper == b'SINCE':
+            date = datetime.strptime(criteria.pop(0).decode('ascii'), '%d-%b-%Y').date()
+            return message.internaldate.date() >= date
+        if key_upper == b'CHARSET':
+            criteria.pop(0)
+            return True
+        if key_upper in (b'FROM', b'SUBJECT', b'TO'):
+            value = criteria.pop(0).decode('utf-8').lower()
+            return value in _header_text(message.parsed, key_upper.decode('ascii')).lower()
+        if key_upper == b'BODY':
+            return criteria.pop(0).decode('utf-8').lower() in _body_text(message.parsed).lower()
+        if key_upper == b'TEXT':
+            value = criteria.pop(0).decode('utf-8').lower()
+            text = message.raw.decode('utf-8', 'replace') + _body_text(message.parsed)
+            return value in text.lower()
+        if key_upper == b'X-GM-RAW' and b'X-GM-EXT-1' in self.server.capabilities:
+            return _match_gmail_query(criteria.pop(0).decode('utf-8'), message)
+        if key_upper == b'UID':
+            max_uid = messages[-1].uid if messages else 0
+            return message.uid in parse_sequence_set(criteria.pop(0), max_uid)
+        if key_upper[:1].isdigit() or key_upper[:1] == b'*':
+            return messages.index(message) + 1 in parse_sequence_set(key, len(messages))
+        raise ValueError(f'Unsupported search key: {key_upper.decode("ascii", "replace")}')
+    
+    def _fetch_items(self, message, items):
+        parts = []
+        for item in items:
+            name = item.upper()
+            if name == b'UID':
+                parts.append(b'UID %d' % message.uid)
+            elif name == b'FLAGS':
+                parts.append(b'FLAGS (' + ' '.join(sorted(message.flags)).encode('ascii') + b')')
+            elif name == b'INTERNALDATE':
+                parts.append(b'INTERNALDATE "' + message.internaldate.strftime('%d-%b-%Y %H:%M:%S %z').encode('ascii') + b'"')
+            elif name == b'RFC822.SIZE':
+                parts.append(b'RFC822.SIZE %d' % len(message.raw))
+            elif name == b'RFC822':
+                if not self.readonly:
+                    message.flags.add('\\Seen')
+                parts.append(b'RFC822 {%d}\r\n' % len(message.raw) + message.raw)
+            elif name == b'BODYSTRUCTURE':
+                parts.append(b'BODYSTRUCTURE ' + _bodystructure(message.parsed))
+            elif _SECTION_RE.match(item):
+                match = _SECTION_RE.match(item)
+                peek, section, origin, length = match.groups()
+                data = _section(message, section.upper())
+                label = b'BODY[' + section + b']'
+                if origin is not None:
+                    start = int(origin)
+                    end = start + int(length) if length is not None else None
+                    data = data[start:end]
+                    label += b'<%d>' % start
+                if not peek and not self.readonly:
+                    message.flags.add('\\Seen')
+                parts.append(label + b' {%d}\r\n' % len(data) + data)
+            else:
+                raise ValueError(f'Unsupported fetch item: {name.decode("ascii", "replace")}')
+        return b' '.join(parts)
+
+
+def _header_text(message, name):
+    """デコード済みのヘッダー値"""
+    value = message.get(name, '')
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return str(value)
+
+
+def _body_text(message):
+    """デコード済みのテキストパートを連結した本文"""
+    texts = []
+    for part in message.walk():
+        if part.get_content_maintype() != 'text':
+            continue
+        payload = part.get_payload(decode=True) or b''
+        texts.append(payload.decode(part.get_content_charset() or 'utf-8', 'replace'))
+    return '\n'.join(texts)
+
+
+_GMAIL_TERM_RE = re.compile(r'(\w+):\(([^)]*)\)|(\w+):(\S+)|"([^"]*)"|(\S+)')
+
+
+def _match_gmail_query(query, message):
+    """Gmailの検索構文（X-GM-RAW）の一部を模擬して評価"""
+    body = (_header_text(message.parsed, 'Subject') + '\n' + _body_text(message.parsed)).lower()
+    for match in _GMAIL_TERM_RE.finditer(query):
+        operator = (match.group(1) or match.group(3) or '').lower()
+        value = match.group(2) or match.group(4) or match.group(5) or match.group(6) or ''
+        if operator == 'from':
+            if value.lower() not in _header_text(message.parsed, 'From').lower():
+                return False
+        elif operator == 'newer_than':
+            units = {'d': 86400, 'm': 30 * 86400, 'y': 365 * 86400}
+            seconds = int(value[:-1]) * units[value[-1].lower()]
+            if message.internaldate.timestamp() < time.time() - seconds:
+                return False
+        elif operator == 'after':
+            if message.internaldate.timestamp() <= int(value):
+                return False
+        elif operator:
+            raise ValueError(f'Unsupported Gmail search operator: {operator}')
+        elif value.lower() not in body:
+            return False
+    return True
+
+
+def _quote(value):
+    if value is None:
+        return b'NIL'
+    return b'"' + value.encode('ascii', 'replace').replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+
+
+def _inline_literal(literal):
+    """受信したリテラルを引用符付き文字列に変換（以降は通常の引数として解析する）"""
+    return b'"' + literal.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+
+
+def _raw_payload(part):
+    """転送エンコーディングを解かない状態のパート本体"""
+    payload = part.get_payload(decode=False)
+    if isinstance(payload, str):
+        return payload.encode('utf-8', 'surrogateescape')
+    return payload or b''
+
+
+def _bodystructure(part):
+    """email.messageからBODYSTRUCTURE応答を生成"""
+    if part.is_multipart():
+        children = b''.join(_bodystructure(child) for child in part.get_payload())
+        return b'(' + children + b' ' + _quote(part.get_content_subtype().upper()) + b')'
+    params = [(k, v) for k, v in (part.get_params() or [])[1:] if v]
+    param_list = b'(' + b' '.join(_quote(k.upper()) + b' ' + _quote(str(v)) for k, v in params) + b')' if params else b'NIL'
+    encoding = part.get('Content-Transfer-Encoding', '7BIT').strip().upper()
+    payload = _raw_payload(part)
+    fields = [
+        _quote(part.get_content_maintype().upper()),
+        _quote(part.get_content_subtype().upper()),
+        param_list,
+        b'NIL',
+        b'NIL',
+        _quote(encoding),
+        b'%d' % len(payload),
+    ]
+    if part.get_content_maintype() == 'text':
+        fields.append(b'%d' % payload.count(b'\n'))
+    return b'(' + b' '.join(fields) + b')'
+
+
+def _split_raw(raw):
+    """生メッセージをヘッダー部と本文部に分割"""
+    for separator in (b'\r\n\r\n', b'\n\n'):
+        index = raw.find(separator)
+        if index >= 0:
+            return raw[:index + len(separator)], raw[index + len(separator):]
+    return raw, b''
+
+
+def _header_fields(header, names, exclude=False):
+    """ヘッダー部から指定したフィールドだけを抜き出す（HEADER.FIELDS）"""
+    names = {n.upper() for n in names}
+    result = []
+    keep = False
+    for line in header.splitlines(keepends=True):
+        if not line.strip():
+            continue
+        if line[:1] in (b' ', b'\t'):
+            if keep:
+                result.append(line)
+            continue
+        name = line.split(b':', 1)[0].strip().upper()
+        keep = (name in names) != exclude
+        if keep:
+            result.append(line)
+    return b''.join(result) + b'\r\n'
+
+
+def _section(message, section):
+    """BODY[section] の内容を返す"""
+    header, body = _split_raw(message.raw)
+    if section == b'':
+        return message.raw
+    if section == b'HEADER':
+        return header
+    if section == b'TEXT':
+        return body
+    if section.startswith(b'HEADER.FIELDS'):
+        names = section[section.index(b'(') + 1:section.rindex(b')')].split()
+        return _header_fields(header, names, exclude=section.startswith(b'HEADER.FIELDS.NOT'))
+    part = message.parsed
+    for number in section.split(b'.'):
+        if part.is_multipart():
+            part = part.get_payload()[int(number) - 1]
+        elif number != b'1':
+            return b''
+    if part is message.parsed and not part.is_multipart():
+        return body
+    return _raw_payload(part)
+
+
+class _ThreadedHandler(socketserver.StreamRequestHandler):
+    """ソケットからコマンド行を読み取り_Sessionへ渡すハンドラー"""
+    
+    def setup(self):
+        if self.server.fake.ssl_context is not None:
+            # ハンドシェイクは接続ごとのスレッドで行う（受け付けのスレッドを止めない）
+            self.request = self.server.fake.ssl_context.wrap_socket(
+                self.request, server_side=True, do_handshake_on_connect=False
+            )
+            self.request.do_handshake()
+        super().setup()
+        self.write_lock = threading.Lock()
+    
+    def _write(self, data):
+        with self.write_lock:
+            self.server.fake.bytes_sent += len(data)
+            self.wfile.write(data)
+            self.wfile.flush()
+    
+    def _read_command(self):
+        """リテラル（{n}）を含めて1コマンド分を読み取る"""
+        data = b''
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return None
+            self.server.fake.bytes_received += len(line)
+            line = line.rstrip(b'\r\n')
+            match = _LITERAL_RE.search(line)
+            if not match:
+                return data + line
+            size = int(match.group(1))
+            self._write(b'+ Ready for literal data\r\n')
+            literal = self.rfile.read(size)
+            self.server.fake.bytes_received += len(literal)
+            data += line[:match.start()] + _inline_literal(literal)
+    
+    def handle(self):
+        session = _Session(self.server.fake, self._write)
+        session.greeting()
+        try:
+            while True:
+                line = self._read_command()
+                if line is None or not session.process(line):
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            session.close()
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeImapServer:
+    """スレッドで動作するローカル偽IMAPサーバー"""
+    
+    def __init__(self, host='127.0.0.1', port=0, users=None, capabilities=(b'IMAP4rev1', b'IDLE'),
+                 ssl_context=None):
+        """
+        Args:
+            host / port: 待ち受けるアドレス（port=0で空いているポート）
+            users: {ユーザー名: パスワード}
+            capabilities: CAPABILITYで返す機能
+            ssl_context: サーバー側のSSLContext（指定するとIMAPS（TLS）で待ち受ける）
+        """
+        self.users = users if users is not None else {'user@example.com': 'password'}
+        self.ssl_context = ssl_context
+        self.capabilities = list(capabilities)
+        self.mailboxes = {'INBOX': FakeMailbox('INBOX')}
+        self.lock = threading.RLock()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._idle_sessions = set()
+        self._thread = None
+        self._create_server(host, port)
+    
+    def _create_server(self, host, port):
+        self._server = _ThreadingServer((host, port), _ThreadedHandler)
+        self._server.fake = self
+    
+    @property
+    def host(self):
+        return self._server.server_address[0]
+    
+    @property
+    def port(self):
+        return self._server.server_address[1]
+    
+    def start(self):
+        """バックグラウンドスレッドでサーバーを起動"""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        """サーバーを停止"""
+        self._server.shutdown()
+        self._server.server_close()
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc_info):
+        self.stop()
+    
+    def add_mailbox(self, name, uidvalidity=1):
+        """メールボックスを追加"""
+        with self.lock:
+            mailbox = self.mailboxes.setdefault(name, FakeMailbox(name, uidvalidity))
+        return mailbox
+    
+    def deliver(self, raw, mailbox='INBOX', flags=(), internaldate=None):
+        """メールを配送し、IDLE中のセッションにEXISTSを通知"""
+        with self.lock:
+            box = self.add_mailbox(mailbox)
+            message = box.append(raw, flags, internaldate)
+            count = len(box.messages)
+            sessions = [s for s in self._idle_sessions if s.mailbox is box]
+        for session in sessions:
+            try:
+                session.notify_exists(count)
+            except OSError:
+                pass
+        return message
+    
+    def register_idle(self, session):
+        with self.lock:
+            self._idle_sessions.add(session)
+    
+    def unregister_idle(self, session):
+        with self.lock:
+            self._idle_sessions.discard(session)
+
+
+class AsyncFakeImapServer(FakeImapServer):
+    """asyncioのイベントループで動作するローカル偽IMAPサーバー
+    
+    状態とコマンド処理はFakeImapServerと共通で、接続の受け付けと読み書きだけを
+    バックグラウンドスレッドのイベントループ上のasyncioストリームで行う。
+    多数の同時接続（AsyncGmailMonitorの試験）でもスレッドを消費しない。
+    """
+    
+    def _create_server(self, host, port):
+        # ポート番号をstart()前から参照できるよう、ソケットだけ先に作成する
+        self._sock = socket.create_server((host, port))
+        self._loop = None
+        self._server = None
+    
+    @property
+    def host(self):
+        return self._sock.getsockname()[0]
+    
+    @property
+    def port(self):
+        return self._sock.getsockname()[1]
+    
+    def start(self):
+        """バックグラウンドスレッドでイベントループを起動"""
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+        
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, sock=self._sock, ssl=self.ssl_context)
+            )
+            started.set()
+            self._loop.run_forever()
+        
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+    
+    def stop(self):
+        """サーバーを停止"""
+        async def close():
+            self._server.close()
+            for task in asyncio.all_tasks():
+                if task is not asyncio.current_task():
+                    task.cancel()
+        
+        asyncio.run_coroutine_threadsafe(close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+    
+    async def _read_command(self, reader, write):
+        """リテラル（{n}）を含めて1コマンド分を読み取る"""
+        data = b''
+        while True:
+            line = await reader.readline()
+            if not line:
+                return None
+            self.bytes_received += len(line)
+            line = line.rstrip(b'\r\n')
+            match = _LITERAL_RE.search(line)
+            if not match:
+                return data + line
+            write(b'+ Ready for literal data\r\n')
+            literal = await reader.readexactly(int(match.group(1)))
+            self.bytes_received += len(literal)
+            data += line[:match.start()] + _inline_literal(literal)
+    
+    async def _handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        loop_thread = threading.get_ident()
+        
+        def write(data):
+            self.bytes_sent += len(data)
+            if threading.get_ident() == loop_thread:
+                writer.write(data)
+            else:
+                # deliver()は別スレッドから呼ばれるため、書き込みはイベントループに依頼する
+                loop.call_soon_threadsafe(writer.write, data)
+        
+        session = _Session(self, write)
+        session.greeting()
+        try:
+            while True:
+                line = await self._read_command(reader, write)
+                if line is None or not session.process(line):
+                    break
+                await writer.drain()
+        except (ConnectionError, OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            session.close()
+            writer.close()
@@ -1,38 +1,513 @@
 """Gmail監視機能モジュール"""
 import imaplib
-import email
-from email.header import decode_header
-from email.utils import parsedate_to_datetime
+import itertools
+import queue
+import select
+import ssl
+import threading
+import time
 from datetime import datetime, timedelta, timezone
 import logging
 
+from body_scanner import iter_body_text
+from imap_connection import STALE_ERRORS, ImapConnection
+from imap_utils import (
+    encode_mailbox_name, find_body_part, get_response_size, get_section, parse_fetch_response, parse_internaldate,
+)
+from mail_state import MailState, SeenCache
+from message_parser import MessageParser
+from metrics import metrics
+
 logger = logging.getLogger(__name__)
 
+# RFC 2177: サーバーは29分でIDLEを打ち切ることがあるため、その前にIDLEを再発行する
+IDLE_RENEW_SECONDS = 25 * 60
+
+# 第1段階で取得するヘッダー
+HEADER_FIELDS = 'FROM SUBJECT MESSAGE-ID'
+
+# 受信時刻だけを取得するFETCH項目
+INTERNALDATE_FETCH_ITEMS = '(UID INTERNALDATE)'
+
+# 第1段階（ヘッダーと構造）で取得するFETCH項目
+HEADER_FETCH_ITEMS = f'(UID INTERNALDATE RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])'
+
+
+def _quote(value):
+    """IMAPの検索条件用に文字列をクォート"""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
 
-class GmailMonitor:
-    """Gmail監視クラス"""
+
+def _uid_set(uids):
+    """UIDのリストをFETCH用のUIDセット文字列にする"""
+    return ','.join(str(uid) for uid in uids)
+
+
+def _to_int(value):
+    """FETCH応答の数値（bytes）を整数に変換"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class MatchResult:
+    """条件に合致したメールの情報
+    
+    照合の過程で取得・解析した内容を保持するため、呼び出し側はメールを再取得・再解析せずに
+    通知の内容やログ（受信から検出までの遅延など）を作れる。
+    """
     
-    def __init__(self, config_manager):
+    __slots__ = ('mailbox', 'uid', 'message_id', 'sender', 'subject', 'received', 'size', 'rule',
+                 'elapsed', 'detected_at')
+    
+    def __init__(self, mailbox, uid, message_id, sender, subject, received, size, rule, elapsed, detected_at):
+        """
+        Args:
+            mailbox: 監視対象の名前（アドレス/メールボックス）
+            uid: メールのUID
+            message_id: Message-IDヘッダー
+            sender: 送信者（デコード済み）
+            subject: 件名（デコード済み）
+            received: サーバーの受信日時（UTCのdatetime、不明ならNone）
+            size: メールのサイズ（バイト）
+            rule: 一致したRule
+            elapsed: チェック開始から一致するまでの秒数
+            detected_at: 一致した日時（UTCのdatetime）
+        """
+        self.mailbox = mailbox
+        self.uid = uid
+        self.message_id = message_id
+        self.sender = sender
+        self.subject = subject
+        self.received = received
+        self.size = size
+        self.rule = rule
+        self.elapsed = elapsed
+        self.detected_at = detected_at
+    
+    @property
+    def latency(self):
+        """受信から検出までの秒数（受信日時が不明ならNone）"""
+        if self.received is None:
+            return None
+        return (self.detected_at - self.received).total_seconds()
+    
+    def __repr__(self):
+        return f"MatchResult({self.mailbox!r}, uid={self.uid}, rule={self.rule.name!r}, subject={self.subject!r})"
+
+
+class BaseMailMonitor:
+    """メール監視の共通処理（検索条件の組み立てや取得結果の判定）
+    
+    通信処理はサブクラス（imaplibを使うGmailMonitor、asyncioを使うAsyncGmailMonitor）が実装する。
+    """
+    
+    def __init__(self, config_manager, state=None, account_section='Gmail', mailbox='INBOX',
+                 filter_section='Monitor', seen=None, parser=None):
+        """
+        Args:
+            config_manager: 設定管理
+            state: 処理済みUIDの保存先（複数の監視で共有する場合に指定）
+            account_section: 接続情報（email / password）を持つセクション
+            mailbox: 監視するメールボックス（ラベル）
+            filter_section: フィルター設定を持つセクション（無い項目は [Monitor] を使用）
+            seen: チェック済みメールのキャッシュ（複数の監視で共有する場合に指定）
+            parser: メールの解析に使うMessageParser（複数の監視で共有する場合に指定）
+        """
         self.config_manager = config_manager
-        self.imap = None
+        self.state = state or MailState.for_config(config_manager)
+        self.seen = seen or SeenCache.for_config(config_manager)
+        self.parser = parser or MessageParser.for_config(config_manager)
+        self.uidvalidity = None
+        self.account_section = account_section
+        self.mailbox = mailbox
+        self.filter_section = filter_section
         self.mailbox_selected = False
+        # 今のチェックで使う設定（WatchSettings）と照合ルール（設定のスナップショットでコンパイル済み）
+        self.settings = None
+        self.matcher = None
+        # 監視対象の名前と、今のチェックで使っている設定のスナップショット
+        # （名前はスナップショットが変わったときだけ組み立て直す）
+        self._name = None
+        self._snapshot = None
+    
+    @property
+    def name(self):
+        """ログ等に使う監視対象の名前（アドレス/メールボックス）
+        
+        メールごとに参照されるため、設定から組み立てた名前を設定のスナップショットが変わるまで使い回す。
+        """
+        if self._name is None:
+            self._name = f"{self.config_manager.get(self.account_section, 'email')}/{self.mailbox}"
+        return self._name
+    
+    def _load_settings(self):
+        """今回のチェックで使う設定を設定のスナップショットから取り出す
+        
+        チェックの途中で設定ファイルが読み直されても、チェックが終わるまでは同じ設定を使う。
+        """
+        snapshot = self.config_manager.snapshot
+        if snapshot is not self._snapshot:
+            self._snapshot = snapshot
+            self._name = None
+        self.settings = snapshot.watch(self.filter_section)
+        self.matcher = self.settings.matcher
+        return self.settings
+    
+    @property
+    def capabilities(self):
+        """サーバーのCAPABILITY（大文字の文字列のタプル）"""
+        raise NotImplementedError
+    
+    def supports_idle(self):
+        """IDLEで新着を待機できるか（設定で有効かつサーバーが対応）"""
+        if not self.config_manager.snapshot.use_idle:
+            return False
+        return 'IDLE' in self.capabilities
+    
+    def _has_gmail_search(self):
+        """GmailのX-GM-RAW検索が使えるか"""
+        return 'X-GM-EXT-1' in self.capabilities
+    
+    def _get_time_threshold(self, time_window_minutes):
+        """現在時刻から time_window_minutes 分前の時刻を計算"""
+        time_threshold = datetime.now(timezone.utc) - timedelta(minutes=time_window_minutes)
+        logger.info("受信時刻フィルター: %s 以降", time_threshold.strftime('%Y-%m-%d %H:%M:%S UTC'))
+        return time_threshold
+    
+    def _get_filters(self):
+        """サーバー側の検索に渡す送信者・キーワードフィルターを取得
+        
+        [Rule:*] でルールを設定している場合は、ルールをまとめて検索条件にできないため
+        サーバー側では絞り込まず、照合は全てMatcherで行う。
+        """
+        sender_filter = self.settings.sender_filter
+        keyword_filter = self.settings.keyword_filter
+        if self.matcher.custom:
+            logger.info("照合ルール: %s", ', '.join(rule.name for rule in self.matcher.rules))
+            return '', ''
+        logger.info("フィルター条件 - 送信者: '%s', キーワード: '%s'", sender_filter, keyword_filter)
+        return sender_filter, keyword_filter
+    
+    def _build_search_criteria(self, last_uid, time_threshold, sender_filter, keyword_filter):
+        """UID SEARCHの検索条件を組み立てる
+        
+        server_filter = true の場合は、送信者・キーワードフィルターをサーバー側の検索条件（FROM / BODY、
+        GmailではX-GM-RAW）に変換し、候補をサーバー側で絞り込む。
+        Gmailの検索は単語単位のため、最終判定はこれまで通りクライアント側で行う。
+        Gmailでは受信時刻も after:<UNIX時刻> で秒単位まで絞り込む。
+        
+        Returns:
+            (検索条件の引数リスト, 最後の条件の値として送るリテラル（bytes）またはNone)
+        """
+        criteria = []
+        if last_uid is not None:
+            criteria += ['UID', f'{last_uid + 1}:*']
+        criteria += ['UNSEEN', 'SINCE', time_threshold.strftime('%d-%b-%Y')]
+        
+        server_filter = self.settings.server_filter
+        literal = None
+        if self._has_gmail_search():
+            # Gmailの検索構文で送信者・キーワード・受信時刻をまとめて指定
+            terms = []
+            if server_filter and sender_filter:
+                terms.append(f'from:({sender_filter})')
+            if server_filter and keyword_filter:
+                terms.append('"' + keyword_filter.replace('"', ' ') + '"')
+            terms.append(f'after:{int(time_threshold.timestamp())}')
+            query = ' '.join(terms)
+            criteria.append('X-GM-RAW')
+            if query.isascii():
+                criteria.append(_quote(query))
+            else:
+                literal = query.encode('utf-8')
+        elif server_filter:
+            # imaplibはリテラルを1つしか送れないため、非ASCIIの条件は最後の1つだけサーバーに渡す
+            non_ascii = None
+            for key, value in (('FROM', sender_filter), ('BODY', keyword_filter)):
+                if not value:
+                    continue
+                if value.isascii():
+                    criteria += [key, _quote(value)]
+                else:
+                    non_ascii = (key, value)
+            if non_ascii:
+                criteria.append(non_ascii[0])
+                literal = non_ascii[1].encode('utf-8')
+        
+        if literal is not None:
+            criteria = ['CHARSET', 'UTF-8'] + criteria
+        return criteria, literal
+    
+    def _get_new_uids(self, search_data, last_uid, time_threshold):
+        """SEARCH結果から未処理のUIDを取り出す"""
+        # 「n:*」は該当が無くても最大UIDを返すため、処理済みUIDは除外する
+        mail_uids = [int(uid) for uid in (search_data or b'').split() if last_uid is None or int(uid) > last_uid]
+        range_label = f"UID {last_uid}より後" if last_uid is not None else "初回"
+        logger.info("未読メール数（%s以降、%s）: %s", time_threshold.strftime('%d-%b-%Y'), range_label, len(mail_uids))
+        return mail_uids
+    
+    def _get_next_last_uid(self, last_uid, mail_uids, uidnext, max_uid=0):
+        """次回の検索の起点となる処理済みUIDを計算（今回見えている最大UID）"""
+        new_last_uid = max([last_uid or 0, max_uid] + mail_uids)
+        if uidnext:
+            new_last_uid = max(new_last_uid, uidnext - 1)
+        return new_last_uid
+    
+    def _get_uids_in_window(self, fetched, time_threshold):
+        """INTERNALDATEの取得結果から、受信時刻が範囲内のUIDだけを返す
+        
+        SINCEは日付単位でしか絞り込めないため、ヘッダーを取得する前に
+        サーバーの受信時刻で範囲外のメールを除外する。
+        """
+        in_window = []
+        for entry in fetched:
+            received = parse_internaldate(entry.get('INTERNALDATE'))
+            uid = _to_int(entry.get('UID'))
+            if uid is not None and (received is None or received >= time_threshold):
+                in_window.append(uid)
+        logger.info("受信時刻が範囲内のメール数: %s", len(in_window))
+        return in_window
+    
+    def _get_fetch_chunks(self, mail_uids):
+        """取得対象のUIDを古い順にfetch_chunk_size件ずつに分ける"""
+        chunk_size = self.settings.fetch_chunk_size
+        mail_uids = sorted(mail_uids)
+        return [mail_uids[i:i + chunk_size] for i in range(0, len(mail_uids), chunk_size)]
+    
+    def _get_headers(self, fetched):
+        """FETCH結果から解析に渡す (ヘッダーのbytes, INTERNALDATE) のリストを作成"""
+        return [
+            (get_section(item, f'HEADER.FIELDS ({HEADER_FIELDS})') or b'', item.get('INTERNALDATE'))
+            for item in fetched
+        ]
+    
+    def _evaluate_headers(self, fetched, parsed, time_threshold, time_window_minutes, started, candidates):
+        """各メールのヘッダーで受信時刻と送信者をチェック
+        
+        本文を見ずに一致したメールのMatchResultを順に返し、本文の確認が必要なメールは
+        (FETCH結果, ヘッダー) としてcandidatesに追加する。
+        
+        Args:
+            fetched: ヘッダーのFETCH結果
+            parsed: fetchedを解析したMessageFieldsのリスト（_parse_headersの結果）
+        """
+        name = self.name
+        metrics.increment('messages_scanned', len(fetched), mailbox=name)
+        # メールごとの詳細なログは出力されるレベルの場合だけ組み立てる
+        # （送信者・件名のデコードも、ログにも照合結果にも使わないメールでは行わない）
+        verbose = logger.isEnabledFor(logging.INFO)
+        for i, (item, fields) in enumerate(zip(fetched, parsed), 1):
+            if verbose:
+                logger.info("メール %d/%d をチェック中 (UID %s, %sバイト)", i, len(fetched),
+                            _to_int(item.get('UID')), _to_int(item.get('RFC822.SIZE')))
+            
+            # 受信時刻（サーバーの受信日時）をチェック
+            received = fields.received
+            if received is not None:
+                if verbose:
+                    logger.info("  受信時刻: %s", received.strftime('%Y-%m-%d %H:%M:%S %Z'))
+                
+                # 時間範囲外のメールはスキップ
+                if received < time_threshold:
+                    logger.info("  → 受信時刻が範囲外（%s分以上前）のためスキップ", time_window_minutes)
+                    continue
+            
+            if verbose:
+                logger.info("  送信者: %s", fields.sender)
+                logger.info("  件名: %s", fields.subject)
+            
+            # 一度チェックしたメールは照合も警告もしない（別のメールボックスにある同じメールも含む）
+            seen_key = self._get_seen_key(item, fields)
+            if seen_key in self.seen:
+                logger.info("  → チェック済みのメールのためスキップ")
+                continue
+            
+            # 送信者をチェック
+            with metrics.span('filter', mailbox=name):
+                rule, needs_body = self.matcher.match_headers(fields.from_header)
+            if rule:
+                # 本文を見る必要が無いので、ここで条件に合致
+                logger.info("  ✓ 条件に合致しました！（ルール: %s）", rule.name)
+                self.seen.add(seen_key)
+                yield self._make_result(item, fields, rule, started)
+                continue
+            
+            if not needs_body:
+                logger.info("  → 送信者フィルターに一致せず")
+                self.seen.add(seen_key)
+                continue
+            
+            candidates.append((item, fields))
+    
+    def _make_result(self, item, fields, rule, started):
+        """一致したメールのMatchResultを作成"""
+        metrics.increment('matches', mailbox=self.name)
+        return MatchResult(
+            mailbox=self.name,
+            uid=_to_int(item.get('UID')),
+            message_id=fields.message_id,
+            sender=fields.sender,
+            subject=fields.subject,
+            received=fields.received,
+            size=_to_int(item.get('RFC822.SIZE')),
+            rule=rule,
+            elapsed=time.monotonic() - started,
+            detected_at=datetime.now(timezone.utc),
+        )
+    
+    def _plan_text_bodies(self, candidates):
+        """BODYSTRUCTUREから本文パート（text/plain、無ければtext/html）を探し、パート番号ごとにUIDをまとめる
+        
+        Returns:
+            ({UID: (パート番号, 転送エンコーディング, 文字コード, サブタイプ)}, {パート番号: [UID, ...]})
+        """
+        parts = {}
+        groups = {}
+        for item, _ in candidates:
+            uid = _to_int(item.get('UID'))
+            body_part = find_body_part(item.get('BODYSTRUCTURE'))
+            if body_part is None:
+                logger.debug("  UID %s: テキストの本文パートがありません", uid)
+                continue
+            parts[uid] = body_part
+            groups.setdefault(body_part[0], []).append(uid)
+        return parts, groups
+    
+    def _get_body_fetch_items(self, section):
+        """本文パートを取得するFETCH項目（body_fetch_limitバイトまでの部分取得）"""
+        limit = self.settings.body_fetch_limit
+        partial = f'<0.{limit}>' if limit > 0 else ''
+        return f'(UID BODY.PEEK[{section}]{partial})'
+    
+    def _collect_text_bodies(self, fetched, section, parts, bodies):
+        """取得した本文パートをbodies（{UID: (データ, 転送エンコーディング, 文字コード, サブタイプ)}）に追加
+        
+        デコードは照合時にチャンクごとに行う（一致した時点で残りはデコードしない）。
+        """
+        for entry in fetched:
+            uid = _to_int(entry.get('UID'))
+            if uid not in parts:
+                continue
+            payload = get_section(entry, section)
+            if payload is None:
+                continue
+            _, encoding, charset, sub_type = parts[uid]
+            bodies[uid] = (payload, encoding, charset, sub_type)
+    
+    def _evaluate_bodies(self, candidates, bodies, texts, failed, started):
+        """本文をルールと照合し、一致したメールのMatchResultを順に返す
+        
+        本文を取得できなかったメール（failed）は照合もチェック済みにもせず、次回のチェックに回す。
+        
+        Args:
+            bodies: 取得した本文パート（_fetch_text_bodiesの結果）
+            texts: bodiesをテキストにしたもの（MessageParser.body_textsの結果）
+        """
+        name = self.name
+        verbose = logger.isEnabledFor(logging.INFO)
+        for item, fields in candidates:
+            uid = _to_int(item.get('UID'))
+            logger.info("メール UID %s の本文をチェック中", uid)
+            if uid in failed:
+                logger.info("  → 本文を取得できなかったため、次回のチェックで照合し直します")
+                continue
+            
+            payload, encoding, charset, sub_type = bodies.get(uid, (b'', None, None, 'plain'))
+            chunks = iter(texts.get(uid, ()))
+            first_chunk = next(chunks, '')
+            if not first_chunk:
+                logger.info("  本文: (取得できませんでした)")
+            elif verbose:
+                logger.info("  本文: %dバイト（text/%s, %s, %s）", len(payload), sub_type, encoding, charset)
+                logger.info("  本文プレビュー: %s...", first_chunk[:100].replace('\n', ' '))
+            
+            # 本文は照合しながらデコードするため、デコードの時間もfilterに含まれる
+            with metrics.span('filter', mailbox=name):
+                rule = self.matcher.match_stream(fields.from_header, itertools.chain([first_chunk], chunks))
+            self.seen.add(self._get_seen_key(item, fields))
+            if rule is None:
+                logger.info("  → キーワードフィルターに一致せず")
+                continue
+            
+            # 条件に合致
+            logger.info("  ✓ 条件に合致しました！（ルール: %s）", rule.name)
+            yield self._make_result(item, fields, rule, started)
+    
+    def _get_failed_bodies(self, parts, bodies):
+        """本文パートがあるのに取得できなかったメールのUIDの集合"""
+        failed = {uid for uid in parts if uid not in bodies}
+        if failed:
+            logger.warning("本文を取得できなかったメール: %d件（次回のチェックで照合し直します）", len(failed))
+        return failed
+    
+    def _limit_last_uid(self, last_uid, retry_uid):
+        """照合し直すメール（retry_uid以降）が次回の検索に含まれるよう、処理済みUIDをその手前までにする"""
+        if retry_uid is None:
+            return last_uid
+        return min(last_uid, retry_uid - 1)
+    
+    def _get_seen_key(self, item, fields):
+        """チェック済みキャッシュのキー（Message-ID、無ければメールボックスとUID）"""
+        if fields.message_id:
+            return fields.message_id
+        return f"{self.name}/{self.uidvalidity}/{_to_int(item.get('UID'))}"
+    
+    def _get_email_body(self, msg):
+        """メール本文を取得（text/plainが無ければtext/htmlのタグを除いたテキスト）
+        
+        テキスト以外のパート（添付ファイルなど）はデコードせずに読み飛ばす。
+        """
+        parts = [part for part in msg.walk() if part.get_content_maintype() == 'text']
+        for sub_type in ('plain', 'html'):
+            texts = []
+            for part in parts:
+                if part.get_content_subtype() != sub_type:
+                    continue
+                payload = part.get_payload(decode=False)
+                encoding = part.get('Content-Transfer-Encoding', '7bit').strip()
+                charset = part.get_content_charset() or 'utf-8'
+                if isinstance(payload, str):
+                    try:
+                        payload = payload.encode('ascii', errors='surrogateescape')
+                    except UnicodeEncodeError:
+                        # 8bitの本文は、emailパッケージが文字コードでデコードした文字列を返す
+                        payload = payload.encode(charset, errors='replace')
+                texts.extend(iter_body_text(payload, encoding, charset, sub_type))
+            if texts:
+                logger.debug("  text/%s パートから本文を取得しました", sub_type)
+                return ''.join(texts)
+        
+        logger.debug("  本文が取得できませんでした")
+        return ""
+
+
+class GmailMonitor(BaseMailMonitor):
+    """Gmail監視クラス（imaplibで1アカウントの1メールボックスを監視）"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 接続の管理（タイムアウト・死活確認・再接続）と、ログイン中のimaplibの接続
+        self.connection = None
+        self.imap = None
+        # ヘッダーの先読みスレッドとチェック処理が同じ接続でコマンドを送るためのロック
+        self._imap_lock = threading.Lock()
     
     def connect(self):
         """Gmailに接続"""
-        email_addr = self.config_manager.get('Gmail', 'email')
-        password = self.config_manager.get('Gmail', 'password')
-        
-        # アプリパスワードのスペースを削除
-        password = password.replace(' ', '')
+        if self.connection is None:
+            self.connection = ImapConnection.for_account(self.config_manager, self.account_section)
         
         try:
-            logger.info(f"Gmailに接続中: {email_addr}")
-            self.imap = imaplib.IMAP4_SSL('imap.gmail.com', 993)
-            self.imap.login(email_addr, password)
+            logger.info("Gmailに接続中: %s", self.connection.email)
+            with metrics.span('connect', mailbox=self.name):
+                self.imap = self.connection.open()
             logger.info("Gmail接続成功")
             return True
         except Exception as e:
-            logger.error(f"Gmail接続エラー: {str(e)}")
+            metrics.increment('errors', mailbox=self.name, stage='connect')
+            logger.error("Gmail接続エラー: %s", e)
             raise Exception(f"Gmail接続エラー: {str(e)}")
     
     def disconnect(self):
@@ -44,186 +519,360 @@ class GmailMonitor:
                 if self.mailbox_selected:
                     self.imap.close()
                     self.mailbox_selected = False
-                self.imap.logout()
+                self.connection.close()
                 logger.info("Gmail接続を切断しました")
             except Exception as e:
-                logger.warning(f"切断時にエラー: {str(e)}")
+                logger.warning("切断時にエラー: %s", e)
+                self.connection.abandon()
             self.imap = None
             self.mailbox_selected = False
     
-    def check_new_mail(self, time_window_minutes=2):
-        """未読メールをチェックし、条件に合致するメールがあるか確認
+    def _abandon_connection(self):
+        """応答しなくなった接続をLOGOUTせずに捨てる（次のチェックで接続し直す）"""
+        if self.connection is not None:
+            self.connection.abandon()
+        self.imap = None
+        self.mailbox_selected = False
+    
+    def ensure_connected(self):
+        """接続が無い場合や応答しなくなった場合に接続（常時接続モードでセッションを使い回す）"""
+        if self.imap is None:
+            self.connect()
+            return
+        if not self.connection.is_alive():
+            logger.info("%s: 接続を張り直します", self.name)
+            self.mailbox_selected = False
+            try:
+                self.imap = self.connection.reconnect()
+            except Exception as e:
+                self.imap = None
+                raise Exception(f"Gmail接続エラー: {str(e)}")
+    
+    @property
+    def capabilities(self):
+        """サーバーのCAPABILITY（未接続なら空）"""
+        return self.imap.capabilities if self.imap else ()
+    
+    def supports_idle(self):
+        """IDLEで新着を待機できるか（設定で有効かつサーバーが対応）"""
+        return self.imap is not None and super().supports_idle()
+    
+    def wait_for_new_mail(self, poll_interval, should_stop=None):
+        """次のチェックまで待機
+        
+        IDLE対応サーバーでは新着通知を受けるまで（最長でpoll_interval秒とIDLE再発行周期の短い方まで）待機し、
+        非対応の場合は poll_interval 秒待機する（ポーリングへのフォールバック）。
+        ポーリングの待機中もnoop_intervalごとにNOOPを送り、接続を保つ（新着の通知があれば戻る）。
         
         Args:
-            time_window_minutes: 何分以内に受信したメールを対象とするか（デフォルト: 2分）
+            poll_interval: 待機する最長の秒数（ポーリング時はこの秒数だけ待つ）
+            should_stop: 待機を中断すべきときにTrueを返す関数
+        
+        Returns:
+            IDLE・NOOPで新着メールの通知を受けた場合はTrue
         """
         try:
-            logger.info("メールチェック開始")
+            if self.supports_idle() and self.mailbox_selected:
+                return self._idle(min(poll_interval, IDLE_RENEW_SECONDS), should_stop)
             
-            # INBOXを選択
-            self.imap.select('INBOX')
+            deadline = time.monotonic() + poll_interval
+            while time.monotonic() < deadline:
+                if should_stop and should_stop():
+                    break
+                if self.imap is not None and self.connection.idle_seconds() >= self.connection.noop_interval:
+                    if self.connection.noop():
+                        logger.info("NOOPで新着メールの通知を受信しました")
+                        return True
+                time.sleep(min(1.0, max(0.0, deadline - time.monotonic())))
+            return False
+        except STALE_ERRORS:
+            self._abandon_connection()
+            raise
+    
+    def _idle(self, timeout, should_stop=None):
+        """IMAP IDLE（RFC 2177）で新着メールの通知を待つ"""
+        tag = b'IDLE%d' % int(time.monotonic() * 1000)
+        self.imap.send(tag + b' IDLE\r\n')
+        response = self.imap.readline()
+        if not response.startswith(b'+'):
+            raise imaplib.IMAP4.error(f"IDLEの開始に失敗しました: {response!r}")
+        logger.debug("IDLE開始")
+        
+        got_mail = False
+        deadline = time.monotonic() + timeout
+        try:
+            while not got_mail:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or (should_stop and should_stop()):
+                    break
+                # 停止要求に素早く反応できるよう1秒単位で待つ
+                if not self._wait_readable(min(1.0, remaining)):
+                    continue
+                line = self.imap.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("IDLE中に接続が切断されました")
+                logger.debug("IDLE応答: %r", line)
+                if line.startswith(b'* BYE'):
+                    raise imaplib.IMAP4.abort(f"サーバーが接続を終了しました: {line!r}")
+                if line.rstrip().endswith((b'EXISTS', b'RECENT')):
+                    got_mail = True
+        finally:
+            self.imap.send(b'DONE\r\n')
+            # IDLE終了のタグ付き応答まで読み捨てる
+            while True:
+                line = self.imap.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("IDLE終了時に接続が切断されました")
+                if line.startswith(tag + b' '):
+                    if not line[len(tag) + 1:].startswith(b'OK'):
+                        raise imaplib.IMAP4.error(f"IDLEの終了に失敗しました: {line!r}")
+                    break
+        
+        if got_mail:
+            logger.info("IDLEで新着メールの通知を受信しました")
+        return got_mail
+    
+    def _wait_readable(self, timeout):
+        """読み取れる応答が届くまで最大timeout秒待つ"""
+        # 読み取りバッファに残っている応答（「+ idling」と同時に届いた通知など）にはselectが反応しない
+        if self._has_buffered_data():
+            return True
+        readable, _, _ = select.select([self.imap.socket()], [], [], timeout)
+        return bool(readable)
+    
+    def _has_buffered_data(self):
+        """imaplibの読み取りバッファ（self.imap.file）やTLSの復号済みデータに未読の応答があるか
+        
+        ソケットを一時的にノンブロッキングにしてpeekするため、届いていなければ待たずにFalseを返す。
+        """
+        sock = self.imap.socket()
+        if isinstance(sock, ssl.SSLSocket) and sock.pending():
+            return True
+        timeout = sock.gettimeout()
+        sock.settimeout(0)
+        try:
+            return bool(self.imap.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(timeout)
+    
+    def check_new_mail(self, time_window_minutes=None, first_only=False):
+        """未読メールをチェックし、条件に合致したメールのリストを返す
+        
+        Args:
+            time_window_minutes: 何分以内に受信したメールを対象とするか（省略時は設定値、デフォルト: 2分）
+            first_only: 最初に合致したメールで打ち切るか（残りのメールは次回のチェックで照合する）
+        
+        Returns:
+            MatchResultのリスト（合致するメールが無ければ空のリスト）
+        """
+        matches = self.iter_matches(time_window_minutes)
+        try:
+            return list(itertools.islice(matches, 1 if first_only else None))
+        finally:
+            matches.close()
+    
+    def iter_matches(self, time_window_minutes=None):
+        """未読メールをチェックし、条件に合致したメールのMatchResultを見つかった順に返す
+        
+        メールはfetch_chunk_size件ずつ取得し、あるチャンクを照合している間に次のチャンクの
+        ヘッダーを別スレッドで先読みする。ヘッダーだけで一致したメールは本文を取得する前に返す。
+        途中で反復をやめた場合、処理済みUIDは照合し終えたチャンクまでしか進めないため、
+        残りのメールは次回のチェックで照合される。
+        
+        Args:
+            time_window_minutes: 何分以内に受信したメールを対象とするか（省略時は設定値、デフォルト: 2分）
+        """
+        settings = self._load_settings()
+        if time_window_minutes is None:
+            time_window_minutes = settings.time_window_minutes
+        
+        started = time.monotonic()
+        match_count = 0
+        # 本文を取得できなかった最初のUID（処理済みUIDをこの手前で止め、次回のチェックで照合し直す）
+        retry_uid = None
+        try:
+            logger.info("メールチェック開始: %s", self.name)
+            
+            # メールボックスを選択
+            with metrics.span('select', mailbox=self.name):
+                self.imap.select(_quote(encode_mailbox_name(self.mailbox)))
             self.mailbox_selected = True
+            uidvalidity = self.uidvalidity = self._get_response_int('UIDVALIDITY')
+            uidnext = self._get_response_int('UIDNEXT')
+            
+            # 前回までに処理したUID（UIDVALIDITYが変わった場合や初回はNone）
+            last_uid = self.state.get_last_uid(self.name, uidvalidity)
             
-            # 現在時刻から time_window_minutes 分前の時刻を計算
-            now = datetime.now(timezone.utc)
-            time_threshold = now - timedelta(minutes=time_window_minutes)
-            logger.info(f"受信時刻フィルター: {time_threshold.strftime('%Y-%m-%d %H:%M:%S UTC')} 以降")
+            time_threshold = self._get_time_threshold(time_window_minutes)
+            sender_filter, keyword_filter = self._get_filters()
             
-            # 未読メールを検索（IMAPのSINCEは日付のみなので、後でDateヘッダーで厳密にチェック）
-            # まずは今日の日付でフィルタリング
-            search_date = time_threshold.strftime('%d-%b-%Y')
-            status, messages = self.imap.search(None, f'UNSEEN SINCE {search_date}')
+            # 未読メールを検索（SINCEは日付単位のため、Gmail以外では後でINTERNALDATEで厳密にチェック）
+            # 前回処理済みのUIDより後ろだけを対象にし、フィルターもサーバー側の検索条件に含める
+            criteria, literal = self._build_search_criteria(last_uid, time_threshold, sender_filter, keyword_filter)
+            logger.info("検索条件: %s%s", ' '.join(criteria), ' (+リテラル)' if literal else '')
+            self.imap.literal = literal
+            with metrics.span('search', mailbox=self.name):
+                status, messages = self.imap.uid('SEARCH', *criteria)
             if status != 'OK':
                 logger.warning("未読メール検索が失敗しました")
-                return False
+                return
             
-            mail_ids = messages[0].split()
-            logger.info(f"未読メール数（{search_date}以降）: {len(mail_ids)}")
+            mail_uids = self._get_new_uids(messages[0], last_uid, time_threshold)
+            max_uid = self._get_max_uid() if uidnext is None and last_uid is None else 0
+            new_last_uid = self._get_next_last_uid(last_uid, mail_uids, uidnext, max_uid)
             
-            if not mail_ids:
-                logger.info("未読メールはありません")
-                return False
+            # Gmail以外では受信時刻（INTERNALDATE）だけを先に取得し、範囲外のメールはダウンロードしない
+            if mail_uids and not self._has_gmail_search():
+                with metrics.span('fetch', mailbox=self.name):
+                    status, msg_data = self.imap.uid('FETCH', _uid_set(mail_uids), INTERNALDATE_FETCH_ITEMS)
+                metrics.increment('bytes_fetched', get_response_size(msg_data), mailbox=self.name)
+                if status == 'OK':
+                    mail_uids = self._get_uids_in_window(parse_fetch_response(msg_data), time_threshold)
+                else:
+                    logger.warning("受信時刻の一括取得に失敗しました")
             
-            # フィルター条件を取得
-            sender_filter = self.config_manager.get('Monitor', 'sender_filter').strip()
-            keyword_filter = self.config_manager.get('Monitor', 'keyword_filter').strip()
-            logger.info(f"フィルター条件 - 送信者: '{sender_filter}', キーワード: '{keyword_filter}'")
+            if not mail_uids:
+                logger.info("未読メールはありません")
+                self.state.set_last_uid(self.name, uidvalidity, new_last_uid)
+                return
             
-            # 全メールを一括ダウンロード（通信は1回だけ）
-            mail_ids_str = b','.join(mail_ids).decode('ascii')
-            logger.info(f"メールを一括ダウンロード中: {len(mail_ids)}件")
-            status, msg_data = self.imap.fetch(mail_ids_str, '(RFC822)')
-            if status != 'OK':
-                logger.warning("メールの一括取得に失敗しました")
-                return False
-            
-            # 取得したメールデータをパース
-            # msg_dataはタプルのリストで、メッセージデータはbytes型の大きなデータとして含まれる
-            mail_messages = []
-            for item in msg_data:
-                if isinstance(item, tuple) and len(item) >= 2:
-                    # 2番目の要素がメッセージデータ（bytes型で大きなサイズ）
-                    if isinstance(item[1], bytes) and len(item[1]) > 100:
-                        mail_messages.append(item[1])
-            
-            logger.info(f"ダウンロード完了: {len(mail_messages)}件のメールデータを取得")
-            
-            # 各メールをチェック
-            for i, msg_bytes in enumerate(mail_messages, 1):
-                logger.info(f"メール {i}/{len(mail_messages)} をチェック中")
-                
-                # メールをパース
-                msg = email.message_from_bytes(msg_bytes)
+            # 第1段階: ヘッダー・構造だけをチャンクごとに取得（本文や添付ファイルはダウンロードしない）
+            # BODY.PEEKを使うため、取得しても既読（\Seen）にはならない
+            chunks = self._get_fetch_chunks(mail_uids)
+            logger.info("メールのヘッダーを取得中: %d件（%d回に分けて取得）", len(mail_uids), len(chunks))
+            for chunk, fetched in self._iter_header_chunks(chunks):
+                if fetched is None:
+                    logger.warning("メールヘッダーの一括取得に失敗しました")
+                    return
+                logger.info("ヘッダー取得完了: %d件（UID %s〜%s）", len(fetched), chunk[0], chunk[-1])
                 
-                # 受信時刻をチェック
-                date_header = msg.get('Date', '')
-                if date_header:
-                    try:
-                        mail_date = parsedate_to_datetime(date_header)
-                        # タイムゾーンを考慮して比較
-                        if mail_date.tzinfo is None:
-                            mail_date = mail_date.replace(tzinfo=timezone.utc)
-                        
-                        logger.info(f"  受信時刻: {mail_date.strftime('%Y-%m-%d %H:%M:%S %Z')}")
-                        
-                        # 時間範囲外のメールはスキップ
-                        if mail_date < time_threshold:
-                            logger.info(f"  → 受信時刻が範囲外（{time_window_minutes}分以上前）のためスキップ")
-                            continue
-                    except Exception as e:
-                        logger.warning(f"  受信時刻の解析エラー: {e}")
-                        # 受信時刻が解析できない場合は処理を続行
-                
-                # 送信者をチェック
-                from_header = msg.get('From', '')
-                subject = msg.get('Subject', '')
-                
-                # ヘッダーをデコード
-                from_decoded = self._decode_header(from_header)
-                subject_decoded = self._decode_header(subject)
+                # ヘッダーをまとめて解析（件数が多ければプロセスプールで並列に解析）
+                with metrics.span('parse', mailbox=self.name):
+                    parsed = self.parser.parse_headers(self._get_headers(fetched))
+                candidates = []
+                for result in self._evaluate_headers(
+                    fetched, parsed, time_threshold, time_window_minutes, started, candidates
+                ):
+                    match_count += 1
+                    yield result
                 
-                logger.info(f"  送信者: {from_decoded}")
-                logger.info(f"  件名: {subject_decoded}")
+                # 第2段階: 送信者・時刻の条件を満たしたメールだけ本文（text/plain）を取得
+                bodies, failed = self._fetch_text_bodies(candidates)
+                texts = self.parser.body_texts(bodies)
+                for result in self._evaluate_bodies(candidates, bodies, texts, failed, started):
+                    match_count += 1
+                    yield result
+                if failed and retry_uid is None:
+                    retry_uid = min(failed)
                 
-                if sender_filter and sender_filter.lower() not in from_header.lower():
-                    logger.info("  → 送信者フィルターに一致せず")
-                    continue
-                
-                # 本文をチェック
-                body = self._get_email_body(msg)
-                if body:
-                    body_length = len(body)
-                    body_preview = body[:100].replace('\n', ' ')
-                    logger.info(f"  本文: {body_length}文字")
-                    logger.info(f"  本文プレビュー: {body_preview}...")
-                else:
-                    logger.info("  本文: (取得できませんでした)")
-                
-                if keyword_filter and keyword_filter.lower() not in body.lower():
-                    logger.info("  → キーワードフィルターに一致せず")
-                    continue
-                
-                # 条件に合致
-                logger.info("  ✓ 条件に合致しました！")
-                return True
+                # このチャンクは照合し終えたので処理済みUIDを進める（最後のチャンクでは今回見えている最大UIDまで）
+                chunk_last_uid = new_last_uid if chunk is chunks[-1] else chunk[-1]
+                self.state.set_last_uid(self.name, uidvalidity, self._limit_last_uid(chunk_last_uid, retry_uid))
             
-            logger.info("条件に合致するメールはありませんでした")
-            return False
+            if match_count:
+                logger.info("条件に合致したメール: %d件", match_count)
+            else:
+                logger.info("条件に合致するメールはありませんでした")
             
         except Exception as e:
-            logger.error(f"メールチェックエラー: {str(e)}")
+            metrics.increment('errors', mailbox=self.name, stage='check')
+            logger.error("メールチェックエラー: %s", e)
+            if isinstance(e, STALE_ERRORS):
+                # 応答の無い接続にLOGOUTを送って待たないよう、ここで捨てる
+                self._abandon_connection()
             raise Exception(f"メールチェックエラー: {str(e)}")
+        finally:
+            self.seen.save()
     
-    def _decode_header(self, header_value):
-        """メールヘッダーをデコード"""
-        if not header_value:
-            return ""
+    def _fetch(self, uids, items):
+        """UID FETCHを実行して解析済みの結果を返す（失敗した場合はNone）
         
-        decoded_parts = []
-        for part, encoding in decode_header(header_value):
-            if isinstance(part, bytes):
-                # エンコーディングが指定されている場合はそれを使用、なければutf-8
-                decoded_parts.append(part.decode(encoding or 'utf-8', errors='ignore'))
-            else:
-                decoded_parts.append(str(part))
-        
-        return ''.join(decoded_parts)
+        ヘッダーの先読みスレッドと同じ接続を使うため、コマンドはロックで1つずつ送る。
+        """
+        with self._imap_lock, metrics.span('fetch', mailbox=self.name):
+            status, msg_data = self.imap.uid('FETCH', _uid_set(uids), items)
+        metrics.increment('bytes_fetched', get_response_size(msg_data), mailbox=self.name)
+        if status != 'OK':
+            return None
+        return parse_fetch_response(msg_data)
     
-    def _get_email_body(self, msg):
-        """メール本文を取得"""
-        body = ""
-        
-        if msg.is_multipart():
-            logger.debug("  メールはマルチパート形式です")
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                logger.debug(f"    パート: {content_type}")
-                if content_type == "text/plain":
-                    try:
-                        payload = part.get_payload(decode=True)
-                        if payload:
-                            charset = part.get_content_charset() or 'utf-8'
-                            decoded_text = payload.decode(charset, errors='ignore')
-                            body += decoded_text
-                            logger.debug(f"    text/plain パートを取得: {len(decoded_text)} 文字")
-                    except Exception as e:
-                        logger.debug(f"    text/plain パートのデコードエラー: {e}")
-        else:
-            logger.debug("  メールはシングルパート形式です")
-            try:
-                content_type = msg.get_content_type()
-                logger.debug(f"  コンテンツタイプ: {content_type}")
-                payload = msg.get_payload(decode=True)
-                if payload:
-                    charset = msg.get_content_charset() or 'utf-8'
-                    body = payload.decode(charset, errors='ignore')
-                    logger.debug(f"  本文を取得: {len(body)} 文字")
-            except Exception as e:
-                logger.debug(f"  本文のデコードエラー: {e}")
+    def _iter_header_chunks(self, chunks):
+        """チャンクごとにヘッダーを取得し、(チャンク, 解析済みのFETCH結果) を順に返す
         
-        if not body:
-            logger.debug("  本文が取得できませんでした")
+        2チャンク以上ある場合は、呼び出し元が照合している間に次のチャンクを別スレッドで取得する。
+        先読みは1チャンクまでなので、保持する取得結果は最大2チャンク分になる。
+        """
+        if len(chunks) == 1:
+            yield chunks[0], self._fetch(chunks[0], HEADER_FETCH_ITEMS)
+            return
         
-        return body
-
-
+        prefetched = queue.Queue(maxsize=1)
+        cancel = threading.Event()
+        
+        def put(entry):
+            # 呼び出し元が反復をやめた場合は待たずに終了する
+            while not cancel.is_set():
+                try:
+                    prefetched.put(entry, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def prefetch():
+            for chunk in chunks:
+                try:
+                    entry = (chunk, self._fetch(chunk, HEADER_FETCH_ITEMS), None)
+                except Exception as e:
+                    put((chunk, None, e))
+                    return
+                if not put(entry) or entry[1] is None:
+                    return
+        
+        worker = threading.Thread(target=prefetch, name=f'prefetch-{self.mailbox}', daemon=True)
+        worker.start()
+        try:
+            for _ in chunks:
+                chunk, fetched, error = prefetched.get()
+                if error:
+                    raise error
+                yield chunk, fetched
+                if fetched is None:
+                    return
+        finally:
+            cancel.set()
+            worker.join()
+    
+    def _fetch_text_bodies(self, candidates):
+        """候補のメールの本文パートをパート番号ごとにまとめて取得
+        
+        Returns:
+            (本文 {UID: (データ, 転送エンコーディング, 文字コード, サブタイプ)}, 本文を取得できなかったUIDの集合)
+        """
+        parts, groups = self._plan_text_bodies(candidates)
+        bodies = {}
+        for section, uids in groups.items():
+            logger.info("本文（パート %s）を取得中: %d件", section, len(uids))
+            fetched = self._fetch(uids, self._get_body_fetch_items(section))
+            if fetched is None:
+                logger.warning("本文の取得に失敗しました")
+                continue
+            self._collect_text_bodies(fetched, section, parts, bodies)
+        return bodies, self._get_failed_bodies(parts, bodies)
+    
+    def _get_response_int(self, name):
+        """SELECT応答のレスポンスコード（UIDVALIDITY等）を整数で取得"""
+        _, data = self.imap.response(name)
+        try:
+            return int(data[-1])
+        except (TypeError, ValueError, IndexError):
+            return None
+    
+    def _get_max_uid(self):
+        """メールボックス内の最大UIDを取得（UIDNEXT非対応サーバー用）"""
+        status, data = self.imap.uid('SEARCH', 'UID *')
+        if status != 'OK' or not data or not data[0]:
+            return 0
+        return max(int(uid) for uid in data[0].split())
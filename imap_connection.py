@@ -0,0 +1,225 @@
+"""IMAP接続の管理モジュール（タイムアウト・NOOPでの死活確認・再接続）
+
+imaplibの接続はタイムアウト無しで作ると、途中で黙って切れたTCP接続（NATのタイムアウトや
+回線の切り替えなど）で応答を待ち続け、監視スレッドが止まってしまう。ImapConnectionは
+
+- ソケットにタイムアウトを設定し、応答が無い場合は例外にする
+- 一定時間やり取りが無かった接続は使う前にNOOPで確認し、応答が無ければ張り直す
+- 再接続ではログイン済みの接続から得たCAPABILITYを使い回し、問い合わせを省く
+- SSLContextは全接続で共有し、再接続ではTLSセッションを再開して完全なハンドシェイクを省く
+
+ことで、接続の異常による停止時間をタイムアウトの秒数程度に抑え、再接続を軽くする。
+
+    [Gmail]
+    imap_timeout = 30
+    noop_interval = 300
+
+- imap_timeout: 応答を待つ最大秒数（デフォルト: 30）
+- noop_interval: この秒数以上やり取りが無かった接続は、使う前にNOOPで確認する（デフォルト: 300）
+- imap_cafile: サーバー証明書の検証に使うCA証明書（自己署名の証明書を使うローカルのサーバー用）
+"""
+import functools
+import imaplib
+import logging
+import ssl
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_NOOP_INTERVAL = 300
+
+# 接続に失敗した場合の再試行回数と間隔（秒）
+CONNECT_ATTEMPTS = 3
+CONNECT_RETRY_DELAY = 1.0
+
+# セッションが使えなくなったことを示す例外
+STALE_ERRORS = (imaplib.IMAP4.abort, OSError, EOFError)
+
+
+@functools.lru_cache(maxsize=None)
+def get_ssl_context(cafile=None):
+    """接続に使うSSLContext（CA証明書の読み込みは最初の1回だけ、TLSセッションの再開にも必要）"""
+    return ssl.create_default_context(cafile=cafile)
+
+
+class _SessionMixin:
+    """最後に応答を受け取った時刻を記録し、CAPABILITYの問い合わせを省けるようにする"""
+    
+    def __init__(self, *args, cached_capabilities=None, **kwargs):
+        self.cached_capabilities = cached_capabilities
+        self.last_response = time.monotonic()
+        super().__init__(*args, **kwargs)
+    
+    def _get_capabilities(self):
+        if self.cached_capabilities:
+            self.capabilities = self.cached_capabilities
+            return
+        super()._get_capabilities()
+    
+    def readline(self):
+        line = super().readline()
+        if line:
+            self.last_response = time.monotonic()
+        return line
+
+
+class _IMAP4(_SessionMixin, imaplib.IMAP4):
+    pass
+
+
+class _IMAP4_SSL(_SessionMixin, imaplib.IMAP4_SSL):
+    """前回の接続のTLSセッションを再開できるIMAP4_SSL"""
+    
+    def __init__(self, *args, tls_session=None, **kwargs):
+        self.tls_session = tls_session
+        super().__init__(*args, **kwargs)
+    
+    def _create_socket(self, timeout):
+        sock = imaplib.IMAP4._create_socket(self, timeout)
+        return self.ssl_context.wrap_socket(sock, server_hostname=self.host, session=self.tls_session)
+
+
+class ImapConnection:
+    """1アカウント分のimaplibの接続を管理するクラス"""
+    
+    def __init__(self, host, port, use_ssl, email, password,
+                 timeout=DEFAULT_TIMEOUT, noop_interval=DEFAULT_NOOP_INTERVAL, cafile=None):
+        """
+        Args:
+            host / port / use_ssl: 接続先
+            email / password: ログイン情報
+            timeout: 応答を待つ最大秒数（Noneで無制限）
+            noop_interval: この秒数以上やり取りが無かった接続は、使う前にNOOPで確認する
+            cafile: サーバー証明書の検証に使うCA証明書（省略時はシステムの証明書）
+        """
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.cafile = cafile
+        self.email = email
+        self.password = password
+        self.timeout = timeout
+        self.noop_interval = noop_interval
+        self.imap = None
+        # 最初の接続で得たCAPABILITYと直近のTLSセッション（再接続で使い回す）
+        self.capabilities = None
+        self.tls_session = None
+        self.reconnect_count = 0
+    
+    @classmethod
+    def for_account(cls, config_manager, section='Gmail'):
+        """設定の接続情報（[Gmail] など）から作成"""
+        timeout = float(config_manager.get(section, 'imap_timeout', str(DEFAULT_TIMEOUT)))
+        return cls(
+            # 接続先（通常はGmail。ローカルの偽IMAPサーバーで試験する場合に上書き）
+            host=config_manager.get(section, 'imap_host', 'imap.gmail.com'),
+            port=int(config_manager.get(section, 'imap_port', '993')),
+            use_ssl=config_manager.get_bool(section, 'imap_ssl', True),
+            email=config_manager.get(section, 'email'),
+            # アプリパスワードのスペースを削除
+            password=config_manager.get(section, 'password').replace(' ', ''),
+            timeout=timeout if timeout > 0 else None,
+            noop_interval=float(config_manager.get(section, 'noop_interval', str(DEFAULT_NOOP_INTERVAL))),
+            cafile=config_manager.get(section, 'imap_cafile', '').strip() or None,
+        )
+    
+    def open(self):
+        """接続してログインし、imaplibの接続を返す（失敗した場合は間隔を空けて再試行する）"""
+        for attempt in range(1, CONNECT_ATTEMPTS + 1):
+            try:
+                self.imap = self._login()
+                return self.imap
+            except imaplib.IMAP4.error as e:
+                # 認証エラーなど、サーバーが拒否した場合は再試行しない
+                if not isinstance(e, imaplib.IMAP4.abort):
+                    raise
+                error = e
+            except OSError as e:
+                error = e
+            if attempt < CONNECT_ATTEMPTS:
+                logger.warning("接続に失敗しました（%s回目）: %s", attempt, error)
+                time.sleep(CONNECT_RETRY_DELAY * attempt)
+        raise error
+    
+    def _login(self):
+        if self.use_ssl:
+            imap = _IMAP4_SSL(
+                self.host, self.port, ssl_context=get_ssl_context(self.cafile), timeout=self.timeout,
+                cached_capabilities=self.capabilities, tls_session=self.tls_session,
+            )
+        else:
+            imap = _IMAP4(self.host, self.port, timeout=self.timeout, cached_capabilities=self.capabilities)
+        try:
+            imap.login(self.email, self.password)
+        except Exception:
+            imap.shutdown()
+            raise
+        self.capabilities = imap.capabilities
+        if self.use_ssl:
+            logger.debug("TLSセッション再開: %s", imap.sock.session_reused)
+            # TLS 1.3ではセッションチケットはハンドシェイク後に届くため、ログイン後に取り出す
+            self.tls_session = imap.sock.session
+        return imap
+    
+    def reconnect(self):
+        """今の接続を捨てて接続し直す（LOGOUTは送らない）"""
+        self.abandon()
+        self.reconnect_count += 1
+        started = time.monotonic()
+        imap = self.open()
+        logger.info("再接続しました（%.0fms）", (time.monotonic() - started) * 1000)
+        return imap
+    
+    def idle_seconds(self):
+        """最後に応答を受け取ってからの秒数"""
+        if self.imap is None:
+            return None
+        return time.monotonic() - self.imap.last_response
+    
+    def noop(self):
+        """NOOPを送る
+        
+        Returns:
+            新着メール（EXISTS）の通知があればTrue
+        
+        Raises:
+            応答が無い・切断された場合はSTALE_ERRORSのいずれか
+        """
+        self.imap.untagged_responses.pop('EXISTS', None)
+        status, _ = self.imap.noop()
+        if status != 'OK':
+            raise imaplib.IMAP4.abort(f"NOOPが失敗しました: {status}")
+        return self.imap.untagged_responses.pop('EXISTS', None) is not None
+    
+    def is_alive(self):
+        """接続が使えるか（しばらくやり取りが無かった場合だけNOOPで確認する）"""
+        if self.imap is None:
+            return False
+        if self.idle_seconds() < self.noop_interval:
+            return True
+        try:
+            self.noop()
+            return True
+        except STALE_ERRORS as e:
+            logger.warning("接続が応答しません: %s", e)
+            return False
+    
+    def abandon(self):
+        """LOGOUTを送らずにソケットを閉じる（応答しない接続を待たずに捨てる）"""
+        if self.imap is None:
+            return
+        try:
+            self.imap.shutdown()
+        except OSError:
+            pass
+        self.imap = None
+    
+    def close(self):
+        """LOGOUTして切断"""
+        if self.imap is None:
+            return
+        try:
+            self.imap.logout()
+        finally:
+            self.imap = None
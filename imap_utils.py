@@ -0,0 +1,237 @@
+"""IMAP応答の解析ユーティリティモジュール"""
+import base64
+import itertools
+import re
+from datetime import datetime, timedelta, timezone
+
+# 括弧トークン
+_LPAREN = object()
+_RPAREN = object()
+
+_SPACES = b' \r\n\t'
+_LITERAL_RE = re.compile(rb'\{\d+\}$')
+_INTERNALDATE_RE = re.compile(
+    r'\s*(\d{1,2})-([A-Za-z]{3})-(\d{4}) (\d{2}):(\d{2}):(\d{2}) ([+-])(\d{2})(\d{2})'
+)
+_MODIFIED_BASE64_RE = re.compile(r'&([^-]*)-')
+_MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+
+
+def _lex(data, tokens):
+    """1つの応答行を字句解析してtokensに追加"""
+    i = 0
+    length = len(data)
+    while i < length:
+        char = data[i:i + 1]
+        if char in _SPACES:
+            i += 1
+        elif char == b'(':
+            tokens.append(_LPAREN)
+            i += 1
+        elif char == b')':
+            tokens.append(_RPAREN)
+            i += 1
+        elif char == b'"':
+            value = bytearray()
+            i += 1
+            while i < length and data[i:i + 1] != b'"':
+                if data[i:i + 1] == b'\\':
+                    i += 1
+                value += data[i:i + 1]
+                i += 1
+            tokens.append(bytes(value))
+            i += 1
+        else:
+            start = i
+            depth = 0
+            while i < length:
+                c = data[i:i + 1]
+                if c == b'[':
+                    depth += 1
+                elif c == b']':
+                    depth -= 1
+                elif depth == 0 and (c in _SPACES or c in (b'(', b')')):
+                    break
+                i += 1
+            atom = data[start:i]
+            tokens.append(None if atom.upper() == b'NIL' else atom)
+
+
+def _build(tokens):
+    """トークン列を括弧ごとにネストしたリストへ変換"""
+    stack = [[]]
+    for token in tokens:
+        if token is _LPAREN:
+            stack.append([])
+        elif token is _RPAREN:
+            if len(stack) > 1:
+                done = stack.pop()
+                stack[-1].append(done)
+        else:
+            stack[-1].append(token)
+    while len(stack) > 1:
+        done = stack.pop()
+        stack[-1].append(done)
+    return stack[0]
+
+
+def parse_fetch_response(data):
+    """imaplibのFETCH応答を、メッセージごとの {項目名: 値} の辞書のリストに変換
+    
+    項目名は大文字の文字列（例: 'UID', 'INTERNALDATE', 'BODY[HEADER.FIELDS (FROM)]'）、
+    値はbytes、整数文字列のbytes、またはBODYSTRUCTURE等のネストしたリストになる。
+    """
+    tokens = []
+    for item in data:
+        if item is None:
+            continue
+        if isinstance(item, tuple):
+            # 末尾のリテラル長指定 {n} を除く（本体はタプルの2番目の要素）
+            _lex(_LITERAL_RE.sub(b'', item[0].rstrip()), tokens)
+            tokens.append(item[1])
+        else:
+            _lex(item, tokens)
+    
+    tree = _build(tokens)
+    results = []
+    for i in range(0, len(tree) - 1):
+        if isinstance(tree[i], bytes) and tree[i].isdigit() and isinstance(tree[i + 1], list):
+            values = tree[i + 1]
+            entry = {}
+            for j in range(0, len(values) - 1, 2):
+                key = values[j]
+                if isinstance(key, bytes):
+                    entry[key.decode('ascii', 'replace').upper()] = values[j + 1]
+            results.append(entry)
+    return results
+
+
+def get_response_size(data):
+    """imaplib形式の応答データ（行とリテラルのタプルのリスト）のバイト数"""
+    size = 0
+    for item in data:
+        if isinstance(item, tuple):
+            size += sum(len(part) for part in item if part)
+        elif item:
+            size += len(item)
+    return size
+
+
+def get_section(entry, section):
+    """FETCH結果から BODY[section] の値を取得（部分取得の <n> 付きにも対応）"""
+    prefix = f'BODY[{section}]'.upper()
+    for key, value in entry.items():
+        if key == prefix or (key.startswith(prefix) and key[len(prefix):].startswith('<')):
+            return value
+    return None
+
+
+def parse_internaldate(value):
+    """INTERNALDATE（例: b'17-Jul-1996 02:44:25 -0700'）をUTCのdatetimeに変換
+    
+    月名はロケールに依存しないよう自前で解釈する。解釈できない場合はNone。
+    """
+    if isinstance(value, bytes):
+        value = value.decode('ascii', 'replace')
+    match = _INTERNALDATE_RE.match(value or '')
+    if not match:
+        return None
+    day, month, year, hour, minute, second, sign, tz_hour, tz_minute = match.groups()
+    month_number = _MONTHS.get(month.lower())
+    if month_number is None:
+        return None
+    offset = timedelta(hours=int(tz_hour), minutes=int(tz_minute))
+    if sign == '-':
+        offset = -offset
+    local = datetime(int(year), month_number, int(day), int(hour), int(minute), int(second),
+                     tzinfo=timezone(offset))
+    return local.astimezone(timezone.utc)
+
+
+def encode_mailbox_name(name):
+    """メールボックス名をIMAPの修正UTF-7（RFC 3501 5.1.3）に変換（日本語のラベル名など）"""
+    encoded = []
+    for printable, chars in itertools.groupby(name, lambda char: ' ' <= char <= '~'):
+        text = ''.join(chars)
+        if printable:
+            encoded.append(text.replace('&', '&-'))
+        else:
+            data = base64.b64encode(text.encode('utf-16-be')).rstrip(b'=').decode('ascii')
+            encoded.append('&' + data.replace('/', ',') + '-')
+    return ''.join(encoded)
+
+
+def decode_mailbox_name(name):
+    """修正UTF-7のメールボックス名を元の文字列に戻す"""
+    def decode(match):
+        data = match.group(1).replace(',', '/')
+        if not data:
+            return '&'
+        return base64.b64decode(data + '=' * (-len(data) % 4)).decode('utf-16-be')
+    return _MODIFIED_BASE64_RE.sub(decode, name)
+
+
+def _to_str(value):
+    if isinstance(value, bytes):
+        return value.decode('ascii', 'replace')
+    return value or ''
+
+
+def _params(value):
+    """BODYSTRUCTUREのパラメーターリストを辞書に変換"""
+    params = {}
+    if isinstance(value, list):
+        for i in range(0, len(value) - 1, 2):
+            params[_to_str(value[i]).lower()] = _to_str(value[i + 1])
+    return params
+
+
+def find_text_part(bodystructure, section='', sub_type='plain'):
+    """BODYSTRUCTUREから最初のtext/<sub_type>パート（デフォルトはtext/plain）を探す
+    
+    Returns:
+        (パート番号, 転送エンコーディング, 文字コード) のタプル。見つからなければNone
+    """
+    if not isinstance(bodystructure, list) or not bodystructure:
+        return None
+    
+    if isinstance(bodystructure[0], list):
+        # マルチパート: 子パートを順に探す（最後の要素群はサブタイプと拡張データ）
+        index = 0
+        for child in bodystructure:
+            if not isinstance(child, list):
+                break
+            index += 1
+            child_section = f'{section}.{index}' if section else str(index)
+            found = find_text_part(child, child_section, sub_type)
+            if found:
+                return found
+        return None
+    
+    main_type = _to_str(bodystructure[0]).lower()
+    part_sub_type = _to_str(bodystructure[1]).lower() if len(bodystructure) > 1 else ''
+    if main_type != 'text' or part_sub_type != sub_type:
+        return None
+    
+    params = _params(bodystructure[2]) if len(bodystructure) > 2 else {}
+    encoding = _to_str(bodystructure[5]).lower() if len(bodystructure) > 5 else '7bit'
+    # シングルパートのメッセージ本文はパート番号1で取得できる
+    return section or '1', encoding, params.get('charset') or 'utf-8'
+
+
+def find_body_part(bodystructure):
+    """本文として照合するパートを探す（text/plainを優先し、無ければtext/html）
+    
+    添付ファイルなどテキスト以外のパートは構造を見るだけで、中身は取得しない。
+    
+    Returns:
+        (パート番号, 転送エンコーディング, 文字コード, サブタイプ) のタプル。見つからなければNone
+    """
+    for sub_type in ('plain', 'html'):
+        found = find_text_part(bodystructure, sub_type=sub_type)
+        if found:
+            return found + (sub_type,)
+    return None
@@ -0,0 +1,177 @@
+"""監視状態（UIDの既読位置など）の永続化モジュール"""
+import json
+import os
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+STATE_FILENAME = 'mail_state.json'
+SEEN_CACHE_FILENAME = 'seen_cache.json'
+
+# チェック済みメールを覚えておく時間（時間）と件数の上限
+DEFAULT_SEEN_TTL_HOURS = 24
+DEFAULT_SEEN_MAX_ENTRIES = 10000
+
+
+class MailState:
+    """メールボックスごとのUIDVALIDITYと処理済みUID（ハイウォーターマーク）を保存するクラス
+    
+    状態はconfig.iniと同じディレクトリのJSONファイルに保存される。
+    """
+    
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self.data = {}
+        # 複数の監視スレッドから更新されるため保存を排他する
+        self.lock = threading.Lock()
+        self.load()
+    
+    @classmethod
+    def for_config(cls, config_manager):
+        """設定ファイルの隣に保存する状態を作成"""
+        config_dir = os.path.dirname(os.path.abspath(config_manager.config_path))
+        return cls(os.path.join(config_dir, STATE_FILENAME))
+    
+    def load(self):
+        """状態ファイルを読み込み（壊れている場合は空の状態から始める）"""
+        if not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"状態ファイルの読み込みに失敗しました: {e}")
+            self.data = {}
+    
+    def save(self):
+        """状態ファイルを保存（一時ファイル経由で置き換え）"""
+        tmp_path = self.state_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            logger.warning(f"状態ファイルの保存に失敗しました: {e}")
+    
+    def get_last_uid(self, key, uidvalidity):
+        """処理済みの最大UIDを取得（UIDVALIDITYが変わっていればNone）"""
+        entry = self.data.get(key)
+        if not entry or uidvalidity is None or entry.get('uidvalidity') != uidvalidity:
+            return None
+        return entry.get('last_uid')
+    
+    def set_last_uid(self, key, uidvalidity, last_uid):
+        """処理済みの最大UIDを更新して保存"""
+        entry = {'uidvalidity': uidvalidity, 'last_uid': last_uid}
+        with self.lock:
+            if self.data.get(key) == entry:
+                return
+            self.data[key] = entry
+            self.save()
+
+
+class SeenCache:
+    """チェック済みメールのキャッシュ（Message-IDまたはUIDで識別）
+    
+    同じメールを何度も照合・警告しないために使う。エントリはTTLを過ぎるか件数の上限を
+    超えると古いものから削除される。パスを指定した場合はJSONファイルに保存し、再起動後も使う。
+    同じメールが複数のラベル（メールボックス）にある場合もMessage-IDで1通として扱える。
+    """
+    
+    def __init__(self, path=None, ttl=DEFAULT_SEEN_TTL_HOURS * 3600, max_entries=DEFAULT_SEEN_MAX_ENTRIES):
+        """
+        Args:
+            path: 保存先のJSONファイル（Noneならメモリ上のみ）
+            ttl: エントリの有効期間（秒）
+            max_entries: 保持する最大件数
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # キー → 有効期限（UNIX時刻）。追加順に並ぶため先頭が最も古い
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.dirty = False
+        if path:
+            self.load()
+    
+    @classmethod
+    def for_config(cls, config_manager):
+        """設定（[Monitor] seen_cache_*）に従ってキャッシュを作成"""
+        ttl_hours = float(config_manager.get('Monitor', 'seen_cache_ttl_hours', str(DEFAULT_SEEN_TTL_HOURS)))
+        max_entries = int(config_manager.get('Monitor', 'seen_cache_size', str(DEFAULT_SEEN_MAX_ENTRIES)))
+        path = None
+        if config_manager.get_bool('Monitor', 'seen_cache_persist', True):
+            config_dir = os.path.dirname(os.path.abspath(config_manager.config_path))
+            path = os.path.join(config_dir, SEEN_CACHE_FILENAME)
+        return cls(path, ttl_hours * 3600, max_entries)
+    
+    def load(self):
+        """保存済みのキャッシュを読み込み（期限切れのエントリは捨てる）"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"チェック済みメールの読み込みに失敗しました: {e}")
+            return
+        now = time.time()
+        for key, expires_at in sorted(saved.items(), key=lambda item: item[1]):
+            if expires_at > now:
+                self.entries[key] = expires_at
+        self._evict(now)
+    
+    def save(self):
+        """変更があればファイルに保存（一時ファイル経由で置き換え）"""
+        if not self.path:
+            return
+        # 複数の監視スレッドが同じ一時ファイルに書き込まないよう、置き換えまでロックしたまま行う
+        with self.lock:
+            if not self.dirty:
+                return
+            self._evict(time.time())
+            tmp_path = self.path + '.tmp'
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.entries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"チェック済みメールの保存に失敗しました: {e}")
+                return
+            self.dirty = False
+    
+    def _evict(self, now):
+        """期限切れと上限超過のエントリを古い順に削除"""
+        while self.entries:
+            key, expires_at = next(iter(self.entries.items()))
+            if expires_at > now and len(self.entries) <= self.max_entries:
+                break
+            del self.entries[key]
+            self.dirty = True
+    
+    def __contains__(self, key):
+        with self.lock:
+            expires_at = self.entries.get(key)
+            if expires_at is None:
+                return False
+            if expires_at <= time.time():
+                del self.entries[key]
+                self.dirty = True
+                return False
+            return True
+    
+    def add(self, key):
+        """チェック済みとして記録"""
+        now = time.time()
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = now + self.ttl
+            self.dirty = True
+            self._evict(now)
+    
+    def __len__(self):
+        return len(self.entries)
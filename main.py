@@ -1,14 +1,20 @@
-"""Gmail監視ビープアプリケーション - エントリーポイント"""
+"""Gmail監視ビープアプリケーション - エントリーポイント
+
+起動モードごとに必要なモジュールだけを読み込む（CLI・デーモンモードではtkinterを読み込まない）。
+"""
 import argparse
 import sys
-import tkinter as tk
-from ui import MailBeepApp
-from utils import setup_logging
-from cli import main as cli_main
+
+# 起動モード
+MODES = ('cli', 'gui', 'daemon', 'ctl')
 
 
 def run_gui():
     """GUIモードでアプリケーションを起動"""
+    import tkinter as tk
+    from ui import MailBeepApp
+    from utils import setup_logging
+    
     setup_logging()
     
     root = tk.Tk()
@@ -19,6 +25,13 @@ def run_gui():
 
 def main():
     """アプリケーションのエントリーポイント"""
+    # --profile-startup: 起動モードのimportにかかる時間を表示して終了
+    if '--profile-startup' in sys.argv[1:]:
+        sys.argv.remove('--profile-startup')
+        from startup_profile import profile_startup
+        mode = sys.argv[1] if len(sys.argv) >= 2 and sys.argv[1] in MODES else 'gui'
+        sys.exit(0 if profile_startup(mode) else 1)
+    
     # 引数が無い、または最初の引数がguiの場合はGUIモード
     if len(sys.argv) == 1 or (len(sys.argv) >= 2 and sys.argv[1] == 'gui'):
         # GUI引数があれば削除
@@ -31,9 +44,24 @@ def main():
     if sys.argv[1] == 'cli':
         # 'cli'引数を削除してcli_mainに渡す
         sys.argv.pop(1)
+        from cli import main as cli_main
         cli_main()
         return
     
+    # 最初の引数がdaemonの場合はデーモンモード
+    if sys.argv[1] == 'daemon':
+        sys.argv.pop(1)
+        from daemon import daemon_main
+        daemon_main()
+        return
+    
+    # 最初の引数がctlの場合は起動中のデーモンを操作
+    if sys.argv[1] == 'ctl':
+        sys.argv.pop(1)
+        from daemon import ctl_main
+        ctl_main()
+        return
+    
     # それ以外の場合はヘルプを表示
     parser = argparse.ArgumentParser(
         description='Gmail監視ビープアプリケーション',
@@ -42,6 +70,8 @@ def main():
 モード:
   cli    - コマンドラインインターフェース（CUI）で起動
   gui    - グラフィカルユーザーインターフェース（GUI）で起動（デフォルト）
+  daemon - デーモンモードで起動（制御ソケットで操作）
+  ctl    - 起動中のデーモンを操作（status / stats / pause / resume / reload / silence / check / stop）
 
 使用例:
   # GUIモードで起動（デフォルト）
@@ -53,15 +83,22 @@ def main():
 
   # CLIモードで追加オプションを指定
   %(prog)s cli --config /path/to/config.ini --debug
+
+  # デーモンモードで起動し、別のターミナルから状態を確認
+  %(prog)s daemon --config /path/to/config.ini
+  %(prog)s ctl status --config /path/to/config.ini
+
+  # 起動時のimportにかかる時間を表示（モードを付けて指定）
+  %(prog)s cli --profile-startup
         """
     )
     
     parser.add_argument(
         'mode',
         nargs='?',
-        choices=['cli', 'gui'],
+        choices=MODES,
         default='gui',
-        help='起動モード: cli または gui（デフォルト: gui）'
+        help='起動モード: cli / gui / daemon / ctl（デフォルト: gui）'
     )
     
     parser.parse_args()
@@ -0,0 +1,293 @@
+"""メールの照合ルール（送信者・キーワード・正規表現）モジュール
+
+config.iniに [Rule:<名前>] セクションを追加すると、複数のルールでメールを照合できる。
+全ルールのキーワードは1つの正規表現にまとめてコンパイルし、本文は1回の走査で全ルール分を
+照合する（正規表現はルールごとにコンパイルし、それぞれ本文を検索する）。送信者はアドレス・ドメインのハッシュで引くため、ルール数が増えても
+1通あたりの照合コストはほぼ本文の長さだけで決まる。
+
+    [Rule:障害通知]
+    sender = no-reply@soracom.io, @alerts.example.com
+    keyword = 障害, 停止
+    pattern = ERROR-\\d+
+    operator = and
+    beep_duration = 30
+
+- sender: 送信者のアドレス、または @ドメイン（サブドメインも一致）をカンマ区切りで指定
+- keyword: 本文に含まれるべき語をカンマ区切りで指定（大文字・小文字は区別しない）
+- pattern: 本文に一致すべき正規表現（書いた通りに照合し、大文字・小文字を区別しない場合は (?i) を付ける。
+  空文字列に一致するものは不可）
+- operator: and（全条件を満たす、デフォルト）/ or（いずれかの条件を満たす）
+- beep_duration: このルールで鳴らす警告音の秒数（省略時は [Sound] の値）
+
+[Rule:*] が無い場合は、従来通り sender_filter / keyword_filter（部分一致）から1つのルールを作る。
+"""
+import re
+from email.utils import getaddresses
+
+RULE_SECTION_PREFIX = 'Rule:'
+
+# 正規表現の一致がチャンクの境界をまたいでも見つけられるよう、次のチャンクに持ち越す文字数
+PATTERN_OVERLAP = 256
+
+
+def _split(value):
+    """カンマ区切りの設定値をリストに変換"""
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+
+class Rule:
+    """1つの照合ルール"""
+    
+    def __init__(self, name, senders=(), keywords=(), pattern='', operator='and',
+                 beep_duration=None, sender_substrings=()):
+        """
+        Args:
+            name: ルール名（ログや警告の報告に使う）
+            senders: 送信者のアドレスまたは @ドメイン のリスト
+            keywords: 本文に含まれるべき語のリスト
+            pattern: 本文に一致すべき正規表現
+            operator: 'and'（全条件）または 'or'（いずれかの条件）
+            beep_duration: このルールで鳴らす警告音の秒数
+            sender_substrings: Fromヘッダーに部分一致すべき文字列（従来のsender_filter用）
+        """
+        if operator not in ('and', 'or'):
+            raise ValueError(f"ルール {name} の operator は and か or を指定してください: {operator}")
+        self.name = name
+        self.addresses = set()
+        self.domains = set()
+        for sender in senders:
+            sender = sender.strip().lower()
+            if '@' in sender and not sender.startswith('@'):
+                self.addresses.add(sender)
+            elif sender:
+                self.domains.add(sender.lstrip('@'))
+        self.sender_substrings = [s.lower() for s in sender_substrings if s]
+        self.keywords = [k for k in keywords if k]
+        self.pattern = pattern
+        self.operator = operator
+        self.beep_duration = beep_duration
+        # 本文の照合に使う語のID（Matcherが割り当てる）
+        self.term_ids = []
+    
+    @property
+    def has_sender(self):
+        return bool(self.addresses or self.domains or self.sender_substrings)
+    
+    def evaluate(self, sender_hit, found_terms):
+        """ルールを評価
+        
+        Args:
+            sender_hit: 送信者の条件を満たすか
+            found_terms: 本文で見つかった語のIDの集合（本文をまだ見ていない場合はNone）
+        
+        Returns:
+            True / False、本文を見ないと決まらない場合はNone
+        """
+        results = [sender_hit] if self.has_sender else []
+        if found_terms is None and self.term_ids:
+            body_results = None
+        else:
+            body_results = [term_id in found_terms for term_id in self.term_ids]
+        
+        if self.operator == 'or':
+            if any(results) or any(body_results or ()):
+                return True
+            if body_results is None:
+                return None
+            # 条件が1つも無いルールは全てのメールに一致する
+            return not results and not body_results
+        
+        if not all(results):
+            return False
+        if body_results is None:
+            return None
+        return all(body_results)
+    
+    def __repr__(self):
+        return f"Rule({self.name!r})"
+
+
+class Matcher:
+    """複数のルールを1回の走査で照合するクラス"""
+    
+    def __init__(self, rules, custom=True):
+        """
+        Args:
+            rules: Ruleのリスト（先頭から順に評価し、最初に一致したルールを報告する）
+            custom: [Rule:*] の設定から作ったルールか（従来のフィルターから作った場合はFalse）
+        """
+        self.rules = rules
+        self.custom = custom
+        self._by_address = {}
+        self._by_domain = {}
+        self._substring_rules = [rule for rule in rules if rule.sender_substrings]
+        for rule in rules:
+            for address in rule.addresses:
+                self._by_address.setdefault(address, set()).add(rule)
+            for domain in rule.domains:
+                self._by_domain.setdefault(domain, set()).add(rule)
+        self._compile_terms()
+    
+    def _compile_terms(self):
+        """全ルールのキーワードを1つの正規表現にまとめ、正規表現はルールごとにコンパイルする"""
+        literals = {}
+        patterns = []
+        for rule in self.rules:
+            rule.term_ids = []
+            for keyword in rule.keywords:
+                # 同じキーワードは複数のルールで1つの語として共有する
+                term_id = literals.setdefault(keyword.lower(), len(literals) + len(patterns))
+                rule.term_ids.append(term_id)
+            if rule.pattern:
+                try:
+                    compiled = re.compile(rule.pattern)
+                except re.error as e:
+                    raise ValueError(f"ルール {rule.name} の正規表現が不正です: {e}")
+                # 空文字列に一致する正規表現（a* など）は全てのメールに一致してしまう
+                if compiled.match(''):
+                    raise ValueError(f"ルール {rule.name} の正規表現が空文字列に一致します: {rule.pattern}")
+                term_id = len(literals) + len(patterns)
+                patterns.append((term_id, compiled))
+                rule.term_ids.append(term_id)
+        
+        self.term_count = len(literals) + len(patterns)
+        
+        # 正規表現は他の語と同じ位置で一致しても見逃さないよう、まとめずに1つずつ検索する
+        # （まとめるとインラインフラグや番号付きの後方参照も正しく扱えない）
+        self._patterns = patterns
+        
+        # 同じ位置で一致するキーワードは先に並べた方だけが報告されるため、キーワードは長い順に並べ、
+        # 長いキーワードが見つかったときはそれに含まれる短いキーワードも見つかったものとする
+        ordered = sorted(literals.items(), key=lambda item: -len(item[0]))
+        self._implied = {
+            term_id: {other_id for other, other_id in literals.items() if other != keyword and other in keyword}
+            for keyword, term_id in ordered
+        }
+        # チャンクの境界で切れた語も見つけられるよう、前のチャンクの末尾を持ち越す長さ
+        self.overlap = max([len(keyword) - 1 for keyword in literals] + [PATTERN_OVERLAP if patterns else 0])
+        alternatives = [f'(?P<t{term_id}>{re.escape(keyword)})' for keyword, term_id in ordered]
+        self._regex = re.compile('|'.join(alternatives), re.IGNORECASE) if alternatives else None
+    
+    def scan(self, text, found=None):
+        """本文を走査し、見つかった語のIDの集合を返す（foundを渡すとそこに追加する）"""
+        found = set() if found is None else found
+        if not text:
+            return found
+        for term_id, compiled in self._patterns:
+            if term_id not in found and compiled.search(text):
+                found.add(term_id)
+        if self._regex is None:
+            return found
+        pos = 0
+        while len(found) < self.term_count and pos < len(text):
+            match = self._regex.search(text, pos)
+            if not match:
+                break
+            term_id = int(match.lastgroup[1:])
+            found.add(term_id)
+            found |= self._implied.get(term_id, set())
+            # 重なって出現する別の語も拾えるよう、一致の次の文字から探し直す
+            pos = match.start() + 1
+        return found
+    
+    def sender_hits(self, from_header):
+        """Fromヘッダーが送信者の条件を満たすルールの集合"""
+        hits = set()
+        for _, address in getaddresses([from_header or '']):
+            address = address.lower()
+            if not address:
+                continue
+            hits |= self._by_address.get(address, set())
+            # サブドメインも一致させる（a.example.com → example.com）
+            labels = address.rpartition('@')[2].split('.')
+            for i in range(len(labels)):
+                hits |= self._by_domain.get('.'.join(labels[i:]), set())
+        if self._substring_rules:
+            lowered = (from_header or '').lower()
+            for rule in self._substring_rules:
+                if any(s in lowered for s in rule.sender_substrings):
+                    hits.add(rule)
+        return hits
+    
+    def match_headers(self, from_header):
+        """ヘッダーだけで照合
+        
+        Returns:
+            (一致したRule（無ければNone）, 本文を見れば一致する可能性があるか)
+        """
+        hits = self.sender_hits(from_header)
+        pending = False
+        for rule in self.rules:
+            result = rule.evaluate(rule in hits, None)
+            if result:
+                return rule, False
+            if result is None:
+                pending = True
+        return None, pending
+    
+    def _first_match(self, hits, found):
+        for rule in self.rules:
+            if rule.evaluate(rule in hits, found):
+                return rule
+        return None
+    
+    def match(self, from_header, body):
+        """ヘッダーと本文で照合し、最初に一致したRuleを返す（無ければNone）"""
+        return self._first_match(self.sender_hits(from_header), self.scan(body))
+    
+    def match_stream(self, from_header, chunks):
+        """本文をチャンクごとに照合し、ルールが一致した時点で打ち切る
+        
+        条件は全て「含まれる」なので、一度一致したルールは残りの本文で不一致にならない。
+        チャンクの境界をまたぐ語を見逃さないよう、前のチャンクの末尾（overlap文字）を重ねて走査する。
+        
+        Args:
+            from_header: Fromヘッダー
+            chunks: 本文のテキストを順に返すイテラブル（body_scanner.iter_body_textなど）
+        
+        Returns:
+            最初に一致したRule（無ければNone）
+        """
+        hits = self.sender_hits(from_header)
+        found = set()
+        rule = self._first_match(hits, found)
+        if rule:
+            return rule
+        tail = ''
+        for chunk in chunks:
+            text = tail + chunk
+            self.scan(text, found)
+            rule = self._first_match(hits, found)
+            if rule:
+                return rule
+            tail = text[-self.overlap:] if self.overlap else ''
+        return None
+
+
+def load_rules(config_manager):
+    """config.iniの [Rule:*] セクションからルールを読み込む"""
+    rules = []
+    for section in config_manager.get_sections(RULE_SECTION_PREFIX):
+        beep_duration = config_manager.get(section, 'beep_duration', '').strip()
+        rules.append(Rule(
+            section[len(RULE_SECTION_PREFIX):],
+            senders=_split(config_manager.get(section, 'sender')),
+            keywords=_split(config_manager.get(section, 'keyword')),
+            pattern=config_manager.get(section, 'pattern').strip(),
+            operator=config_manager.get(section, 'operator', 'and').strip().lower(),
+            beep_duration=float(beep_duration) if beep_duration else None,
+        ))
+    return rules
+
+
+def build_matcher(config_manager, sender_filter='', keyword_filter=''):
+    """照合に使うMatcherを作成（[Rule:*] が無ければ従来のフィルターから作る）"""
+    rules = load_rules(config_manager)
+    if rules:
+        return Matcher(rules)
+    rule = Rule(
+        'default',
+        keywords=[keyword_filter] if keyword_filter else (),
+        sender_substrings=[sender_filter] if sender_filter else (),
+    )
+    return Matcher([rule], custom=False)
@@ -0,0 +1,217 @@
+"""メールの解析（ヘッダーのデコード・本文のテキスト化）モジュール
+
+解析処理はモジュールレベルの関数にしてあり、[Monitor] セクションの parse_workers を
+設定するとプロセスプールで並列に実行する。障害明けなどで大量のメールをまとめて取得した
+場合でも、解析にかかる時間をCPUコア数に応じて短縮できる。
+
+    [Monitor]
+    parse_workers = auto
+
+- parse_workers: 解析に使うプロセス数（0で無効・デフォルト、auto でCPUコア数）
+"""
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from email.header import decode_header
+from email.parser import BytesHeaderParser
+
+from body_scanner import iter_body_text
+from imap_utils import parse_internaldate
+
+logger = logging.getLogger(__name__)
+
+# プロセスプールを使う最小の件数（少ない場合はプロセス間の受け渡しの方が高くつく）
+PARALLEL_MIN_BATCH = 32
+
+
+def decode_header_value(header_value):
+    """メールヘッダーをデコード"""
+    if not header_value:
+        return ""
+    
+    decoded_parts = []
+    for part, encoding in decode_header(header_value):
+        if isinstance(part, bytes):
+            # エンコーディングが指定されている場合はそれを使用、なければutf-8
+            try:
+                decoded_parts.append(part.decode(encoding or 'utf-8', errors='ignore'))
+            except LookupError:
+                decoded_parts.append(part.decode('utf-8', errors='ignore'))
+        else:
+            decoded_parts.append(str(part))
+    
+    return ''.join(decoded_parts)
+
+
+class MessageFields:
+    """ヘッダーから取り出したメールの情報（プロセス間で受け渡すため必要な項目だけを持つ）
+    
+    送信者と件名は、ログや照合結果で参照された時に初めてデコードする
+    （受信時刻やチェック済みの判定でスキップするメールではデコードしない）。
+    プロセスプールで解析する場合は、親プロセスでデコードし直さないようワーカー側でデコードしておく。
+    """
+    
+    __slots__ = ('from_header', 'raw_subject', 'message_id', 'received', '_sender', '_subject')
+    
+    def __init__(self, from_header, raw_subject, message_id, received):
+        """
+        Args:
+            from_header: Fromヘッダー（デコード前、送信者の照合に使う）
+            raw_subject: Subjectヘッダー（デコード前）
+            message_id: Message-IDヘッダー
+            received: サーバーの受信日時（UTCのdatetime、不明ならNone）
+        """
+        self.from_header = from_header
+        self.raw_subject = raw_subject
+        self.message_id = message_id
+        self.received = received
+        self._sender = None
+        self._subject = None
+    
+    @property
+    def sender(self):
+        """送信者（デコード済み）"""
+        if self._sender is None:
+            self._sender = decode_header_value(self.from_header)
+        return self._sender
+    
+    @property
+    def subject(self):
+        """件名（デコード済み）"""
+        if self._subject is None:
+            self._subject = decode_header_value(self.raw_subject)
+        return self._subject
+
+
+def parse_header_fields(header_bytes, internaldate):
+    """取得したヘッダーとINTERNALDATEからMessageFieldsを作成"""
+    msg = BytesHeaderParser().parsebytes(header_bytes or b'')
+    return MessageFields(
+        from_header=str(msg.get('From', '')),
+        raw_subject=str(msg.get('Subject', '')),
+        message_id=str(msg.get('Message-ID') or '').strip(),
+        received=parse_internaldate(internaldate),
+    )
+
+
+def parse_decoded_header_fields(header_bytes, internaldate):
+    """parse_header_fieldsと同じだが、送信者と件名もデコードしておく（プロセスプール用）"""
+    fields = parse_header_fields(header_bytes, internaldate)
+    # 参照するとデコードした値がMessageFieldsに保持され、親プロセスに受け渡される
+    fields.sender
+    fields.subject
+    return fields
+
+
+def extract_body_text(payload, encoding, charset, subtype):
+    """本文パートの全体をテキストに変換"""
+    return ''.join(iter_body_text(payload, encoding, charset, subtype))
+
+
+def _apply_batch(func, args):
+    """プロセスプールに渡す1回分の処理（argsの各要素でfuncを呼ぶ）"""
+    return [func(*arg) for arg in args]
+
+
+class MessageParser:
+    """メールの解析を行うクラス（件数が多い場合はプロセスプールで並列に解析する）"""
+    
+    def __init__(self, workers=0):
+        """
+        Args:
+            workers: 解析に使うプロセス数（0なら呼び出し元のスレッドで解析する）
+        """
+        self.workers = workers
+        self._executor = None
+    
+    @classmethod
+    def for_config(cls, config_manager):
+        """設定（[Monitor] の parse_workers）からMessageParserを作成"""
+        value = config_manager.get('Monitor', 'parse_workers', '0').strip().lower()
+        if value == 'auto':
+            workers = os.cpu_count() or 1
+        else:
+            workers = max(0, int(value or 0))
+        return cls(workers)
+    
+    def _use_pool(self, count):
+        return self.workers > 0 and count >= PARALLEL_MIN_BATCH
+    
+    def _get_executor(self):
+        if self._executor is None:
+            logger.info("解析用のプロセスプールを起動します（%sプロセス）", self.workers)
+            # 監視スレッドやGUIのスレッドを抱えたままforkしないよう、spawnで起動する
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+    
+    def _get_chunksize(self, count):
+        return max(1, count // (self.workers * 4))
+    
+    def _map(self, func, args):
+        """argsの各要素（引数のタプル）でfuncを呼び、結果のリストを返す"""
+        if not self._use_pool(len(args)):
+            return [func(*arg) for arg in args]
+        chunksize = self._get_chunksize(len(args))
+        return list(self._get_executor().map(func, *zip(*args), chunksize=chunksize))
+    
+    async def _map_async(self, func, args):
+        """_mapのコルーチン版（プロセスプールの結果を待つ間もイベントループを止めない）"""
+        if not self._use_pool(len(args)):
+            return [func(*arg) for arg in args]
+        import asyncio
+        
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        chunksize = self._get_chunksize(len(args))
+        batches = await asyncio.gather(*(
+            loop.run_in_executor(executor, _apply_batch, func, args[i:i + chunksize])
+            for i in range(0, len(args), chunksize)
+        ))
+        return [result for batch in batches for result in batch]
+    
+    def _get_header_parser(self, count):
+        # 件数が少なく呼び出し元で解析する場合だけ、送信者と件名のデコードを参照時まで遅らせる
+        return parse_decoded_header_fields if self._use_pool(count) else parse_header_fields
+    
+    def parse_headers(self, headers):
+        """(ヘッダーのbytes, INTERNALDATE) のリストを解析し、MessageFieldsのリストを返す"""
+        return self._map(self._get_header_parser(len(headers)), headers)
+    
+    async def parse_headers_async(self, headers):
+        """parse_headersのコルーチン版（AsyncGmailMonitor用）"""
+        return await self._map_async(self._get_header_parser(len(headers)), headers)
+    
+    def body_texts(self, bodies):
+        """本文パートをテキストに変換
+        
+        プロセスプールを使わない場合は照合しながら逐次デコードするイテレータを返し、
+        一致した時点で残りはデコードしない。
+        
+        Args:
+            bodies: {UID: (データ, 転送エンコーディング, 文字コード, サブタイプ)}
+        
+        Returns:
+            {UID: 本文のテキストを順に返すイテラブル}
+        """
+        if not self._use_pool(len(bodies)):
+            return {uid: iter_body_text(*body) for uid, body in bodies.items()}
+        uids = list(bodies)
+        texts = self._map(extract_body_text, [bodies[uid] for uid in uids])
+        return {uid: [text] for uid, text in zip(uids, texts)}
+    
+    async def body_texts_async(self, bodies):
+        """body_textsのコルーチン版（AsyncGmailMonitor用）"""
+        if not self._use_pool(len(bodies)):
+            return self.body_texts(bodies)
+        uids = list(bodies)
+        texts = await self._map_async(extract_body_text, [bodies[uid] for uid in uids])
+        return {uid: [text] for uid, text in zip(uids, texts)}
+    
+    def close(self):
+        """プロセスプールを終了"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
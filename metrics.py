@@ -0,0 +1,304 @@
+"""監視処理の計測（処理時間のスパン・カウンター）と公開モジュール
+
+接続・メールボックスの選択・検索・取得・解析・照合・警告音の再生にかかった時間を
+time.monotonic()で計り、取得したバイト数・照合したメール数・合致数・エラー数を数える。
+計測値はプロセス全体で1つのレジストリ（metrics）に集計され、設定に応じて
+
+- Prometheus形式のテキスト（http://127.0.0.1:<metrics_port>/metrics）
+- 一定間隔で書き出すJSONファイル（stats_file）
+
+として公開する。--debug を付けずに、本番の監視サイクルの時間がどこにかかっているかを確認できる。
+
+    [Monitor]
+    metrics_port = 9464
+    stats_file = stats.json
+    stats_interval = 60
+
+- metrics_port: Prometheus形式で公開するポート（0で無効・デフォルト）
+- metrics_host: 待ち受けるアドレス（デフォルト: 127.0.0.1）
+- stats_file: 計測値を書き出すJSONファイル（config.iniからの相対パス、空で無効・デフォルト）
+- stats_interval: JSONファイルを書き出す間隔（秒、デフォルト: 60）
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Prometheus形式で出力する名前の接頭辞
+METRIC_PREFIX = 'mail_beep'
+
+DEFAULT_METRICS_HOST = '127.0.0.1'
+DEFAULT_STATS_INTERVAL = 60
+
+# カウンターの説明（Prometheus形式のHELP）
+COUNTER_HELP = {
+    'bytes_fetched': 'FETCHで受信したバイト数',
+    'messages_scanned': 'ヘッダーを照合したメールの数',
+    'matches': '条件に合致したメールの数',
+    'errors': '接続・チェックのエラーの数',
+    'cycles': '監視サイクルの数',
+}
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(key, **extra):
+    labels = dict(extra, **dict(key))
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in labels.items()) + '}'
+
+
+class _SpanStats:
+    """1つのスパン（名前とラベルの組）の集計"""
+    
+    __slots__ = ('count', 'total', 'max', 'last')
+    
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+    
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+class Metrics:
+    """スパンの所要時間とカウンターを集計するクラス（複数のスレッドから更新できる）"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.spans = {}
+        self.started = time.time()
+    
+    def increment(self, name, value=1, **labels):
+        """カウンターを増やす"""
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def observe(self, name, seconds, **labels):
+        """スパンの所要時間（秒）を記録"""
+        key = (name, _label_key(labels))
+        with self.lock:
+            stats = self.spans.get(key)
+            if stats is None:
+                stats = self.spans[key] = _SpanStats()
+            stats.add(seconds)
+    
+    @contextmanager
+    def span(self, name, **labels):
+        """withブロックの所要時間をスパンとして記録"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+    
+    def reset(self):
+        """全ての計測値を消去"""
+        with self.lock:
+            self.counters.clear()
+            self.spans.clear()
+            self.started = time.time()
+    
+    def snapshot(self):
+        """計測値をJSONに変換できる辞書で返す"""
+        with self.lock:
+            spans = [
+                {
+                    'name': name, 'labels': dict(labels), 'count': stats.count,
+                    'total_seconds': stats.total, 'max_seconds': stats.max, 'last_seconds': stats.last,
+                }
+                for (name, labels), stats in sorted(self.spans.items())
+            ]
+            counters = [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+            started = self.started
+        return {
+            'started': datetime.fromtimestamp(started, timezone.utc).isoformat(timespec='seconds'),
+            'uptime_seconds': time.time() - started,
+            'spans': spans,
+            'counters': counters,
+        }
+    
+    def render_prometheus(self):
+        """計測値をPrometheusのテキスト形式で返す"""
+        with self.lock:
+            spans = sorted((key, (stats.count, stats.total, stats.max)) for key, stats in self.spans.items())
+            counters = sorted(self.counters.items())
+            started = self.started
+        
+        lines = [
+            f'# HELP {METRIC_PREFIX}_uptime_seconds 計測を開始してからの秒数',
+            f'# TYPE {METRIC_PREFIX}_uptime_seconds gauge',
+            f'{METRIC_PREFIX}_uptime_seconds {time.time() - started:.3f}',
+        ]
+        if spans:
+            metric = f'{METRIC_PREFIX}_span_seconds'
+            lines.append(f'# HELP {metric} 処理ごとの所要時間（秒）')
+            lines.append(f'# TYPE {metric} summary')
+            for (name, labels), (count, total, _) in spans:
+                lines.append(f'{metric}_count{_format_labels(labels, span=name)} {count}')
+                lines.append(f'{metric}_sum{_format_labels(labels, span=name)} {total:.6f}')
+            lines.append(f'# HELP {metric}_max 処理ごとの最長の所要時間（秒）')
+            lines.append(f'# TYPE {metric}_max gauge')
+            for (name, labels), (_, _, longest) in spans:
+                lines.append(f'{metric}_max{_format_labels(labels, span=name)} {longest:.6f}')
+        
+        previous = None
+        for (name, labels), value in counters:
+            metric = f'{METRIC_PREFIX}_{name}_total'
+            if name != previous:
+                lines.append(f'# HELP {metric} {COUNTER_HELP.get(name, name)}')
+                lines.append(f'# TYPE {metric} counter')
+                previous = name
+            lines.append(f'{metric}{_format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# プロセス全体で共有するレジストリ
+metrics = Metrics()
+
+
+class _MetricsHandlerMixin:
+    """/metrics（Prometheus形式）と /stats.json（JSON）を返すハンドラーの処理"""
+    
+    def do_GET(self):
+        registry = self.server.registry
+        if self.path in ('/', '/metrics'):
+            body = registry.render_prometheus().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path == '/stats.json':
+            body = json.dumps(registry.snapshot(), ensure_ascii=False, indent=2).encode('utf-8')
+            content_type = 'application/json; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        logger.debug(f"計測値の取得: {self.address_string()} {format % args}")
+
+
+def _create_http_server(host, port, registry):
+    """計測値を公開するHTTPサーバーを作成
+    
+    http.serverの読み込みには時間がかかるため、metrics_portを設定した場合だけ読み込む。
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    handler = type('_MetricsHandler', (_MetricsHandlerMixin, BaseHTTPRequestHandler), {})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.registry = registry
+    return server
+
+
+class MetricsExporter:
+    """計測値をHTTP（Prometheus形式）とJSONファイルで公開するクラス"""
+    
+    def __init__(self, registry=None, port=0, host=DEFAULT_METRICS_HOST, stats_path=None,
+                 stats_interval=DEFAULT_STATS_INTERVAL):
+        """
+        Args:
+            registry: 公開するMetrics（省略時はプロセス全体のmetrics）
+            port: Prometheus形式で公開するポート（0で無効）
+            host: 待ち受けるアドレス
+            stats_path: 計測値を書き出すJSONファイル（Noneで無効）
+            stats_interval: JSONファイルを書き出す間隔（秒）
+        """
+        self.registry = registry or metrics
+        self.port = port
+        self.host = host
+        self.stats_path = stats_path
+        self.stats_interval = stats_interval
+        self._server = None
+        self._threads = []
+        self._stop = threading.Event()
+    
+    @classmethod
+    def for_config(cls, config_manager):
+        """設定（[Monitor] セクション）から作成"""
+        stats_file = config_manager.get('Monitor', 'stats_file', '').strip()
+        stats_path = None
+        if stats_file:
+            config_dir = os.path.dirname(os.path.abspath(config_manager.config_path))
+            stats_path = os.path.join(config_dir, stats_file)
+        return cls(
+            port=int(config_manager.get('Monitor', 'metrics_port', '0') or 0),
+            host=config_manager.get('Monitor', 'metrics_host', DEFAULT_METRICS_HOST).strip() or DEFAULT_METRICS_HOST,
+            stats_path=stats_path,
+            stats_interval=float(config_manager.get('Monitor', 'stats_interval', str(DEFAULT_STATS_INTERVAL))),
+        )
+    
+    def start(self):
+        """HTTPサーバーとJSONファイルの書き出しをバックグラウンドスレッドで開始"""
+        self._stop.clear()
+        if self.port:
+            try:
+                self._server = _create_http_server(self.host, self.port, self.registry)
+            except OSError as e:
+                logger.warning(f"計測値の公開を開始できませんでした（{self.host}:{self.port}）: {e}")
+            else:
+                self._start_thread(self._server.serve_forever, 'metrics-http')
+                logger.info(f"計測値を公開します: http://{self.host}:{self.port}/metrics")
+        if self.stats_path:
+            self._start_thread(self._write_periodically, 'metrics-file')
+            logger.info(f"計測値を {self.stats_interval:g}秒ごとに書き出します: {self.stats_path}")
+        return self
+    
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+    
+    def _write_periodically(self):
+        while not self._stop.wait(self.stats_interval):
+            self.write_stats()
+    
+    def write_stats(self):
+        """計測値をJSONファイルに書き出す（一時ファイル経由で置き換え）"""
+        tmp_path = self.stats_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.registry.snapshot(), f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.stats_path)
+        except OSError as e:
+            logger.warning(f"計測値の書き出しに失敗しました: {e}")
+    
+    def stop(self):
+        """公開を終了（JSONファイルは最後の計測値で書き出してから終了する）"""
+        self._stop.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+        if self.stats_path:
+            self.write_stats()
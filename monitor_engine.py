@@ -0,0 +1,193 @@
+"""複数アカウント・複数メールボックスの同時監視モジュール
+
+config.iniに [Watch:<名前>] セクションを追加すると、任意のアカウントの任意のメールボックスを
+それぞれ独自のフィルターで監視できる。[Watch:*] が無い場合は従来通り [Gmail] のINBOXを監視する。
+
+    [Gmail:oncall]
+    email = oncall@example.com
+    password = xxxx
+
+    [Watch:oncall]
+    account = Gmail:oncall
+    mailbox = INBOX, alerts
+    sender_filter = no-reply@example.com
+    keyword_filter = 障害
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from gmail_monitor import GmailMonitor
+from mail_state import MailState, SeenCache
+from message_parser import MessageParser
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+WATCH_SECTION_PREFIX = 'Watch:'
+
+
+def load_watch_targets(config_manager):
+    """設定から監視対象（アカウントセクション, メールボックス, フィルターセクション）の一覧を作成"""
+    targets = []
+    for section in config_manager.get_sections(WATCH_SECTION_PREFIX):
+        account = config_manager.get(section, 'account', 'Gmail').strip() or 'Gmail'
+        mailboxes = config_manager.get(section, 'mailbox', 'INBOX')
+        for mailbox in mailboxes.split(','):
+            mailbox = mailbox.strip()
+            if mailbox:
+                targets.append((account, mailbox, section))
+    
+    if not targets:
+        targets.append(('Gmail', 'INBOX', 'Monitor'))
+    return targets
+
+
+def get_engine_key(config_manager):
+    """監視エンジンを作り直す必要があるかを判定するための、監視対象と接続情報の組
+    
+    設定を読み直した後にこの値が変わっていれば、監視対象（[Watch:*]）か接続情報が変わっている。
+    """
+    targets = load_watch_targets(config_manager)
+    accounts = sorted({account for account, _, _ in targets})
+    return targets, [
+        (account, sorted(config_manager.config[account].items()) if config_manager.config.has_section(account) else None)
+        for account in accounts
+    ]
+
+
+def describe_matches(matched):
+    """一致したメール（MatchResultのリスト）をログ用の文字列にする"""
+    return ', '.join(
+        f"{result.mailbox}: {result.subject}（ルール: {result.rule.name}）" for result in matched
+    )
+
+
+def describe_latency(result):
+    """受信から検出までの遅延をログ用の文字列にする"""
+    latency = result.latency
+    if latency is None:
+        return "受信時刻不明"
+    return f"受信から{latency:.1f}秒（チェック開始から{result.elapsed:.2f}秒）"
+
+
+def get_alert_duration(matched, default):
+    """一致したルールの警告音の秒数（ルールで指定が無ければdefault、複数あれば最長）"""
+    durations = [result.rule.beep_duration for result in matched if result.rule.beep_duration]
+    return max(durations) if durations else default
+
+
+class MonitorEngine:
+    """複数のGmailMonitorをスレッドプールで並行にチェックするクラス
+    
+    1サイクルの所要時間は全メールボックスの合計ではなく、最も遅いメールボックス程度になる。
+    """
+    
+    def __init__(self, config_manager):
+        self.config_manager = config_manager
+        self.state = MailState.for_config(config_manager)
+        self.seen = SeenCache.for_config(config_manager)
+        self.parser = MessageParser.for_config(config_manager)
+        self.monitors = [
+            GmailMonitor(config_manager, self.state, account, mailbox, section, self.seen, self.parser)
+            for account, mailbox, section in load_watch_targets(config_manager)
+        ]
+        # IMAPの接続は監視対象ごとに1本必要なため、監視対象数のスレッドで並行処理する
+        self.executor = ThreadPoolExecutor(
+            max_workers=len(self.monitors), thread_name_prefix='monitor'
+        )
+    
+    def _run_all(self, func):
+        """全監視対象でfuncを並行実行し、(monitor, 結果, 例外) のリストを返す"""
+        futures = [(monitor, self.executor.submit(func, monitor)) for monitor in self.monitors]
+        results = []
+        for monitor, future in futures:
+            try:
+                results.append((monitor, future.result(), None))
+            except Exception as e:
+                results.append((monitor, None, e))
+        return results
+    
+    def connect_all(self):
+        """全監視対象に接続（1つでも失敗したら例外）"""
+        for monitor, _, error in self._run_all(lambda m: m.connect()):
+            if error:
+                self.disconnect_all()
+                raise Exception(f"{monitor.name}: {error}")
+    
+    def disconnect_all(self):
+        """全監視対象の接続を切断"""
+        self._run_all(lambda m: m.disconnect())
+    
+    def check_all(self, first_only=False):
+        """全監視対象を並行にチェック
+        
+        一部のメールボックスでエラーが起きても他の結果は返す（そのメールボックスは切断し、
+        次のサイクルで再接続する）。全てが失敗した場合は例外を送出する。
+        
+        Args:
+            first_only: 各監視対象で最初に合致したメールでチェックを打ち切るか
+        
+        Returns:
+            条件に合致したメールのMatchResultのリスト（監視対象の順）
+        """
+        def check(monitor):
+            monitor.ensure_connected()
+            return monitor.check_new_mail(first_only=first_only)
+        
+        with metrics.span('cycle'):
+            outcomes = self._run_all(check)
+        metrics.increment('cycles')
+        
+        matched = []
+        errors = []
+        for monitor, result, error in outcomes:
+            if error:
+                logger.error("%s のチェックでエラー: %s", monitor.name, error)
+                monitor.disconnect()
+                errors.append(f"{monitor.name}: {error}")
+            else:
+                matched.extend(result)
+        
+        if errors and len(errors) == len(self.monitors):
+            raise Exception(", ".join(errors))
+        return matched
+    
+    def supports_idle(self):
+        """全監視対象がIDLEで待機できるか"""
+        return all(monitor.supports_idle() for monitor in self.monitors)
+    
+    def wait_for_new_mail(self, poll_interval, should_stop=None):
+        """いずれかの監視対象で新着があるか、待機時間が経過するまで待つ
+        
+        各メールボックスは並行にIDLE（非対応ならポーリング）で待機し、
+        どれか1つが戻ったら他の待機も打ち切って次のチェックに進む。
+        """
+        if len(self.monitors) == 1:
+            return self.monitors[0].wait_for_new_mail(poll_interval, should_stop)
+        
+        wake = threading.Event()
+        
+        def interrupted():
+            return wake.is_set() or bool(should_stop and should_stop())
+        
+        def wait(monitor):
+            try:
+                return monitor.wait_for_new_mail(poll_interval, should_stop=interrupted)
+            finally:
+                wake.set()
+        
+        got_mail = False
+        for monitor, result, error in self._run_all(wait):
+            if error:
+                logger.error("%s の待機中にエラー: %s", monitor.name, error)
+                monitor.disconnect()
+            elif result:
+                got_mail = True
+        return got_mail
+    
+    def shutdown(self):
+        """全接続を切断してスレッドプール（と解析用のプロセスプール）を終了"""
+        self.disconnect_all()
+        self.executor.shutdown(wait=False)
+        self.parser.close()
@@ -0,0 +1,159 @@
+"""監視サイクルの待機時間を決めるスケジューラーモジュール
+
+CLIとGUIの監視ループは、チェックの後にAdaptiveScheduler.next_delay()の秒数だけ待機する。
+
+- 条件に合致するメールが届いた直後は間隔を縮め（続報を早く拾う）、しばらく何も無ければ広げる
+- チェックに失敗した場合は指数的に待機時間を延ばし、ジッターでタイミングを散らす
+- 静穏時間帯（夜間など）は最長の間隔でチェックする
+- 次のチェックは時計の区切り（間隔の整数倍の時刻）に合わせるため、チェックにかかった時間が
+  待機時間に積み重なって間隔がずれていくことがない
+
+    [Monitor]
+    check_interval = 60
+    min_check_interval = 15
+    max_check_interval = 300
+    quiet_hours = 23:00-07:00
+"""
+import random
+import time
+from datetime import datetime
+
+# 合致したメールの後、間隔を縮めておく時間（分）
+DEFAULT_ACTIVE_WINDOW_MINUTES = 10
+# 合致したメールが無いまま経過するごとに間隔を倍にする時間（分）
+DEFAULT_IDLE_AFTER_MINUTES = 60
+# チェックに失敗した後の最初の待機時間と上限（秒）
+DEFAULT_RETRY_INTERVAL = 10
+DEFAULT_RETRY_MAX_INTERVAL = 300
+
+
+def _parse_quiet_hours(value):
+    """'23:00-07:00' 形式の静穏時間帯を (開始の分, 終了の分) に変換（未設定ならNone）"""
+    value = (value or '').strip()
+    if not value:
+        return None
+    try:
+        start, end = (part.strip() for part in value.split('-'))
+        minutes = []
+        for text in (start, end):
+            hour, minute = text.split(':')
+            minutes.append(int(hour) * 60 + int(minute))
+    except ValueError:
+        raise ValueError(f"quiet_hours は 23:00-07:00 の形式で指定してください: {value}")
+    return tuple(minutes)
+
+
+class AdaptiveScheduler:
+    """直近の合致・失敗・時間帯から次のチェックまでの待機時間を決めるクラス"""
+    
+    def __init__(self, base_interval=60, min_interval=None, max_interval=None,
+                 active_window=DEFAULT_ACTIVE_WINDOW_MINUTES * 60, idle_after=DEFAULT_IDLE_AFTER_MINUTES * 60,
+                 retry_interval=DEFAULT_RETRY_INTERVAL, retry_max_interval=DEFAULT_RETRY_MAX_INTERVAL,
+                 quiet_hours=None, align=True):
+        """
+        Args:
+            base_interval: 通常のチェック間隔（秒）
+            min_interval: 合致したメールの直後のチェック間隔（秒、省略時はbase_intervalの1/4）
+            max_interval: 最長のチェック間隔（秒、省略時はbase_intervalの5倍）
+            active_window: 合致したメールの後、間隔を縮めておく時間（秒）
+            idle_after: 合致したメールが無いまま経過するごとに間隔を倍にする時間（秒）
+            retry_interval: チェックに失敗した後の最初の待機時間（秒）
+            retry_max_interval: 失敗が続いた場合の待機時間の上限（秒）
+            quiet_hours: 静穏時間帯（'23:00-07:00' 形式、この間は最長の間隔でチェックする）
+            align: 次のチェックを時計の区切り（間隔の整数倍の時刻）に合わせるか
+        """
+        self.base_interval = base_interval
+        self.min_interval = min_interval if min_interval is not None else max(1, base_interval // 4)
+        self.max_interval = max_interval if max_interval is not None else base_interval * 5
+        self.active_window = active_window
+        self.idle_after = idle_after
+        self.retry_interval = retry_interval
+        self.retry_max_interval = retry_max_interval
+        self.quiet_hours = _parse_quiet_hours(quiet_hours)
+        self.align = align
+        self.failures = 0
+        self.last_activity = None
+        self.started = time.time()
+        # 直近のnext_delay()で選んだ間隔の理由（ログ用）
+        self.reason = ''
+    
+    @classmethod
+    def for_config(cls, config_manager):
+        """設定（[Monitor] セクション）からスケジューラーを作成"""
+        def get_int(key):
+            value = config_manager.get('Monitor', key, '').strip()
+            return int(value) if value else None
+        
+        base_interval = get_int('check_interval') or 60
+        return cls(
+            base_interval=base_interval,
+            min_interval=get_int('min_check_interval'),
+            max_interval=get_int('max_check_interval'),
+            retry_max_interval=get_int('retry_max_interval') or DEFAULT_RETRY_MAX_INTERVAL,
+            quiet_hours=config_manager.get('Monitor', 'quiet_hours', ''),
+            align=config_manager.get_bool('Monitor', 'align_checks', True),
+        )
+    
+    def reconfigured(self, config_manager):
+        """設定を読み直した後に使うスケジューラーを作成（直近の合致・失敗の記録は引き継ぐ）"""
+        scheduler = self.for_config(config_manager)
+        scheduler.failures = self.failures
+        scheduler.last_activity = self.last_activity
+        scheduler.started = self.started
+        return scheduler
+    
+    def record_success(self, matched=False, now=None):
+        """チェックに成功したことを記録（matched: 条件に合致するメールがあったか）"""
+        self.failures = 0
+        if matched:
+            self.last_activity = now if now is not None else time.time()
+    
+    def record_failure(self):
+        """チェックに失敗したことを記録"""
+        self.failures += 1
+    
+    def in_quiet_hours(self, now=None):
+        """静穏時間帯か"""
+        if self.quiet_hours is None:
+            return False
+        local = datetime.fromtimestamp(now if now is not None else time.time())
+        minute = local.hour * 60 + local.minute
+        start, end = self.quiet_hours
+        if start <= end:
+            return start <= minute < end
+        # 23:00-07:00 のように日付をまたぐ場合
+        return minute >= start or minute < end
+    
+    def get_interval(self, now=None):
+        """失敗していない場合のチェック間隔（秒）"""
+        now = now if now is not None else time.time()
+        if self.in_quiet_hours(now):
+            self.reason = '静穏時間帯'
+            return self.max_interval
+        if self.last_activity is not None and now - self.last_activity < self.active_window:
+            self.reason = '直近に合致あり'
+            return self.min_interval
+        
+        # 合致したメールが無い時間が長いほど間隔を広げる
+        idle = now - (self.last_activity if self.last_activity is not None else self.started)
+        steps = int(idle // self.idle_after) if self.idle_after > 0 else 0
+        if steps:
+            self.reason = f'{int(idle // 60)}分間合致なし'
+            return min(self.max_interval, self.base_interval * 2 ** min(steps, 16))
+        self.reason = '通常'
+        return self.base_interval
+    
+    def next_delay(self, now=None):
+        """次のチェックまでの待機時間（秒）"""
+        now = now if now is not None else time.time()
+        if self.failures:
+            # 指数バックオフ（待機時間の半分から全体までの間でランダムに散らす）
+            delay = min(self.retry_max_interval, self.retry_interval * 2 ** min(self.failures - 1, 16))
+            self.reason = f'エラー後の再試行（{self.failures}回目）'
+            return random.uniform(delay / 2, delay)
+        
+        interval = self.get_interval(now)
+        if not self.align:
+            return interval
+        # 間隔の整数倍の時刻に合わせる（チェックにかかった時間の分だけずれていかない）
+        return interval - now % interval
@@ -0,0 +1,102 @@
+"""起動時のimportにかかる時間の計測モジュール（--profile-startup）
+
+起動モードで読み込むモジュールを別のPythonプロセスで `python -X importtime` として読み込み、
+モジュールごとのimportの時間（自身・配下を含む累計）を集計して表示する。別のプロセスで計測するため、
+このプロセスで読み込み済みのモジュールに左右されず、実際の起動と同じ条件の値になる。
+
+警告音を初めて鳴らすときに読み込むモジュール（numpy・simpleaudio）の時間も別に計測する。
+
+    python main.py cli --profile-startup
+    python main.py daemon --profile-startup
+"""
+import os
+import subprocess
+import sys
+
+# 起動モードごとに読み込むモジュール
+MODE_MODULES = {
+    'gui': ('tkinter', 'ui'),
+    'cli': ('cli',),
+    'daemon': ('daemon',),
+    'ctl': ('daemon',),
+}
+
+# 警告音を初めて鳴らすときの読み込み
+FIRST_ALERT_STATEMENT = 'import utils; utils._load_numpy(); utils._load_simpleaudio()'
+
+# 必要になるまで読み込まないモジュール
+DEFERRED_MODULES = ('numpy', 'simpleaudio', 'tkinter', 'asyncio', 'http.server')
+
+# 表示するモジュールの数（累計の時間が長い順）
+DEFAULT_TOP = 15
+
+_IMPORT_TIME_PREFIX = 'import time:'
+
+
+def measure_imports(statement):
+    """別のプロセスでstatementを -X importtime 付きで実行し、importの時間を集計
+    
+    Returns:
+        (モジュール名, ネストの深さ, 自身のマイクロ秒, 累計のマイクロ秒) のリスト（読み込みが終わった順）
+    """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    lines = completed.stderr.splitlines()
+    if completed.returncode != 0:
+        errors = [line for line in lines if not line.startswith(_IMPORT_TIME_PREFIX)]
+        raise RuntimeError(errors[-1] if errors else f"終了コード {completed.returncode}")
+    
+    entries = []
+    for line in lines:
+        if not line.startswith(_IMPORT_TIME_PREFIX):
+            continue
+        fields = line[len(_IMPORT_TIME_PREFIX):].split('|')
+        # 見出しの行（self [us] | cumulative | imported package）は飛ばす
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        # モジュール名の前の空白は1つ + ネストの深さごとに2つ
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), depth, int(fields[0]), int(fields[1])))
+    return entries
+
+
+def _format_ms(microseconds):
+    return f'{microseconds / 1000:.1f}ms'
+
+
+def profile_startup(mode, top=DEFAULT_TOP):
+    """起動モードのimportにかかる時間を表示"""
+    modules = MODE_MODULES[mode]
+    try:
+        entries = measure_imports('; '.join(f'import {module}' for module in modules))
+    except RuntimeError as e:
+        print(f"{mode}モードのモジュールを読み込めませんでした: {e}", file=sys.stderr)
+        return False
+    
+    total = sum(cumulative for _, depth, _, cumulative in entries if depth == 0)
+    print(f"起動時のimport（{mode}モード）: {len(entries)}モジュール, 合計 {_format_ms(total)}")
+    print(f"  {'累計':>8}  {'自身':>8}  モジュール")
+    for name, depth, self_time, cumulative in sorted(entries, key=lambda entry: entry[3], reverse=True)[:top]:
+        print(f"  {_format_ms(cumulative):>10}  {_format_ms(self_time):>10}  {'  ' * depth}{name}")
+    
+    loaded = {name for name, _, _, _ in entries}
+    print()
+    print("必要になるまで読み込まないモジュール:")
+    for name in DEFERRED_MODULES:
+        print(f"  {name}: {'起動時に読み込み' if name in loaded else '読み込まない'}")
+    
+    print()
+    try:
+        alert_entries = measure_imports(FIRST_ALERT_STATEMENT)
+    except RuntimeError as e:
+        print(f"初回の警告音で読み込むモジュール: 読み込めませんでした（{e}）")
+        return True
+    costs = [(name, cumulative) for name, depth, _, cumulative in alert_entries
+             if depth == 0 and name in ('numpy', 'simpleaudio')]
+    print("初回の警告音で読み込むモジュール: " + ', '.join(f"{name} {_format_ms(cumulative)}" for name, cumulative in costs))
+    return True
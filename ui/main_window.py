@@ -4,9 +4,12 @@ from tkinter import ttk, messagebox
 import threading
 import logging
 
-from config_manager import ConfigManager
-from gmail_monitor import GmailMonitor
-from utils import play_beep
+from alert_player import AlertPlayer
+from config_manager import ConfigManager, ConfigWatcher
+from metrics import MetricsExporter
+from monitor_engine import MonitorEngine, describe_latency, describe_matches, get_alert_duration, get_engine_key
+from scheduler import AdaptiveScheduler
+from utils import get_waveform_cache_dir
 from .settings_window import SettingsWindow
 
 logger = logging.getLogger(__name__)
@@ -18,19 +21,20 @@ class MailBeepApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Gmail監視ビープアプリ")
-        self.root.geometry("400x250")
+        self.root.geometry("400x290")
         self.root.resizable(False, False)
         
         # 設定管理
         self.config_manager = ConfigManager()
         
-        # Gmail監視
-        self.gmail_monitor = GmailMonitor(self.config_manager)
+        # Gmail監視（設定保存後や監視開始時に作り直す）
+        self.engine = None
         
         # 監視状態
         self.is_monitoring = False
         self.monitor_thread = None
         self.stop_event = threading.Event()
+        self.alert_player = None
         self.beep_count = 0
         
         # GUI作成
@@ -57,6 +61,10 @@ class MailBeepApp:
         self.count_label = ttk.Label(main_frame, text="ビープ回数: 0回", font=('', 12))
         self.count_label.pack(pady=10)
         
+        # 最後に条件に合致したメールの表示
+        self.last_match_label = ttk.Label(main_frame, text="最新の一致: なし", wraplength=360)
+        self.last_match_label.pack()
+        
         # ボタンフレーム
         button_frame = ttk.Frame(main_frame)
         button_frame.pack(pady=20)
@@ -105,21 +113,44 @@ class MailBeepApp:
             messagebox.showerror("エラー", "先に設定を行ってください")
             return
         
-        # 接続テスト
+        # 前回の監視スレッドが残っていれば終了を待つ（セッションの競合を防ぐ）
+        if self.monitor_thread and self.monitor_thread.is_alive():
+            self.monitor_thread.join(timeout=3)
+        
+        # 接続テスト（成功した接続はそのまま監視セッションとして使い回す）
+        engine = None
         try:
             logger.info("接続テスト開始")
-            self.gmail_monitor.connect()
-            self.gmail_monitor.disconnect()
+            engine = MonitorEngine(self.config_manager)
+            engine.connect_all()
             logger.info("接続テスト成功")
         except Exception as e:
             logger.error(f"接続テスト失敗: {e}")
+            if engine:
+                engine.shutdown()
+            self.engine = None
             messagebox.showerror("接続エラー", str(e))
             return
+        self.engine = engine
+        
+        # 警告音は別スレッドで再生し、鳴っている間もメールのチェックを続ける
+        waveform_cache_dir = get_waveform_cache_dir(self.config_manager)
+        if self.alert_player:
+            self.alert_player.close()
+        # 波形は再生用のスレッドで先に用意しておく（最初の警告から生成待ちなしで鳴らすため）
+        beep_duration = float(self.config_manager.get('Sound', 'beep_duration', '10'))
+        self.alert_player = AlertPlayer(beep_duration, waveform_cache_dir, prepare=True)
         
         # 監視開始
+        # 前回の監視スレッドがまだ終わっていなくても干渉しないよう、エンジン・警告音・停止イベントは
+        # スレッドごとに渡す（self の属性は次に監視を開始したときに置き換わる）
         self.is_monitoring = True
-        self.stop_event.clear()
-        self.monitor_thread = threading.Thread(target=self._monitor_loop, daemon=True)
+        self.stop_event = threading.Event()
+        self.monitor_thread = threading.Thread(
+            target=self._monitor_loop,
+            args=(engine, self.alert_player, self.stop_event),
+            daemon=True,
+        )
         self.monitor_thread.start()
         
         logger.info("監視を開始しました")
@@ -134,48 +165,86 @@ class MailBeepApp:
         self.is_monitoring = False
         self.stop_event.set()
         
+        # 再生中の警告音もすぐに止める
+        if self.alert_player:
+            self.alert_player.stop()
+        
         # UI更新
         self.start_stop_button.config(text="開始")
         self.status_label.config(text="ステータス: 停止中")
         logger.info("監視を停止しました")
     
-    def _monitor_loop(self):
+    def _monitor_loop(self, engine, alert_player, stop_event):
         """監視ループ（別スレッドで実行）"""
-        check_interval = int(self.config_manager.get('Monitor', 'check_interval', '60'))
-        time_window_minutes = int(self.config_manager.get('Monitor', 'time_window_minutes', '2'))
-        logger.info(f"監視ループ開始 (チェック間隔: {check_interval}秒, 時間範囲: {time_window_minutes}分)")
+        logger.info("監視ループ開始")
+        scheduler = AdaptiveScheduler.for_config(self.config_manager)
+        # 計測値の公開（[Monitor] の metrics_port / stats_file を設定した場合）
+        exporter = MetricsExporter.for_config(self.config_manager).start()
+        # 監視中に設定ファイルが書き換えられたら読み直す（次のサイクルから反映）
+        watcher = ConfigWatcher.for_config(self.config_manager).start()
+        applied_snapshot = None
+        engine_key = get_engine_key(self.config_manager)
         
-        while not self.stop_event.is_set():
+        while not stop_event.is_set():
             try:
                 logger.info("=" * 50)
                 logger.info("新しい監視サイクル開始")
                 
-                # Gmail接続
-                self.gmail_monitor.connect()
+                # 設定が読み直されていれば、監視対象とチェック間隔を反映
+                snapshot = self.config_manager.snapshot
+                if snapshot is not applied_snapshot:
+                    # 監視対象（[Watch:*]）か接続情報が変わった場合だけ、監視エンジンを作り直して接続し直す
+                    new_engine_key = get_engine_key(self.config_manager)
+                    if new_engine_key != engine_key:
+                        engine.shutdown()
+                        engine = MonitorEngine(self.config_manager)
+                        # 監視を開始し直していなければ、終了時に閉じられるよう新しいエンジンを保持する
+                        if stop_event is self.stop_event:
+                            self.engine = engine
+                        engine_key = new_engine_key
+                        logger.info(f"監視対象を変更しました: {', '.join(monitor.name for monitor in engine.monitors)}")
+                    scheduler = scheduler.reconfigured(self.config_manager)
+                    logger.info(f"チェック間隔: {snapshot.check_interval}秒, 時間範囲: {snapshot.time_window_minutes}分")
+                    applied_snapshot = snapshot
                 
-                # メールチェック（時間範囲を指定）
-                if self.gmail_monitor.check_new_mail(time_window_minutes=time_window_minutes):
+                # 全監視対象を並行にチェック（接続済みならセッションを再利用）
+                matched = engine.check_all()
+                scheduler.record_success(bool(matched))
+                if matched:
                     # 条件に合致するメールあり
-                    logger.info("条件に合致するメールが見つかりました！ビープ音を再生します")
-                    # 設定からビープ音の秒数を取得
-                    beep_duration = float(self.config_manager.get('Sound', 'beep_duration', '10'))
-                    play_beep(duration=beep_duration)
-                    self.beep_count += 1
-                    self._update_count_label()
-                    logger.info(f"ビープ回数: {self.beep_count}")
+                    logger.info(f"条件に合致するメールが見つかりました！ビープ音を再生します: {describe_matches(matched)}")
+                    for result in matched:
+                        logger.info(f"  {result.mailbox} UID {result.uid}: {result.sender} - {describe_latency(result)}")
+                    self._update_last_match_label(matched[-1])
+                    # 設定からビープ音の秒数を取得（ルールで指定があればその秒数）
+                    if alert_player.play(duration=get_alert_duration(matched, snapshot.beep_duration)):
+                        self.beep_count += 1
+                        self._update_count_label()
+                        logger.info(f"ビープ回数: {self.beep_count}")
                 
-                # 切断
-                self.gmail_monitor.disconnect()
+                delay = scheduler.next_delay()
+                if engine.supports_idle():
+                    logger.info(f"IDLEで新着メールを待機します（最長 {delay:.0f}秒、{scheduler.reason}）")
+                else:
+                    logger.info(f"次のチェックまで {delay:.0f}秒 待機します（{scheduler.reason}）")
                 
-                logger.info(f"次のチェックまで {check_interval}秒 待機します")
+                # IDLEで新着を待つか、指定間隔待機（中断可能）
+                engine.wait_for_new_mail(delay, should_stop=stop_event.is_set)
                 
             except Exception as e:
                 logger.error(f"監視エラー: {e}")
-                # エラーが発生してもループを継続
-            
-            # 指定間隔待機（中断可能）
-            self.stop_event.wait(check_interval)
+                # エラーが発生してもループを継続（接続は次のサイクルで張り直す）
+                engine.disconnect_all()
+                # エラーが続くほど待機時間を延ばす
+                scheduler.record_failure()
+                delay = scheduler.next_delay()
+                logger.info(f"{delay:.0f}秒後に再試行します（{scheduler.reason}）")
+                stop_event.wait(delay)
         
+        watcher.stop()
+        alert_player.stop()
+        engine.shutdown()
+        exporter.stop()
         logger.info("監視ループを終了しました")
     
     def _update_count_label(self):
@@ -183,11 +252,22 @@ class MailBeepApp:
         # メインスレッドで実行
         self.root.after(0, lambda: self.count_label.config(text=f"ビープ回数: {self.beep_count}回"))
     
+    def _update_last_match_label(self, result):
+        """最新の一致ラベルを更新"""
+        text = f"最新の一致: {result.subject}（{result.sender}、ルール: {result.rule.name}）"
+        self.root.after(0, lambda: self.last_match_label.config(text=text))
+    
     def on_closing(self):
         """アプリ終了時の処理"""
         if self.is_monitoring:
             self._stop_monitoring()
-        self.gmail_monitor.disconnect()
+            # 監視スレッドがIDLEを終了して切断するのを待つ
+            if self.monitor_thread:
+                self.monitor_thread.join(timeout=3)
+        elif self.engine:
+            self.engine.shutdown()
+        if self.alert_player:
+            self.alert_player.close()
         self.root.destroy()
 
 
@@ -1,11 +1,46 @@
-"""ユーティリティ関数モジュール"""
+"""ユーティリティ関数モジュール
+
+numpyとsimpleaudioは警告音の波形を用意するとき・鳴らすときに初めて読み込む。
+警告音を鳴らさずに終わる実行（--onceでの定期実行など）では読み込まないため、起動が速くなる。
+"""
+import atexit
+import functools
 import logging
-import numpy as np
-import simpleaudio as sa
+import logging.handlers
+import math
+import os
+import queue
+import time
+
+# 初回の使用時に読み込むモジュール（_load_numpy / _load_simpleaudio）
+np = None
+sa = None
+
 
+# キュー経由でログを出力する場合のリスナー（setup_logging(use_queue=True)で作成）
+_log_listener = None
 
-def setup_logging(level=logging.INFO):
-    """ロギング設定を初期化"""
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """ログの記録をそのままキューに入れるハンドラー
+    
+    標準のQueueHandlerはキューに入れる前に呼び出し元のスレッドでメッセージを整形するが、
+    ここでは整形もリスナーのスレッドで行う（キューは同じプロセス内でしか使わないため、
+    引数をそのまま渡せる）。
+    """
+    
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level=logging.INFO, use_queue=False):
+    """ロギング設定を初期化
+    
+    Args:
+        level: ログレベル
+        use_queue: ログの整形と出力を専用のスレッドで行うか（監視スレッドは記録をキューに入れるだけになる）
+    """
+    global _log_listener
     root_logger = logging.getLogger()
     root_logger.setLevel(level)
     
@@ -14,60 +49,284 @@ def setup_logging(level=logging.INFO):
         handler = logging.StreamHandler()
         formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         handler.setFormatter(formatter)
-        root_logger.addHandler(handler)
+        if not use_queue:
+            root_logger.addHandler(handler)
+            return
+        
+        log_queue = queue.SimpleQueue()
+        _log_listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+        _log_listener.start()
+        root_logger.addHandler(_DeferredQueueHandler(log_queue))
+        # 終了時にキューに残っているログを出力する
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """キュー経由のログ出力を終了（キューに残っているログは出力してから戻る）"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
 
 
 logger = logging.getLogger(__name__)
 
 
-def play_beep(duration=10.0):
-    """警告音を生成して鳴らす（低音で音量が変動する警告を煽る音）
+# 警告音のサンプリングレート
+SAMPLE_RATE = 44100
+
+# 最後にフェードアウトさせる秒数
+FADE_SECONDS = 0.3
+
+# これより長い警告音はストリーミング合成で鳴らす（メモリ使用量を秒数によらず一定にする）
+STREAMING_THRESHOLD_SECONDS = 30.0
+
+# ストリーミング合成で1回に再生するブロックの長さの目安（秒）
+STREAM_BLOCK_SECONDS = 1.0
+
+# 波形キャッシュ（.npy）を保存するディレクトリ名（config.iniと同じ場所に作成）
+WAVEFORM_CACHE_DIRNAME = 'waveform_cache'
+
+
+def _load_numpy():
+    """numpyを読み込む（読み込み済みなら何もしない）"""
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+
+def _load_simpleaudio():
+    """simpleaudioを読み込む（読み込み済みなら何もしない）"""
+    global sa
+    if sa is None:
+        import simpleaudio
+        sa = simpleaudio
+    return sa
+
+
+def get_waveform_cache_dir(config_manager):
+    """波形をディスクにキャッシュする場合の保存先（[Sound] waveform_cache が無効ならNone）"""
+    if not config_manager.get_bool('Sound', 'waveform_cache', False):
+        return None
+    config_dir = os.path.dirname(os.path.abspath(config_manager.config_path))
+    return os.path.join(config_dir, WAVEFORM_CACHE_DIRNAME)
+
+
+def _synthesize_note(t, frequency, tremolo_frequency):
+    """時刻t（秒の配列）の警告音の波形を生成（フェードアウト・正規化の前）"""
+    # 基本のサイン波を生成
+    note = np.sin(frequency * t * 2 * np.pi)
+    
+    # 倍音を追加して厚みのある音に（2倍音を少し混ぜる）
+    note += 0.3 * np.sin(2 * frequency * t * 2 * np.pi)
+    
+    # 音量を変動させる（tremolo_frequency Hzで変動 = サイレンのような効果）
+    tremolo = 0.5 + 0.5 * np.sin(tremolo_frequency * t * 2 * np.pi)
+    return note * tremolo
+
+
+def _to_int16(note):
+    """波形を16ビット整数に変換（最大振幅で正規化）"""
+    # 音量を調整（0.4 = 40%の音量）
+    note = note * 0.4
+    
+    audio = note * (2**15 - 1) / np.max(np.abs(note))
+    return audio.astype(np.int16)
+
+
+def _fade_out(audio):
+    """最後のFADE_SECONDS秒をフェードアウトさせる（配列をその場で変更）"""
+    fade_samples = min(int(SAMPLE_RATE * FADE_SECONDS), len(audio))
+    if fade_samples:
+        audio[-fade_samples:] = audio[-fade_samples:] * np.linspace(1, 0, fade_samples)
+    return audio
+
+
+def _synthesize_beep(duration, frequency, tremolo_frequency):
+    """警告音の波形を生成（低音で音量が変動する警告を煽る音）"""
+    _load_numpy()
+    # 時間軸を生成
+    t = np.linspace(0, duration, int(SAMPLE_RATE * duration), False)
+    note = _synthesize_note(t, frequency, tremolo_frequency)
+    
+    # 最後にフェードアウト
+    note = _fade_out(note)
+    
+    # 16ビット整数に変換
+    return _to_int16(note)
+
+
+def _period_samples(frequency, tremolo_frequency):
+    """波形が繰り返す周期（サンプル数）。整数サンプルで繰り返さない場合はNone
+    
+    基本波・2倍音・トレモロはいずれも gcd(frequency, tremolo_frequency) Hz の整数倍のため、
+    波形はその逆数の周期で繰り返す（300Hz・6Hzなら1/6秒 = 7350サンプル）。
+    """
+    if not (float(frequency).is_integer() and float(tremolo_frequency).is_integer()):
+        return None
+    repeat_hz = math.gcd(int(frequency), int(tremolo_frequency))
+    if repeat_hz == 0 or SAMPLE_RATE % repeat_hz:
+        return None
+    return SAMPLE_RATE // repeat_hz
+
+
+@functools.lru_cache(maxsize=8)
+def get_loop_block(frequency=300, tremolo_frequency=6):
+    """ストリーミング再生で繰り返し鳴らすブロック（int16、周期の整数倍で約STREAM_BLOCK_SECONDS秒）
+    
+    ブロックはトレモロの谷（音量がほぼ0）から始まるため、ブロックを続けて再生したときの
+    つなぎ目は無音の位置になる。周期が整数サンプルにならない場合はNone。
+    """
+    period = _period_samples(frequency, tremolo_frequency)
+    if period is None:
+        return None
+    _load_numpy()
+    periods = max(1, round(SAMPLE_RATE * STREAM_BLOCK_SECONDS / period))
+    start = round(0.75 * SAMPLE_RATE / tremolo_frequency)
+    t = (start + np.arange(periods * period)) / SAMPLE_RATE
+    # ブロックは周期の整数倍なので、最大振幅（正規化の基準）は全体を生成した場合と同じ
+    audio = _to_int16(_synthesize_note(t, frequency, tremolo_frequency))
+    audio.flags.writeable = False
+    return audio
+
+
+def _load_waveform(path, duration):
+    """保存済みの波形をメモリマップで読み込む（壊れている・長さが違う場合はNone）"""
+    _load_numpy()
+    try:
+        audio = np.load(path, mmap_mode='r')
+    except (OSError, ValueError) as e:
+        logger.warning(f"波形キャッシュの読み込みに失敗しました: {e}")
+        return None
+    if audio.dtype != np.int16 or audio.shape != (int(SAMPLE_RATE * duration),):
+        logger.warning(f"波形キャッシュが不正なため作り直します: {path}")
+        return None
+    return audio
+
+
+def _save_waveform(path, audio):
+    """波形を.npyとして保存（一時ファイル経由で置き換え）"""
+    tmp_path = path + '.tmp.npy'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.save(tmp_path, audio)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"波形キャッシュの保存に失敗しました: {e}")
+
+
+@functools.lru_cache(maxsize=8)
+def get_beep_waveform(duration=10.0, frequency=300, tremolo_frequency=6, cache_dir=None):
+    """警告音の波形（int16）を取得
+    
+    パラメーターごとに一度だけ生成してメモリ上にキャッシュするため、2回目以降の警告は
+    波形の生成（数MBの一時配列の確保）なしですぐに再生できる。
+    cache_dirを指定すると波形を.npyとして保存し、次回起動時はメモリマップで読み込む。
+    返す配列は共有されるため読み取り専用。
+    """
+    path = None
+    if cache_dir:
+        filename = f'beep_{duration:g}s_{frequency:g}hz_{tremolo_frequency:g}hz_{SAMPLE_RATE}.npy'
+        path = os.path.join(cache_dir, filename)
+        if os.path.exists(path):
+            audio = _load_waveform(path, duration)
+            if audio is not None:
+                logger.debug(f"波形キャッシュを読み込みました: {path}")
+                return audio
+    
+    logger.debug(f"警告音の波形を生成します: {duration}秒, {frequency}Hz, トレモロ{tremolo_frequency}Hz")
+    audio = _synthesize_beep(duration, frequency, tremolo_frequency)
+    audio.flags.writeable = False
+    if path:
+        _save_waveform(path, audio)
+    return audio
+
+
+def _use_streaming(duration, frequency=300, tremolo_frequency=6):
+    """ストリーミング合成で鳴らすか（長い警告音で、波形が整数サンプルで繰り返す場合）"""
+    return duration > STREAMING_THRESHOLD_SECONDS and _period_samples(frequency, tremolo_frequency) is not None
+
+
+def prepare_beep(duration=10.0, cache_dir=None):
+    """警告音の波形を事前に用意（起動後に呼んでおくと最初の警告も遅延なく鳴る）
+    
+    numpyとsimpleaudioの読み込みもここで済ませる。
+    """
+    try:
+        if _use_streaming(float(duration)):
+            get_loop_block()
+        else:
+            get_beep_waveform(float(duration), cache_dir=cache_dir)
+        _load_simpleaudio()
+    except Exception as e:
+        logger.warning(f"警告音の準備に失敗しました: {e}")
+
+
+def _play_buffer(audio, stop_event=None):
+    """バッファを再生し、鳴り終わる時刻まで待つ
+    
+    Returns:
+        最後まで再生した場合はTrue、stop_eventで中断した場合はFalse
+    """
+    play_obj = _load_simpleaudio().play_buffer(audio, 1, 2, SAMPLE_RATE)
+    # is_playing()のポーリングではブロック間に隙間ができるため、鳴り終わる時刻を計算して待つ
+    end = time.monotonic() + len(audio) / SAMPLE_RATE
+    while True:
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            return True
+        if stop_event is None:
+            time.sleep(remaining)
+        elif stop_event.wait(remaining):
+            play_obj.stop()
+            return False
+
+
+def _stream_beep(duration, frequency=300, tremolo_frequency=6, stop_event=None):
+    """周期に揃えたブロックを繰り返し再生して警告音を鳴らす
+    
+    メモリ使用量はブロック1つ分（と最後のブロック）で、警告音の長さによらず一定。
+    フェードアウトは最後のブロックにだけかける。
+    """
+    block = get_loop_block(frequency, tremolo_frequency)
+    remaining = int(SAMPLE_RATE * duration)
+    fade_samples = int(SAMPLE_RATE * FADE_SECONDS)
+    
+    # 最後のブロックがフェードアウト分より短くならないよう、余りは最後にまとめる
+    while remaining > len(block) + fade_samples:
+        if not _play_buffer(block, stop_event):
+            return
+        remaining -= len(block)
+    
+    if remaining > 0:
+        # 周期の整数倍ごとに繰り返すブロックを必要な長さまで延ばす
+        _play_buffer(_fade_out(np.resize(block, remaining)), stop_event)
+
+
+def play_beep(duration=10.0, cache_dir=None, stop_event=None, streaming=None):
+    """警告音を鳴らす（低音で音量が変動する警告を煽る音）
     
     Args:
         duration: 音の持続時間（秒）デフォルトは10秒
+        cache_dir: 波形キャッシュ（.npy）の保存先（省略時はメモリ上のみ）
+        stop_event: セットされると再生を途中で止めるthreading.Event
+        streaming: ストリーミング合成で鳴らすか（省略時はSTREAMING_THRESHOLD_SECONDS秒より長い場合）
     """
     try:
-        # サンプリングレート
-        sample_rate = 44100
-        
-        # 基本周波数（Hz）- 300Hzの低めの警告音
-        frequency = 300
-        
-        # 時間軸を生成
-        t = np.linspace(0, duration, int(sample_rate * duration), False)
-        
-        # 基本のサイン波を生成
-        note = np.sin(frequency * t * 2 * np.pi)
-        
-        # 倍音を追加して厚みのある音に（2倍音を少し混ぜる）
-        note += 0.3 * np.sin(2 * frequency * t * 2 * np.pi)
-        
-        # 音量を変動させる（6Hzで変動 = サイレンのような効果）
-        tremolo_frequency = 6
-        tremolo = 0.5 + 0.5 * np.sin(tremolo_frequency * t * 2 * np.pi)
-        note = note * tremolo
-        
-        # 最後にフェードアウト
-        fade_samples = int(sample_rate * 0.3)
-        envelope = np.ones_like(note)
-        envelope[-fade_samples:] = np.linspace(1, 0, fade_samples)
-        note = note * envelope
-        
-        # 音量を調整（0.4 = 40%の音量）
-        note = note * 0.4
-        
-        # 16ビット整数に変換
-        audio = note * (2**15 - 1) / np.max(np.abs(note))
-        audio = audio.astype(np.int16)
+        duration = float(duration)
+        if streaming is None:
+            streaming = _use_streaming(duration)
         
         # 再生
-        logger.info("警告音を生成して再生します")
-        play_obj = sa.play_buffer(audio, 1, 2, sample_rate)
-        play_obj.wait_done()  # 再生が終わるまで待つ
+        logger.info("警告音を再生します")
+        if streaming:
+            _stream_beep(duration, stop_event=stop_event)
+        else:
+            _play_buffer(get_beep_waveform(duration, cache_dir=cache_dir), stop_event)
         
     except Exception as e:
         logger.error(f"ビープ音の生成/再生エラー: {e}")
         # フォールバック: ターミナルベル
         print('\a', flush=True)
-
-